@@ -6,6 +6,8 @@ from click import Context
 import scrywarden.database as db
 from scrywarden.curator import Curator
 from scrywarden.investigator.base import parse_investigators
+from scrywarden.migrations import migrate
+from scrywarden.partitioning import parse_partitioning
 from scrywarden.profile.base import sync_profiles
 from scrywarden.profile.config import parse_profiles
 from scrywarden.pipline.base import Pipeline
@@ -30,10 +32,15 @@ def main(ctx: Context, **kwargs):
 def setup(ctx: Context):
     config = parse_config(ctx.obj['config_file'])
     engine = db.parse_engine(config.get('database', {}))
+    partitioning = parse_partitioning(config.get('database', {}))
     configure_logging(config.get('logging'))
-    db.migrate(engine)
+    migrate(engine, partitioning)
     ctx.obj['config'] = config
+    ctx.obj['partitioning'] = partitioning
     ctx.obj['session_factory'] = db.create_session_factory(engine)
+    ctx.obj['replica'] = db.parse_replica(
+        config.get('database', {}), ctx.obj['session_factory'],
+    )
 
 
 @main.command()
@@ -51,7 +58,10 @@ def collect(ctx: Context):
         ctx.obj['session_factory'], expire_on_commit=False,
     ) as session:
         sync_profiles(session, profiles)
-    pipeline = Pipeline(transports, profiles, ctx.obj['session_factory'])
+    pipeline = Pipeline(
+        transports, profiles, ctx.obj['session_factory'],
+        partitioning=ctx.obj['partitioning'],
+    )
     pipeline.configure(config.get('pipeline'))
     pipeline.start()
 
@@ -66,7 +76,9 @@ def investigate(ctx: Context):
     shippers = parse_shippers(config['shippers']).values()
     curator = Curator(
         investigators, shippers, session_factory=ctx.obj['session_factory'],
+        replica=ctx.obj['replica'],
     )
+    curator.configure(config.get('curator'))
     curator.start()
 
 
@@ -3,13 +3,16 @@ import threading
 import typing as t
 import queue as q
 
+import numpy as np
 from pandas import DataFrame
 from sqlalchemy.orm import sessionmaker
 
+from scrywarden.config import parsers, Config
 from scrywarden.curator.entry import CuratorEntry
-from scrywarden.database import Investigation
+from scrywarden.database import Investigation, Replica
 from scrywarden.entry import Entry
 from scrywarden.investigator.base import Investigator
+from scrywarden.investigator.scheduler import InvestigationScheduler
 from scrywarden.investigator.entry import InvestigatorEntry
 from scrywarden.shipper import Shipper
 from scrywarden.timing import ExponentialBackoff
@@ -17,6 +20,44 @@ from scrywarden.timing import ExponentialBackoff
 logger = logging.getLogger(__name__)
 
 
+def freeze(frame: DataFrame) -> DataFrame:
+    """Makes the data buffers of a dataframe read-only in place.
+
+    Frozen dataframes can be shared between threads without copying since
+    any attempt to write into their buffers raises a ValueError instead of
+    changing the data the other threads see. Assigning a column of a frozen
+    dataframe, or of a shallow copy of it, may write into those buffers
+    too, so the dataframe has to be copied before assigning any column.
+
+    The blocks are reached through pandas internals, since pandas has no
+    public API for read-only dataframes.
+
+    Parameters
+    ----------
+    frame: DataFrame
+        Dataframe to freeze.
+
+    Returns
+    -------
+    DataFrame
+        The same dataframe with read-only buffers.
+    """
+    manager = getattr(frame, '_mgr', None)
+    if manager is None:
+        manager = frame._data
+    for block in manager.blocks:
+        values = block.values
+        if not isinstance(values, np.ndarray):
+            # Extension arrays such as timezone aware datetimes wrap a numpy
+            # array.
+            values = getattr(
+                values, '_ndarray', getattr(values, '_data', None),
+            )
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+    return frame
+
+
 class Curator:
     """Coordinates the investigation phase of anomaly detection.
 
@@ -36,22 +77,77 @@ class Curator:
         and the curator.
     session_factory: Optional[sessionmaker]
         SQLAlchemy session factory.
+    replica: Optional[Replica]
+        Read replica the investigators collect and analyze anomalies from.
+    workers: int
+        Number of worker threads to run investigations on. Defaults to 0,
+        which runs every investigator in its own thread. Otherwise the
+        investigators are run by an `InvestigationScheduler`.
+    processes: int
+        Number of processes the scheduler runs analyzers in. Defaults to 0,
+        which runs analyzers in the worker threads.
+    interval: float
+        Number of seconds the scheduler waits before checking an idle
+        profile for anomalies again.
+    prefetch: int
+        Number of pages each investigator thread collects ahead of the
+        analysis. Defaults to 0, which does not prefetch. Only used when
+        not running on a worker pool.
     """
+    PARSER = parsers.Options({
+        'queue_size': parsers.Integer(),
+        'workers': parsers.Integer(),
+        'processes': parsers.Integer(),
+        'interval': parsers.Float(),
+        'prefetch': parsers.Integer(),
+    })
+
     def __init__(
         self,
         investigators: t.Iterable[Investigator] = (),
         shippers: t.Iterable[Shipper] = (),
         queue_size: int = 10,
         session_factory: t.Optional[sessionmaker] = None,
+        replica: t.Optional[Replica] = None,
+        workers: int = 0,
+        processes: int = 0,
+        interval: float = 1.0,
+        prefetch: int = 0,
     ):
         self.investigators: t.List[Investigator] = list(investigators)
         self.shippers: t.List[Shipper] = list(shippers)
         self.queue_size: int = queue_size
         self.session_factory: t.Optional[sessionmaker] = session_factory
+        self.replica: t.Optional[Replica] = replica
+        self.workers: int = workers
+        self.processes: int = processes
+        self.interval: float = interval
+        self.prefetch: int = prefetch
         self._queue: 't.Optional[q.Queue[Entry]]' = None
         self._investigator_shutdown: threading.Event = threading.Event()
         self._shipper_shutdown: threading.Event = threading.Event()
 
+    def configure(self, config: Config) -> Config:
+        """Configures the curator according to the YAML config.
+
+        Parameters
+        ----------
+        config: Config
+            Configuration object to pull values from.
+
+        Returns
+        -------
+        Config
+            Parsed configuration object.
+        """
+        config = config.parse(self.PARSER)
+        self.queue_size = config.get_value('queue_size', self.queue_size)
+        self.workers = config.get_value('workers', self.workers)
+        self.processes = config.get_value('processes', self.processes)
+        self.interval = config.get_value('interval', self.interval)
+        self.prefetch = config.get_value('prefetch', self.prefetch)
+        return config
+
     def start(self) -> None:
         """Starts the curator process.
 
@@ -69,8 +165,20 @@ class Curator:
         for investigator in self.investigators:
             investigator.queue = self._queue
             investigator.session_factory = self.session_factory
+            investigator.replica = self.replica
             investigator.shutdown = self._investigator_shutdown
-            investigator.start()
+            investigator.prefetch = self.prefetch
+        scheduler: t.Optional[InvestigationScheduler] = None
+        if self.workers:
+            scheduler = InvestigationScheduler(
+                self.investigators, workers=self.workers,
+                processes=self.processes, interval=self.interval,
+                shutdown=self._investigator_shutdown,
+            )
+            scheduler.start()
+        else:
+            for investigator in self.investigators:
+                investigator.start()
         try:
             while not self._investigator_shutdown.is_set():
                 self._pull_entry()
@@ -80,8 +188,11 @@ class Curator:
             logger.warning("Received system exit")
         logger.info("Shutting down curator")
         self._investigator_shutdown.set()
-        for investigator in self.investigators:
-            investigator.join()
+        if scheduler is not None:
+            scheduler.join()
+        else:
+            for investigator in self.investigators:
+                investigator.join()
         while not self._queue.empty():
             self._pull_entry()
         self._shipper_shutdown.set()
@@ -90,12 +201,16 @@ class Curator:
             shipper.join()
 
     def _ship(self, investigation: Investigation, events: DataFrame):
+        # Every shipper shares the same read-only data. Shallow copies keep
+        # column removals of one shipper from the others, but shippers must
+        # copy the data before assigning columns.
+        freeze(events)
         for shipper in self.shippers:
             backoff = ExponentialBackoff(initialize=True)
             while not self._investigator_shutdown.wait(backoff.timeout):
                 try:
                     shipper.queue.put_nowait(CuratorEntry.malicious_activity(
-                        investigation, events.copy(),
+                        investigation, events.copy(deep=False),
                     ))
                     break
                 except q.Full:
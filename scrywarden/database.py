@@ -1,19 +1,91 @@
 """Defines all the database models and utilities."""
 
+import hashlib
+import logging
+import select
+import threading
+import time
 import typing as t
+import uuid
 from contextlib import contextmanager
+from datetime import datetime, timezone
 
 import sqlalchemy as sa
 from sqlalchemy.dialects import postgresql as pg
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker, Session
+from sqlalchemy.types import TypeDecorator
 
 from scrywarden.config import parsers, Config
+from scrywarden.config.exceptions import ValidationError
+from scrywarden.missing import MISSING
+from scrywarden.storage import get_storage
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
 
+class HexUUID(TypeDecorator):
+    """Stores UUIDs as hex strings on databases without a UUID type."""
+
+    impl = sa.CHAR(32)
+
+    def process_bind_param(
+        self,
+        value: t.Optional[t.Union[uuid.UUID, str]],
+        dialect,
+    ) -> t.Optional[str]:
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        return value.hex
+
+    def process_result_value(
+        self,
+        value: t.Optional[str],
+        dialect,
+    ) -> t.Optional[uuid.UUID]:
+        return None if value is None else uuid.UUID(value)
+
+
+class UTCDateTime(TypeDecorator):
+    """Stores timezone aware datetimes in UTC on databases without zones.
+
+    Naive datetimes are assumed to already be in UTC.
+    """
+
+    impl = sa.DateTime
+
+    def process_bind_param(
+        self,
+        value: t.Optional[datetime],
+        dialect,
+    ) -> t.Optional[datetime]:
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(
+        self,
+        value: t.Optional[datetime],
+        dialect,
+    ) -> t.Optional[datetime]:
+        return None if value is None else value.replace(tzinfo=timezone.utc)
+
+
+# Column types with variants for the embedded SQLite database.
+BigID = sa.BigInteger().with_variant(sa.Integer(), 'sqlite')
+UUID = pg.UUID(as_uuid=True).with_variant(HexUUID(), 'sqlite')
+Timestamp = sa.DateTime(timezone=True).with_variant(UTCDateTime(), 'sqlite')
+JSON = pg.JSONB().with_variant(sa.JSON(), 'sqlite')
+NullableJSON = pg.JSONB(none_as_null=True).with_variant(
+    sa.JSON(none_as_null=True), 'sqlite',
+)
+
+
 class Profile(Base):
     """Representation of a profile in the database."""
 
@@ -70,8 +142,42 @@ class Actor(Base):
     __table_args__ = (sa.UniqueConstraint(profile_id, name),)
 
 
+def hash_value(value: str) -> int:
+    """Hashes a feature value into a signed 64 bit integer.
+
+    Uses the first 8 bytes of the MD5 digest of the UTF-8 encoded value,
+    which matches `hash_value_sql` in the database.
+
+    Parameters
+    ----------
+    value: str
+        Feature value to hash.
+
+    Returns
+    -------
+    int
+        Signed 64 bit hash of the value.
+    """
+    digest = hashlib.md5(value.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def hash_value_sql(value: sa.sql.ColumnElement) -> sa.sql.ColumnElement:
+    """Returns the SQL expression of `hash_value` for a value expression."""
+    return sa.cast(sa.cast(
+        sa.literal('x') + sa.func.substr(sa.func.md5(value), 1, 16),
+        pg.BIT(64),
+    ), sa.BigInteger)
+
+
 class Feature(Base):
-    """Feature model related to a profile evaluation."""
+    """Feature model related to a profile evaluation.
+
+    Features are unique by the 64 bit hash of their value instead of the
+    value itself, which keeps the unique index small for long values. The
+    full value is stored alongside and compared on lookups and upserts, so
+    a value whose hash collides with another value is never counted as it.
+    """
 
     __tablename__ = 'feature'
 
@@ -85,12 +191,76 @@ class Feature(Base):
         sa.Integer, sa.ForeignKey(Actor.id, ondelete='CASCADE'),
         nullable=False)
     value = sa.Column(sa.String, nullable=False)
+    value_hash = sa.Column(sa.BigInteger, nullable=False)
     count = sa.Column(sa.Integer, nullable=False)
 
     field = relationship('Field', back_populates='features')
     actor = relationship('Actor', back_populates='features')
 
-    __table_args__ = (sa.UniqueConstraint(field_id, actor_id, value),)
+    __table_args__ = (
+        sa.Index(
+            'ux_feature_field_id_actor_id_value_hash',
+            field_id, actor_id, value_hash, unique=True,
+        ),
+    )
+
+
+class FeatureDelta(Base):
+    """Pending increment of a feature count.
+
+    Pipelines using feature deltas append increments here instead of
+    updating the feature rows, so concurrent pipelines never wait on the
+    locks of popular features. The count of a feature is its own count
+    plus its pending deltas until `compact_features` merges them.
+    """
+
+    __tablename__ = 'feature_delta'
+
+    id = sa.Column(
+        f'{__tablename__}_id', BigID, primary_key=True,
+        autoincrement=True,
+    )
+    feature_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Feature.id, ondelete='CASCADE'),
+        nullable=False,
+    )
+    count = sa.Column(sa.Integer, nullable=False)
+
+    __table_args__ = (
+        sa.Index('ix_feature_delta_feature_id', feature_id),
+    )
+
+
+def feature_count() -> sa.sql.ColumnElement:
+    """Returns the count of a feature including its pending deltas."""
+    return Feature.count + sa.select([
+        sa.func.coalesce(sa.func.sum(FeatureDelta.count), 0),
+    ]).where(FeatureDelta.feature_id == Feature.id).as_scalar()
+
+
+COMPACT_SIZE = 100000
+"""Default maximum number of feature deltas merged per transaction."""
+
+
+def compact_features(session: Session, limit: int = COMPACT_SIZE) -> int:
+    """Merges the oldest pending feature deltas into the feature counts.
+
+    Parameters
+    ----------
+    session: Session
+        SQLAlchemy session.
+    limit: int
+        Maximum number of deltas to merge.
+
+    Returns
+    -------
+    int
+        Number of deltas merged.
+    """
+    return get_storage(session).merge_deltas(
+        session, Feature.__table__, FeatureDelta.__table__,
+        key=FeatureDelta.feature_id, count=Feature.count, limit=limit,
+    )
 
 
 class Message(Base):
@@ -99,9 +269,13 @@ class Message(Base):
     __tablename__ = 'message'
 
     id = sa.Column(
-        f'{__tablename__}_id', pg.UUID(as_uuid=True), primary_key=True,
+        f'{__tablename__}_id', UUID, primary_key=True,
+    )
+    data = sa.Column(NullableJSON)
+    created_at = sa.Column(
+        Timestamp, nullable=False,
+        server_default=sa.func.now(),
     )
-    data = sa.Column(pg.JSONB(none_as_null=True))
 
 
 class Event(Base):
@@ -110,19 +284,24 @@ class Event(Base):
     __tablename__ = 'event'
 
     id = sa.Column(
-        f'{__tablename__}_id', sa.BigInteger, primary_key=True,
+        f'{__tablename__}_id', BigID, primary_key=True,
         autoincrement=True
     )
     message_id = sa.Column(
-        pg.UUID(as_uuid=True), sa.ForeignKey(Message.id, ondelete='CASCADE'),
+        UUID, sa.ForeignKey(Message.id, ondelete='CASCADE'),
         nullable=False,
     )
     actor_id = sa.Column(
         sa.Integer, sa.ForeignKey(Actor.id, ondelete='CASCADE'),
         nullable=False,
     )
+    # Profile of the actor, stored to filter events without joins.
+    profile_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Profile.id, ondelete='CASCADE'),
+        nullable=False,
+    )
     created_at = sa.Column(
-        sa.DateTime(timezone=True), nullable=False, index=True,
+        Timestamp, nullable=False, index=True,
         server_default=sa.func.now(),
     )
 
@@ -137,6 +316,11 @@ class Event(Base):
     def score(self):
         return sum(anomaly.score for anomaly in self.anomalies)
 
+    __table_args__ = (
+        sa.Index('ix_event_actor_id_created_at', actor_id, created_at),
+        sa.Index('ix_event_profile_id_created_at', profile_id, created_at),
+    )
+
 
 class Anomaly(Base):
     """Field feature that generated an anomaly score."""
@@ -144,7 +328,7 @@ class Anomaly(Base):
     __tablename__ = 'anomaly'
 
     id = sa.Column(
-        f'{__tablename__}_id', sa.BigInteger, primary_key=True,
+        f'{__tablename__}_id', BigID, primary_key=True,
         autoincrement=True,
     )
     event_id = sa.Column(
@@ -160,6 +344,10 @@ class Anomaly(Base):
         nullable=False,
     )
     score = sa.Column(sa.Float, nullable=False)
+    created_at = sa.Column(
+        Timestamp, nullable=False,
+        server_default=sa.func.now(),
+    )
 
     event = relationship('Event', back_populates='anomalies')
 
@@ -193,15 +381,20 @@ class Investigator(Base):
     __tablename__ = 'investigator'
 
     id = sa.Column(
-        f'{__tablename__}_id', pg.UUID(as_uuid=True), primary_key=True,
+        f'{__tablename__}_id', UUID, primary_key=True,
     )
     profile_id = sa.Column(
         sa.Integer, sa.ForeignKey(Profile.id, ondelete='SET NULL'),
     )
     created_at = sa.Column(
-        sa.DateTime(timezone=True), nullable=False, index=True,
+        Timestamp, nullable=False, index=True,
         server_default=sa.func.now(),
     )
+    # Refreshed while the investigator runs, so investigators that crashed
+    # can be told apart from running ones.
+    heartbeat_at = sa.Column(
+        Timestamp, nullable=False, server_default=sa.func.now(),
+    )
 
 
 class Investigation(Base):
@@ -220,16 +413,20 @@ class Investigation(Base):
     )
     index = sa.Column(sa.Integer, nullable=True)
     created_at = sa.Column(
-        sa.DateTime(timezone=True), nullable=False, index=True,
+        Timestamp, nullable=False, index=True,
         server_default=sa.func.now(),
     )
     created_by = sa.Column(
-        pg.UUID(as_uuid=True),
+        UUID,
         sa.ForeignKey(Investigator.id, ondelete='SET NULL'),
     )
-    completed_at = sa.Column(sa.DateTime(timezone=True), index=True)
+    completed_at = sa.Column(Timestamp, index=True)
     is_assigned = sa.Column(sa.Boolean, nullable=False, default=False)
-    options = sa.Column(pg.JSONB)
+    options = sa.Column(JSON)
+    window_start = sa.Column(Timestamp)
+    window_end = sa.Column(Timestamp)
+    # Not a foreign key since events can be dropped with their partition.
+    last_event_id = sa.Column(sa.BigInteger)
 
     events = relationship(
         'Event', secondary=lambda: InvestigationEvent,
@@ -237,7 +434,13 @@ class Investigation(Base):
     )
     group = relationship('InvestigationGroup', back_populates='investigations')
 
-    __table_args__ = (sa.UniqueConstraint(group_id, index),)
+    __table_args__ = (
+        sa.UniqueConstraint(group_id, index),
+        sa.Index(
+            'ix_investigation_investigation_group_id_created_at',
+            group_id, created_at,
+        ),
+    )
 
 
 InvestigationEvent = sa.Table(
@@ -252,12 +455,36 @@ InvestigationEvent = sa.Table(
         sa.ForeignKey(Event.id, ondelete='CASCADE'),
         nullable=False,
     ),
+    sa.Column(
+        'created_at', Timestamp, nullable=False,
+        server_default=sa.func.now(),
+    ),
     sa.UniqueConstraint('investigation_id', 'event_id'),
+    sa.Index('ix_investigation_event_event_id', 'event_id'),
 )
 """Many to many relation for investigations and events."""
 
 
+DRIVERS = {
+    'postgresql': 'postgresql+psycopg2',
+    'sqlite': 'sqlite',
+}
+
+
+def is_valid_driver(value: str) -> None:
+    """Determines if the database driver in the config is supported."""
+    if value not in DRIVERS:
+        raise ValidationError(
+            f"{value!r} is not a valid driver, expected one of "
+            f"{', '.join(map(repr, DRIVERS))}",
+        )
+
+
 PARSER = parsers.Options({
+    'driver': parsers.String(
+        default='postgresql', validators=[is_valid_driver],
+    ),
+    'path': parsers.String(default='scrywarden.db'),
     'host': parsers.String(default='localhost'),
     'port': parsers.Integer(default=5432),
     'name': parsers.String(default='scrywarden'),
@@ -279,15 +506,54 @@ def parse_engine(config: Config) -> Engine:
     Engine
         SQLAlchemy engine.
     """
-    config = config.parse(PARSER)
+    return _create_engine(config.parse(PARSER))
+
+
+def _create_engine(config: Config) -> Engine:
+    driver = config['driver'].value
+    if driver == 'sqlite':
+        return create_sqlite_engine(config['path'].value)
     return sa.create_engine(
-        "postgresql+psycopg2://"
+        f"{DRIVERS[driver]}://"
         f"{config['user'].value}:{config['password'].value}"
         f"@{config['host'].value}:{config['port'].value}/"
         f"{config['name'].value}",
     )
 
 
+def create_sqlite_engine(path: str = ':memory:') -> Engine:
+    """Creates an engine of an embedded SQLite database.
+
+    File databases use write-ahead logging so the collecting and
+    investigating processes can read while the other one writes. Foreign
+    keys are enforced like on PostgreSQL.
+
+    Parameters
+    ----------
+    path: str
+        Path of the database file. Defaults to an in-memory database.
+
+    Returns
+    -------
+    Engine
+        SQLAlchemy engine.
+    """
+    engine = sa.create_engine(
+        f'sqlite:///{path}', connect_args={'timeout': 30},
+    )
+
+    @sa.event.listens_for(engine, 'connect')
+    def configure(connection, _):
+        cursor = connection.cursor()
+        if path != ':memory:':
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+    return engine
+
+
 @contextmanager
 def managed_session(
     factory: sessionmaker, **kwargs,
@@ -336,14 +602,312 @@ def create_session_factory(engine: Engine) -> sessionmaker:
     return sessionmaker(bind=engine)
 
 
-def migrate(engine: Engine) -> None:
-    """Ensures that the connected database has all the database objects.
+def replication_lag(connection: Connection) -> float:
+    """Returns how many seconds a database lags behind its primary.
 
-    Very simple migration. Does not handle changing the models currently.
+    Primaries and replicas that replayed everything they received have no
+    lag. Otherwise the lag is the age of the last replayed transaction.
+    Databases other than PostgreSQL don't replicate and have no lag.
 
     Parameters
     ----------
-    engine: Engine
-        SQLAlchemy engine.
+    connection: Connection
+        SQLAlchemy connection to the database.
+
+    Returns
+    -------
+    float
+        Replication lag in seconds.
+    """
+    if connection.dialect.name != 'postgresql':
+        return 0.0
+    return float(connection.execute(sa.text("""
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE coalesce(
+                EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()),
+                0
+            )
+        END
+    """)).scalar())
+
+
+class Replica:
+    """Routes reads to a read replica while it is fresh enough.
+
+    Reads that can tolerate stale data are sent to the replica as long as
+    its replication lag is within what the reader tolerates. Otherwise, or
+    when the lag can't be measured, they fall back to the primary. The lag
+    is measured at most once every `check_interval` seconds.
+
+    Parameters
+    ----------
+    primary: sessionmaker
+        SQLAlchemy session factory of the primary database.
+    replica: sessionmaker
+        SQLAlchemy session factory of the read replica.
+    check_interval: float
+        Number of seconds a measured lag is reused for. Defaults to 1
+        second.
+    """
+
+    def __init__(
+        self,
+        primary: sessionmaker,
+        replica: sessionmaker,
+        check_interval: float = 1.0,
+    ):
+        self.primary: sessionmaker = primary
+        self.replica: sessionmaker = replica
+        self.check_interval: float = check_interval
+        self._lag: t.Tuple[float, float] = (float('inf'), -float('inf'))
+
+    def lag(self) -> float:
+        """Returns the replication lag of the replica in seconds.
+
+        Returns
+        -------
+        float
+            Replication lag, or infinity if it could not be measured.
+        """
+        lag, measured_at = self._lag
+        now = time.monotonic()
+        if now - measured_at < self.check_interval:
+            return lag
+        try:
+            with self.replica.kw['bind'].connect() as connection:
+                lag = replication_lag(connection)
+        except sa.exc.DBAPIError as error:
+            logger.warning("Could not measure replica lag: %s", error)
+            lag = float('inf')
+        self._lag = (lag, now)
+        return lag
+
+    def route(self, max_lag: float = 0.0) -> sessionmaker:
+        """Returns the session factory to read from.
+
+        Parameters
+        ----------
+        max_lag: float
+            Maximum number of seconds the read tolerates the replica lagging
+            behind. Defaults to 0 seconds.
+
+        Returns
+        -------
+        sessionmaker
+            Replica session factory if it is fresh enough, otherwise the
+            primary session factory.
+        """
+        lag = self.lag()
+        if lag <= max_lag:
+            return self.replica
+        logger.debug(
+            "Reading from primary since replica lags %.2f seconds", lag,
+        )
+        return self.primary
+
+
+REPLICA_PARSER = PARSER.extend({
+    'check_interval': parsers.Float(default=1.0),
+})
+
+
+def parse_replica(
+    config: Config,
+    primary: sessionmaker,
+) -> t.Optional[Replica]:
+    """Parses the read replica of the database config.
+
+    Connection settings missing from the `replica` section are taken from
+    the primary database.
+
+    Parameters
+    ----------
+    config: Config
+        Database configuration object.
+    primary: sessionmaker
+        SQLAlchemy session factory of the primary database.
+
+    Returns
+    -------
+    Optional[Replica]
+        Configured replica, or None if the config has no replica section.
+    """
+    replica = config.get('replica')
+    if replica.value is MISSING:
+        return None
+    settings = {
+        key: value for key, value in (config.value or {}).items()
+        if key in PARSER.parsers
+    }
+    replica = Config(
+        {**settings, **replica.value}, key=replica.key,
+    ).parse(REPLICA_PARSER)
+    return Replica(
+        primary, create_session_factory(_create_engine(replica)),
+        check_interval=replica['check_interval'].value,
+    )
+
+
+EVENTS_CHANNEL = 'events'
+"""Channel kind notified when events are created for a profile."""
+
+INVESTIGATIONS_CHANNEL = 'investigations'
+"""Channel kind notified when an investigation of a group is assigned."""
+
+
+def channel(kind: str, id: int) -> str:
+    """Returns the notification channel name of a database object.
+
+    Parameters
+    ----------
+    kind: str
+        Kind of channel such as `EVENTS_CHANNEL`.
+    id: int
+        ID of the object the channel belongs to.
+
+    Returns
+    -------
+    str
+        Channel name.
+    """
+    return f'scrywarden_{kind}_{id}'
+
+
+def notify(session: Session, name: str, payload: str = '') -> None:
+    """Sends a notification on a channel when the session commits.
+
+    Does nothing on databases that don't support notifications.
+
+    Parameters
+    ----------
+    session: Session
+        Current SQLAlchemy session.
+    name: str
+        Channel name to notify.
+    payload: str
+        Optional payload of the notification.
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    session.execute(sa.select([sa.func.pg_notify(name, payload)]))
+
+
+class Listener:
+    """Waits for PostgreSQL notifications on a channel.
+
+    Listens on a dedicated connection outside of the connection pool. If
+    listening is not possible, such as when the database does not support
+    notifications or the connection is lost, waiting falls back to waiting
+    on the shutdown event for the whole timeout like regular polling.
+
+    Parameters
+    ----------
+    factory: sessionmaker
+        SQLAlchemy session factory bound to the engine to listen with.
+    name: str
+        Channel name to listen on.
+    shutdown: threading.Event
+        Threading event that indicates a shutdown occurred.
+    poll: float
+        Maximum number of seconds to block on the connection before checking
+        for a shutdown. Defaults to 1 second.
     """
-    Base.metadata.create_all(engine)
+    def __init__(
+        self,
+        factory: sessionmaker,
+        name: str,
+        shutdown: threading.Event,
+        poll: float = 1.0,
+    ):
+        self.name: str = name
+        self.shutdown: threading.Event = shutdown
+        self.poll: float = poll
+        self._engine: Engine = factory.kw['bind']
+        self._connection: t.Optional[t.Any] = None
+        self._failed: bool = False
+
+    def listen(self) -> bool:
+        """Starts listening on the channel if not already listening.
+
+        Returns
+        -------
+        bool
+            If the listener is listening on the channel.
+        """
+        if self._connection is not None:
+            return True
+        if self._failed or self._engine.dialect.name != 'postgresql':
+            return False
+        try:
+            proxy = self._engine.raw_connection()
+            # Keep the listening connection out of the connection pool.
+            proxy.detach()
+            connection = proxy.connection
+            connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute(f'LISTEN "{self.name}"')
+            cursor.close()
+        except Exception as error:
+            logger.warning(
+                "Could not listen on channel %r falling back to polling: %s",
+                self.name, error,
+            )
+            self._failed = True
+            return False
+        self._connection = connection
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        """Waits until a notification is received or the timeout passes.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        bool
+            True if a shutdown occurred, False otherwise. This mirrors the
+            return value of `threading.Event.wait` on the shutdown event.
+        """
+        if not self.listen():
+            return self.shutdown.wait(timeout)
+        deadline = time.monotonic() + timeout
+        while not self.shutdown.is_set():
+            try:
+                if self._received():
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                select.select(
+                    [self._connection], [], [], min(remaining, self.poll),
+                )
+            except Exception as error:
+                logger.warning(
+                    "Lost listener connection on channel %r: %s", self.name,
+                    error,
+                )
+                self.close()
+                return self.shutdown.wait(max(deadline - time.monotonic(), 0))
+        return self.shutdown.is_set()
+
+    def close(self) -> None:
+        """Stops listening and closes the listener connection."""
+        if self._connection is None:
+            return
+        try:
+            self._connection.close()
+        except Exception as error:
+            logger.debug("Error closing listener connection: %s", error)
+        self._connection = None
+
+    def _received(self) -> bool:
+        self._connection.poll()
+        if not self._connection.notifies:
+            return False
+        self._connection.notifies.clear()
+        return True
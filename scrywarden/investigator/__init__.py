@@ -1 +1,2 @@
 from .base import Investigator
+from .scheduler import InvestigationScheduler
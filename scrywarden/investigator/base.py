@@ -1,12 +1,14 @@
 import logging
 import threading
+import time
 import typing as t
 import uuid
-from datetime import datetime, timezone
-from queue import Queue, Full
+from concurrent.futures import Executor
+from datetime import datetime, timedelta, timezone
+from queue import Queue, Full, Empty
 
 import pandas as pa
-from sqlalchemy.dialects import postgresql as pg
+import sqlalchemy as sa
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session, joinedload
 
@@ -17,11 +19,31 @@ from scrywarden.investigator.entry import InvestigatorEntry
 from scrywarden.profile.analyzers import Analyzer
 from scrywarden.profile.collectors import Collector
 from scrywarden.profile.config import parse_profiles
+from scrywarden.storage import get_storage
 from scrywarden.timing import ExponentialBackoff, benchmark
 from scrywarden.profile.base import Profile
 
 logger = logging.getLogger(__name__)
 
+# Number of seconds between the heartbeats of a running investigator.
+HEARTBEAT_INTERVAL = 30.0
+
+# Number of seconds without a heartbeat after which an investigator is
+# considered gone and its investigations are taken back.
+HEARTBEAT_TIMEOUT = 300.0
+
+
+class PrefetchedPage(t.NamedTuple):
+    """Page of anomalies collected ahead of its analysis.
+
+    A page of None marks the end of the investigation. An aborted page marks
+    that collecting the investigation failed, so its pages are discarded.
+    """
+
+    investigation: db.Investigation
+    anomalies: t.Optional[pa.DataFrame]
+    aborted: bool = False
+
 
 class Investigator(threading.Thread):
     """Handles the task of analyzing anomalies from a profile.
@@ -47,12 +69,33 @@ class Investigator(threading.Thread):
         Analyzer instance used to detect malicious anomalies.
     session_factory: Optional[sessionmaker]
         SQLAlchemy session factory.
+    replica: Optional[Replica]
+        Read replica the collector and analyzer read from while it is fresh
+        enough. Investigations and their events are always written to and
+        claimed from the primary.
     queue: Optional[Queue]
         Threading queue to use to send investigation results.
     shutdown: Optional[threading.Event]
         Threading event that indicates that shutdown is occurring.
     group: str
         Investigation group name to use. Defaults to the default group.
+    block: bool
+        If steps should wait until anomalies are available. When False, a
+        step returns right away when there is nothing to investigate yet.
+        Defaults to True.
+    partition: Optional[Tuple[int, int]]
+        Partition index and partition count of the profile actors to
+        investigate. Each partition is investigated in its own investigation
+        group, so partitions of one profile run in parallel. Defaults to
+        investigating every actor.
+    executor: Optional[Executor]
+        Executor to run the analyzer in, such as a process pool for CPU heavy
+        analyzers. The analyzer must be picklable to run in a process pool.
+        Defaults to analyzing in the investigator thread.
+    prefetch: int
+        Number of collected pages a background thread may fetch and assign
+        ahead of the analysis. Defaults to 0, which collects and analyzes
+        one after another. Only used when blocking.
     """
 
     def __init__(
@@ -61,9 +104,14 @@ class Investigator(threading.Thread):
         collector: t.Optional[Collector] = None,
         analyzer: t.Optional[Analyzer] = None,
         session_factory: t.Optional[sessionmaker] = None,
+        replica: t.Optional[db.Replica] = None,
         queue: 't.Optional[Queue[Entry]]' = None,
         shutdown: t.Optional[threading.Event] = None,
         group: str = '',
+        block: bool = True,
+        partition: t.Optional[t.Tuple[int, int]] = None,
+        executor: t.Optional[Executor] = None,
+        prefetch: int = 0,
     ):
         super().__init__()
         self.id: uuid.UUID = uuid.uuid4()
@@ -71,39 +119,129 @@ class Investigator(threading.Thread):
         self.collector: t.Optional[Collector] = collector
         self.analyzer: t.Optional[Analyzer] = analyzer
         self.session_factory: t.Optional[sessionmaker] = session_factory
+        self.replica: t.Optional[db.Replica] = replica
         self.queue: 't.Optional[Queue[Entry]]' = queue
         self.shutdown: t.Optional[threading.Event] = shutdown
         self.group: str = group
+        self.block: bool = block
+        self.partition: t.Optional[t.Tuple[int, int]] = partition
+        self.executor: t.Optional[Executor] = executor
+        self.prefetch: int = prefetch
         self._group: t.Optional[db.InvestigationGroup] = None
         self._model: t.Optional[db.Investigator] = None
+        self._listener: t.Optional[db.Listener] = None
+        self._window_end: t.Optional[datetime] = None
+        self._recovered: t.List[db.Investigation] = []
+        self._prefetched: 't.Optional[Queue[PrefetchedPage]]' = None
+        self._prefetcher: t.Optional[threading.Thread] = None
+        self._heartbeat: t.Optional[threading.Thread] = None
+        self._stopped: threading.Event = threading.Event()
+        self._reclaim_at: float = 0.0
+        self._investigation: t.Optional[db.Investigation] = None
+        self._discarded: t.Optional[db.Investigation] = None
 
     def run(self) -> None:
         """Runs the main investigation loop."""
         self.name = f"Investigator-{self.profile.name}"
+        if self.partition is not None:
+            self.name += f"-{self.partition[0]}"
+        self.setup()
+        while not self.shutdown.is_set():
+            self.step()
+        self.teardown()
+
+    def setup(self) -> None:
+        """Prepares the investigator to run investigations.
+
+        Syncs the profile, investigator and investigation group with the
+        database and claims investigations left unfinished by investigators
+        that shut down or stopped sending heartbeats. Must be called before
+        calling `step`.
+        """
         self.collector.shutdown = self.shutdown
         self.collector.session_factory = self.session_factory
+        self.collector.replica = self.replica
+        self.analyzer.session_factory = self.session_factory
+        self.analyzer.replica = self.replica
+        self.collector.block = self.block
+        self.collector.partition = self.partition
         with self._session(expire_on_commit=False) as session:
             self.profile.sync(session)
             self._sync(session)
             self._sync_group(session)
-        while not self.shutdown.is_set():
+            self._window_end = session.query(
+                sa.func.max(db.Investigation.window_end),
+            ).filter(db.Investigation.group == self._group).scalar()
+        self._listener = db.Listener(
+            self.session_factory,
+            db.channel(db.INVESTIGATIONS_CHANNEL, self._group.id),
+            self.shutdown,
+        )
+        self._reclaim()
+        self._stopped.clear()
+        self._heartbeat = threading.Thread(
+            target=self._beat, name=f"{self.name}-Heartbeat",
+        )
+        self._heartbeat.start()
+        if self.prefetch and self.block:
+            self._prefetched = Queue(self.prefetch)
+            self._prefetcher = threading.Thread(
+                target=self._prefetch, name=f"{self.name}-Prefetch",
+            )
+            self._prefetcher.start()
+
+    def step(self) -> bool:
+        """Runs a single investigation and queues its malicious anomalies.
+
+        When the investigation fails, it is abandoned before the error is
+        raised, so the next step investigates its window again instead of
+        waiting on it.
+
+        Returns
+        -------
+        bool
+            True if an investigation took place, False otherwise.
+        """
+        try:
             result = self._investigate()
-            if result is None:
-                continue
-            investigation, anomalies = result
-            backoff = ExponentialBackoff(initialize=True)
-            while not self.shutdown.wait(backoff.timeout):
-                try:
-                    self.queue.put_nowait(InvestigatorEntry.malicious_activity(
-                        investigation,
-                        anomalies,
-                    ))
-                    break
-                except Full:
-                    logger.debug(
-                        "Investigator queue full retrying in %.2f seconds",
-                        backoff.next()
-                    )
+        except Exception:
+            self._abandon_current()
+            raise
+        self._investigation = None
+        if result is None:
+            return False
+        investigation, anomalies = result
+        self._window_end = investigation.window_end
+        backoff = ExponentialBackoff(initialize=True)
+        while not self.shutdown.wait(backoff.timeout):
+            try:
+                self.queue.put_nowait(InvestigatorEntry.malicious_activity(
+                    investigation,
+                    anomalies,
+                ))
+                break
+            except Full:
+                logger.debug(
+                    "Investigator queue full retrying in %.2f seconds",
+                    backoff.next()
+                )
+        return True
+
+    def teardown(self) -> None:
+        """Releases the resources of the investigator after shutdown.
+
+        Prefetched investigations that were not analyzed yet are claimed by
+        the next investigator of the group that starts.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.join()
+            self._prefetcher = None
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        self._listener.close()
+        self.collector.close()
         # Investigator model must be removed to allow unassigned
         # investigations to be removed.
         with self._session() as session:
@@ -115,61 +253,434 @@ class Investigator(threading.Thread):
             self.profile.name,
         )
 
+    @property
+    def group_name(self) -> str:
+        """Returns the investigation group name including the partition."""
+        if self.partition is None:
+            return self.group
+        index, count = self.partition
+        return f"{self.group}[{index}/{count}]"
+
+    @property
+    def backlog(self) -> float:
+        """Returns how many seconds the investigations are behind.
+
+        Measured from the end of the last investigated window. Investigators
+        that have not investigated a window yet are infinitely behind.
+        """
+        if self._window_end is None:
+            return float('inf')
+        return (datetime.now(timezone.utc) - self._window_end).total_seconds()
+
     @benchmark("Investigation completed in %.2f seconds", logger=logger)
     def _investigate(self) -> t.Optional[
         t.Tuple[db.Investigation, pa.DataFrame]
     ]:
-        investigation, previous = self._create_investigation()
+        if not self._recovered and time.monotonic() >= self._reclaim_at:
+            self._reclaim()
+        if self._recovered:
+            return self._investigate_unfinished(self._recovered.pop(0))
+        if self._prefetched is not None:
+            return self._investigate_prefetched()
+        created = self._create_investigation()
+        if created is None:
+            return None
+        investigation, previous = created
+        self._investigation = investigation
         logger.debug("Created investigation %s", investigation.id)
+        results = [
+            self._analyze_page(anomalies)
+            for anomalies in self._collect(investigation, previous)
+        ]
+        return self._complete(investigation, results)
+
+    def _collect(
+        self,
+        investigation: db.Investigation,
+        previous: t.Optional[db.Investigation],
+    ) -> t.Iterator[pa.DataFrame]:
+        """Collects the pages of an investigation and assigns their events.
+
+        The next page is fetched before a page is returned, so the
+        investigation is marked as assigned as soon as the events of every
+        page are, before the last page is analyzed.
+        """
+        pages = self.collector.collect_pages(
+            self.profile, investigation, previous=previous,
+        )
+        anomalies = self._next_page(pages)
+        while anomalies is not None:
+            logger.debug("\n%s", anomalies)
+            self._assign(investigation, anomalies)
+            next_anomalies = self._next_page(pages)
+            if next_anomalies is None:
+                self._mark_assigned(investigation)
+            yield anomalies
+            anomalies = next_anomalies
+
+    def _next_page(
+        self,
+        pages: t.Iterator[pa.DataFrame],
+    ) -> t.Optional[pa.DataFrame]:
+        anomalies = self._collect_page(pages)
+        while anomalies is not None and anomalies.empty:
+            anomalies = self._collect_page(pages)
+        return anomalies
+
+    def _analyze_page(self, anomalies: pa.DataFrame) -> pa.DataFrame:
+        logger.debug("Analyzing collected events")
         with benchmark() as elapsed:
-            anomalies = self.collector.collect(
-                self.profile, investigation, previous=previous,
-            )
+            malicious_anomalies = self._analyze(anomalies)
             logger.info(
-                "%d anomalies collected in %.2f seconds", len(anomalies),
-                elapsed(),
+                "%d malicious anomalies found in %.2f seconds",
+                len(malicious_anomalies), elapsed(),
             )
-        if anomalies.empty:
+        logger.debug("\n%s", malicious_anomalies)
+        return malicious_anomalies
+
+    def _complete(
+        self,
+        investigation: db.Investigation,
+        results: t.List[pa.DataFrame],
+    ) -> t.Optional[t.Tuple[db.Investigation, pa.DataFrame]]:
+        if not results:
             # Delete investigation because no investigation took place.
             with self._session() as session:
                 session.delete(investigation)
             return None
-        logger.debug("\n%s", anomalies)
-        event_ids = anomalies['event_id'].drop_duplicates().astype(
-            'object',
-        )
         with self._session(expire_on_commit=False) as session:
             session.add(investigation)
-            investigation.is_assigned = True
-            assigned_events = []
-            for event_id in event_ids.values:
-                assigned_events.append({
-                    'investigation_id': investigation.id,
-                    'event_id': event_id,
-                })
-            statement = pg.insert(db.InvestigationEvent).values(
-                assigned_events,
+            investigation.completed_at = datetime.now(timezone.utc)
+            session.flush()
+        return investigation, pa.concat(results, ignore_index=True)
+
+    def _prefetch(self) -> None:
+        """Collects and assigns investigations ahead of their analysis.
+
+        Runs in a background thread and puts every collected page into the
+        bounded prefetch queue in order, followed by a page of None that
+        marks the end of the investigation. When collecting fails, the
+        investigation is abandoned and an aborted page tells the analysis to
+        discard the pages it already received.
+        """
+        while not self.shutdown.is_set():
+            investigation = None
+            collected = False
+            try:
+                created = self._create_investigation()
+                if created is None:
+                    continue
+                investigation, previous = created
+                for anomalies in self._collect(investigation, previous):
+                    collected = True
+                    self._put_prefetched(PrefetchedPage(
+                        investigation, anomalies,
+                    ))
+                if collected:
+                    self._put_prefetched(PrefetchedPage(investigation, None))
+                else:
+                    self._complete(investigation, [])
+            except Exception as error:
+                logger.exception(error)
+                if investigation is not None:
+                    self._abandon(investigation)
+                    if collected:
+                        self._put_prefetched(PrefetchedPage(
+                            investigation, None, aborted=True,
+                        ))
+                self.shutdown.wait(1.0)
+
+    def _put_prefetched(self, page: 'PrefetchedPage') -> None:
+        while not self.shutdown.is_set():
+            try:
+                return self._prefetched.put(page, timeout=1.0)
+            except Full:
+                continue
+
+    def _investigate_prefetched(self) -> t.Optional[
+        t.Tuple[db.Investigation, pa.DataFrame]
+    ]:
+        results: t.List[pa.DataFrame] = []
+        while not self.shutdown.is_set():
+            try:
+                page = self._prefetched.get(timeout=1.0)
+            except Empty:
+                continue
+            investigation, anomalies, aborted = page
+            if investigation is self._discarded:
+                self._discard(page)
+                continue
+            self._investigation = investigation
+            if aborted:
+                logger.warning(
+                    "Discarding the pages of aborted investigation %d",
+                    investigation.id,
+                )
+                return None
+            if anomalies is None:
+                return self._complete(investigation, results)
+            results.append(self._analyze_page(anomalies))
+        return None
+
+    def _abandon_current(self) -> None:
+        """Abandons the investigation of a step that failed.
+
+        Prefetched investigations may still be collected in the background,
+        so their remaining pages are discarded and they are abandoned once
+        the prefetcher is done with them.
+        """
+        investigation, self._investigation = self._investigation, None
+        if investigation is None:
+            return
+        if self._prefetched is not None:
+            self._discarded = investigation
+            return
+        try:
+            self._abandon(investigation)
+        except Exception as error:
+            logger.exception(error)
+
+    def _discard(self, page: PrefetchedPage) -> None:
+        """Discards a prefetched page of an investigation that failed."""
+        investigation, anomalies, aborted = page
+        if anomalies is not None:
+            return
+        self._discarded = None
+        # Aborted investigations were already abandoned by the prefetcher.
+        if not aborted:
+            self._abandon(investigation)
+
+    def _abandon(self, investigation: db.Investigation) -> None:
+        """Gives up an investigation that failed to be investigated.
+
+        Investigations that are still assigning events are deleted along
+        with their assigned events, so the window is collected again.
+        Investigations whose events were all assigned may already be built
+        upon by the next investigation of the group, so they are released
+        instead and claimed again like investigations of crashed
+        investigators.
+        """
+        with self._session(expire_on_commit=False) as session:
+            session.add(investigation)
+            if investigation.is_assigned:
+                logger.warning(
+                    "Releasing investigation %d after it failed",
+                    investigation.id,
+                )
+                investigation.created_by = None
+            else:
+                logger.warning(
+                    "Deleting investigation %d after it failed",
+                    investigation.id,
+                )
+                session.delete(investigation)
+
+    def _beat(self) -> None:
+        """Refreshes the heartbeat of the investigator until it stops."""
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                with self._session() as session:
+                    session.query(db.Investigator).filter(
+                        db.Investigator.id == self.id,
+                    ).update({
+                        db.Investigator.heartbeat_at:
+                            datetime.now(timezone.utc),
+                    }, synchronize_session=False)
+            except Exception as error:
+                logger.exception(error)
+
+    def _reclaim(self) -> None:
+        """Claims the unfinished investigations of gone investigators.
+
+        Runs at setup and then at most once every heartbeat interval, so
+        investigations of investigators that crash while this one runs are
+        taken back too.
+        """
+        self._reclaim_at = time.monotonic() + HEARTBEAT_INTERVAL
+        with self._session(expire_on_commit=False) as session:
+            self._delete_stale_investigators(session)
+            self._recovered = self._claim_unfinished(session)
+
+    def _delete_stale_investigators(self, session: Session) -> None:
+        """Deletes investigators of the profile that stopped heartbeating.
+
+        These are left behind when an investigator crashes without tearing
+        down. Deleting them releases their investigations, so unassigned
+        ones are deleted and assigned ones are claimed again.
+        """
+        stale = session.query(db.Investigator).filter(
+            db.Investigator.profile_id == self.profile.model.id,
+            db.Investigator.id != self.id,
+            db.Investigator.heartbeat_at < datetime.now(timezone.utc)
+            - timedelta(seconds=HEARTBEAT_TIMEOUT),
+        ).delete(synchronize_session=False)
+        if stale:
+            logger.warning("Deleted %d stale investigators", stale)
+
+    def _claim_unfinished(self, session: Session) -> t.List[db.Investigation]:
+        """Claims assigned investigations that were never completed.
+
+        These are left behind when an investigator shuts down, crashes or
+        fails with investigations that were assigned but not analyzed yet.
+        Rows are locked with SKIP LOCKED so concurrent investigators of the
+        group claim each investigation only once.
+        """
+        investigations = session.query(db.Investigation).filter(
+            db.Investigation.group == self._group,
+            db.Investigation.is_assigned.is_(True),
+            db.Investigation.completed_at.is_(None),
+            db.Investigation.created_by.is_(None),
+        ).order_by(db.Investigation.index.asc()).options(
+            joinedload(db.Investigation.group).joinedload(
+                db.InvestigationGroup.profile,
+            ),
+        ).with_for_update(skip_locked=True, of=db.Investigation).all()
+        for investigation in investigations:
+            logger.warning(
+                "Claiming unfinished investigation %d", investigation.id,
             )
+            investigation.created_by = self._model.id
+        session.flush()
+        return investigations
+
+    def _investigate_unfinished(
+        self,
+        investigation: db.Investigation,
+    ) -> t.Optional[t.Tuple[db.Investigation, pa.DataFrame]]:
+        """Analyzes the assigned events of a claimed investigation."""
+        self._investigation = investigation
+        results = [
+            self._analyze_page(anomalies)
+            for anomalies in self._assigned_pages(investigation)
+        ]
+        if not results:
+            with self._session(expire_on_commit=False) as session:
+                session.add(investigation)
+                investigation.completed_at = datetime.now(timezone.utc)
+            return None
+        return self._complete(investigation, results)
+
+    def _assigned_pages(
+        self,
+        investigation: db.Investigation,
+    ) -> t.Iterator[pa.DataFrame]:
+        """Loads the assigned events of an investigation in pages.
+
+        Pages hold at most the `page_size` of the collector in events and are
+        fetched with keyset pagination on the event creation time and ID,
+        like collected pages are. Collectors without a page size load every
+        event at once.
+        """
+        page_size = getattr(self.collector, 'page_size', 0)
+        after: t.Optional[t.Tuple[datetime, int]] = None
+        while True:
+            with self._session() as session:
+                events = session.query(
+                    db.Event.id.label('event_id'),
+                ).join(
+                    db.InvestigationEvent,
+                    db.InvestigationEvent.c.event_id == db.Event.id,
+                ).filter(
+                    db.InvestigationEvent.c.investigation_id
+                    == investigation.id,
+                )
+                if after is not None:
+                    events = events.filter(
+                        sa.tuple_(db.Event.created_at, db.Event.id)
+                        > sa.tuple_(
+                            sa.literal(after[0].to_pydatetime(), db.Timestamp),
+                            sa.literal(int(after[1])),
+                        ),
+                    )
+                if page_size:
+                    events = events.order_by(
+                        db.Event.created_at.asc(), db.Event.id.asc(),
+                    ).limit(page_size)
+                events = events.subquery()
+                query = session.query(
+                    db.Event.id.label('event_id'),
+                    db.Event.message_id.label('message_id'),
+                    db.Event.actor_id.label('actor_id'),
+                    db.Event.created_at.label('created_at'),
+                    db.Anomaly.id.label('anomaly_id'),
+                    db.Anomaly.field_id.label('field_id'),
+                    db.Anomaly.score.label('score'),
+                ).join(
+                    (events, events.c.event_id == db.Event.id),
+                    (db.Anomaly, db.Event.anomalies),
+                ).order_by(db.Event.created_at.asc(), db.Event.id.asc())
+                anomalies = pa.read_sql_query(
+                    query.statement, session.connection(),
+                    parse_dates=['created_at'],
+                )
+            if anomalies.empty:
+                return
+            yield anomalies
+            if not page_size or anomalies['event_id'].nunique() < page_size:
+                return
+            last = anomalies.iloc[-1]
+            after = (last['created_at'], last['event_id'])
+
+    def _analyze(self, anomalies: pa.DataFrame) -> pa.DataFrame:
+        if self.executor is None:
+            return self.analyzer.analyze(anomalies)
+        return self.executor.submit(self.analyzer.analyze, anomalies).result()
+
+    def _collect_page(
+        self,
+        pages: t.Iterator[pa.DataFrame],
+    ) -> t.Optional[pa.DataFrame]:
+        with benchmark() as elapsed:
+            anomalies = next(pages, None)
+            if anomalies is not None:
+                logger.info(
+                    "%d anomalies collected in %.2f seconds", len(anomalies),
+                    elapsed(),
+                )
+        return anomalies
+
+    def _assign(
+        self,
+        investigation: db.Investigation,
+        anomalies: pa.DataFrame,
+    ) -> None:
+        """Assigns the events of the collected anomalies to an investigation.
+
+        Parameters
+        ----------
+        investigation: Investigation
+            Investigation to assign the events to.
+        anomalies: DataFrame
+            Collected anomalies.
+        """
+        last_event = anomalies.sort_values(
+            ['created_at', 'event_id'],
+        ).iloc[-1]
+        investigation.last_event_id = int(last_event['event_id'])
+        with self._session() as session:
             with benchmark() as elapsed:
-                session.execute(statement)
+                count = len(self.collector.assign(
+                    session, investigation, anomalies,
+                ))
                 logger.info(
                     "%d events assigned to investigation %d in %.2f "
-                    "seconds", len(assigned_events), investigation.id,
-                    elapsed()
+                    "seconds", count, investigation.id, elapsed(),
                 )
-        logger.debug("Analyzing collected events")
-        with benchmark() as elapsed:
-            malicious_anomalies = self.analyzer.analyze(anomalies)
-            logger.info(
-                "%d malicious anomalies found in %.2f seconds",
-                len(malicious_anomalies), elapsed(),
-            )
-        logger.debug("\n%s", malicious_anomalies)
+
+    def _mark_assigned(self, investigation: db.Investigation) -> None:
+        """Marks that all the investigation events have been assigned.
+
+        Also saves the investigation window and last event watermark so the
+        next investigation of the group can start where this one left off.
+        """
         with self._session(expire_on_commit=False) as session:
             session.add(investigation)
-            investigation.completed_at = datetime.now(timezone.utc)
-            session.flush()
-        return investigation, malicious_anomalies
+            investigation.is_assigned = True
+            # Wakes up investigators of the group waiting on this one.
+            db.notify(
+                session,
+                db.channel(db.INVESTIGATIONS_CHANNEL, investigation.group_id),
+            )
 
     @benchmark("Fetched features in %.2f seconds", logger=logger)
     def _get_features(
@@ -230,6 +741,7 @@ class Investigator(threading.Thread):
     def _sync(self, session: Session):
         self._model = db.Investigator(
             id=self.id, profile_id=self.profile.model.id,
+            heartbeat_at=datetime.now(timezone.utc),
         )
         session.add(self._model)
         session.flush()
@@ -243,7 +755,14 @@ class Investigator(threading.Thread):
         Waits until events have been assigned to the investigation before
         returning the object. This allows for the previous investigation
         to have safely claimed a group of alerts to analyze before moving
-        onward
+        onward. Waiting wakes up as soon as the previous investigation
+        notifies the group that it has been assigned.
+
+        When not blocking, the previous investigation is returned right away
+        even if it is still assigning events.
+
+        Groups without investigations continue from the other groups of the
+        same name, see `_get_sibling_investigation`.
 
         Returns
         -------
@@ -258,12 +777,19 @@ class Investigator(threading.Thread):
                 ),
             )
             investigation = query.first()
-            if investigation is None or investigation.is_assigned:
+            if investigation is None:
+                return self._get_sibling_investigation(session)
+            if investigation.is_assigned:
                 return investigation
         # Wait until the investigation has assigned itself events.
         backoff = ExponentialBackoff(after=1, initialize=True)
-        while not self.shutdown.wait(backoff.timeout):
+        # Investigators that don't block never wait long enough to need a
+        # listening connection.
+        wait = self._listener.wait if self.block else self.shutdown.wait
+        while not wait(backoff.timeout):
             with self._session(expire_on_commit=False) as session:
+                # Releases the investigation if its investigator crashed.
+                self._delete_stale_investigators(session)
                 investigation = session.query(db.Investigation).filter(
                     db.Investigation.group == self._group,
                 ).order_by(db.Investigation.created_at.desc()).first()
@@ -281,16 +807,85 @@ class Investigator(threading.Thread):
                         logger.exception(error)
                     backoff.reset(initialize=True)
                     continue
+                if not self.block:
+                    return investigation
                 logger.debug(
                     "Previous investigation still assigning trying again in "
                     "%.2f seconds", backoff.next(),
                 )
 
-    def _create_investigation(self) -> t.Tuple[
+    def _get_sibling_investigation(
+        self,
+        session: Session,
+    ) -> t.Optional[db.Investigation]:
+        """Retrieves where a new investigation group starts from.
+
+        Partition groups are created when partitioning is turned on or the
+        number of partitions changes. Instead of starting from the first
+        event of the profile, which would investigate and ship its whole
+        history again, they continue from the last assigned investigation
+        of the groups of the same name that were investigated most recently
+        with another number of partitions. Of those, the group that is
+        furthest behind is used, so no events are skipped.
+        """
+        groups = session.query(
+            db.InvestigationGroup.id, db.InvestigationGroup.name,
+        ).filter(
+            db.InvestigationGroup.profile_id == self.profile.model.id,
+            sa.or_(
+                db.InvestigationGroup.name == self.group,
+                db.InvestigationGroup.name.startswith(
+                    f"{self.group}[", autoescape=True,
+                ),
+            ),
+        )
+        if self.partition is None:
+            groups = groups.filter(db.InvestigationGroup.name != self.group)
+        else:
+            # Partitions of the same count start together.
+            groups = groups.filter(sa.not_(
+                db.InvestigationGroup.name.endswith(
+                    f"/{self.partition[1]}]", autoescape=True,
+                ),
+            ))
+        siblings: t.Dict[str, t.List[db.Investigation]] = {}
+        latest: t.Optional[t.Tuple[db.Investigation, str]] = None
+        for group_id, name in groups:
+            investigation = session.query(db.Investigation).filter(
+                db.Investigation.group_id == group_id,
+                db.Investigation.is_assigned.is_(True),
+            ).order_by(db.Investigation.created_at.desc()).first()
+            if investigation is None:
+                continue
+            # Groups are named `group[index/count]` when partitioned.
+            count = name[len(self.group):].rpartition('/')[2]
+            siblings.setdefault(count, []).append(investigation)
+            # IDs increase with creation, unlike timestamps they never tie.
+            if latest is None or investigation.id > latest[0].id:
+                latest = investigation, count
+        if latest is None:
+            return None
+        sibling = min(siblings[latest[1]], key=lambda investigation: (
+            investigation.window_end is not None, investigation.window_end,
+        ))
+        logger.info(
+            "Starting investigation group '%s' after investigation %d",
+            self.group_name, sibling.id,
+        )
+        return sibling
+
+    def _create_investigation(self) -> t.Optional[t.Tuple[
         db.Investigation, t.Optional[db.Investigation]
-    ]:
+    ]]:
         while not self.shutdown.is_set():
             previous = self._get_previous_investigation()
+            if self.shutdown.is_set():
+                return None
+            if not self.block and (
+                (previous is not None and not previous.is_assigned)
+                or not self.collector.ready(self.profile, previous)
+            ):
+                return None
             with self._session(expire_on_commit=False) as session:
                 investigation = db.Investigation(
                     created_by=self._model.id,
@@ -308,20 +903,19 @@ class Investigator(threading.Thread):
                     logger.exception(error)
 
     def _sync_group(self, session: Session) -> db.InvestigationGroup:
-        statement = pg.insert(db.InvestigationGroup).values(
-            profile_id=self.profile.model.id,
-            name=self.group,
-        ).on_conflict_do_nothing(
-            index_elements=[
+        get_storage(session).insert_ignore(
+            session, db.InvestigationGroup.__table__, [{
+                'profile_id': self.profile.model.id,
+                'name': self.group_name,
+            }], index_elements=[
                 db.InvestigationGroup.profile_id,
                 db.InvestigationGroup.name,
             ],
         )
-        session.execute(statement)
         session.commit()
         query = session.query(db.InvestigationGroup).filter(
             db.InvestigationGroup.profile_id == self.profile.model.id,
-            db.InvestigationGroup.name == self.group,
+            db.InvestigationGroup.name == self.group_name,
         )
         self._group = query.one()
         return self._group
@@ -330,6 +924,9 @@ class Investigator(threading.Thread):
 def parse_investigators(config: Config) -> t.List[Investigator]:
     """Parses a list of investigator from the YAML config.
 
+    Profiles configured with more than one partition get an investigator for
+    each partition.
+
     Parameters
     ----------
     config: Config
@@ -340,12 +937,21 @@ def parse_investigators(config: Config) -> t.List[Investigator]:
     List[Investigator]
         List of parsed investigators.
     """
-    profile_objects = parse_profiles(config, extras=['collector', 'analyzer'])
+    extras = ['collector', 'analyzer', 'partitions']
+    profile_objects = parse_profiles(config, extras=extras)
+    # Every partition syncs and collects with its own parsed objects.
+    partition_objects = [profile_objects]
     investigators = []
-    for value in profile_objects.values():
-        investigators.append(Investigator(
-            profile=value['profile'],
-            collector=value['collector'],
-            analyzer=value['analyzer'],
-        ))
+    for name, value in profile_objects.items():
+        partitions = value['partitions']
+        for index in range(partitions):
+            if index == len(partition_objects):
+                partition_objects.append(parse_profiles(config, extras=extras))
+            objects = partition_objects[index][name]
+            investigators.append(Investigator(
+                profile=objects['profile'],
+                collector=objects['collector'],
+                analyzer=objects['analyzer'],
+                partition=(index, partitions) if partitions > 1 else None,
+            ))
     return investigators
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+import typing as t
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait,
+)
+
+from scrywarden.investigator.base import Investigator
+
+logger = logging.getLogger(__name__)
+
+
+class InvestigationScheduler(threading.Thread):
+    """Runs the investigations of many investigators on a worker pool.
+
+    Instead of running every investigator in its own thread, the scheduler
+    runs single investigation steps of each investigator on a bounded thread
+    pool. Investigators are switched to not block, so a step returns right
+    away when the profile has nothing to investigate yet. Idle investigators
+    are retried after an interval, while investigators that found a window
+    of anomalies are stepped again right away.
+
+    When more investigators are due than there are free workers, the ones
+    with the largest backlog, measured from the end of their last
+    investigated window, go first.
+
+    Parameters
+    ----------
+    investigators: Iterable[Investigator]
+        Investigators to schedule. Their queue and session factory must be
+        set beforehand.
+    workers: int
+        Number of worker threads running investigation steps.
+    processes: int
+        Number of processes to run analyzers in. Defaults to 0, which runs
+        analyzers in the worker threads. Analyzers must be picklable to run
+        in a process pool.
+    interval: float
+        Number of seconds to wait before stepping an idle investigator again.
+    shutdown: Optional[threading.Event]
+        Threading event that indicates that shutdown is occurring.
+    """
+
+    def __init__(
+        self,
+        investigators: t.Iterable[Investigator] = (),
+        workers: int = 4,
+        processes: int = 0,
+        interval: float = 1.0,
+        shutdown: t.Optional[threading.Event] = None,
+    ):
+        super().__init__(name='InvestigationScheduler')
+        self.investigators: t.List[Investigator] = list(investigators)
+        self.workers: int = workers
+        self.processes: int = processes
+        self.interval: float = interval
+        self.shutdown: t.Optional[threading.Event] = shutdown
+
+    def run(self) -> None:
+        """Runs the scheduling loop until shutdown."""
+        analyzers = (
+            ProcessPoolExecutor(self.processes) if self.processes else None
+        )
+        for investigator in self.investigators:
+            investigator.block = False
+            investigator.executor = analyzers
+            investigator.shutdown = self.shutdown
+            investigator.setup()
+        logger.info(
+            "Scheduling %d investigators on %d workers",
+            len(self.investigators), self.workers,
+        )
+        executor = ThreadPoolExecutor(
+            self.workers, thread_name_prefix='Investigation',
+        )
+        due: t.Dict[Investigator, float] = {
+            investigator: 0.0 for investigator in self.investigators
+        }
+        running: t.Dict[Future, Investigator] = {}
+        while not self.shutdown.is_set():
+            self._submit(executor, due, running)
+            timeout = self._timeout(due, running)
+            if running:
+                done, _ = wait(
+                    running, timeout=timeout, return_when=FIRST_COMPLETED,
+                )
+            else:
+                self.shutdown.wait(timeout)
+                done = ()
+            for future in done:
+                investigator = running.pop(future)
+                try:
+                    investigated = future.result()
+                except Exception as error:
+                    logger.exception(error)
+                    investigated = False
+                due[investigator] = time.monotonic() + (
+                    0.0 if investigated else self.interval
+                )
+        logger.info("Waiting for running investigations to finish")
+        executor.shutdown(wait=True)
+        if analyzers is not None:
+            analyzers.shutdown()
+        for investigator in self.investigators:
+            investigator.teardown()
+        logger.info("Investigation scheduler has been shutdown")
+
+    def _submit(
+        self,
+        executor: ThreadPoolExecutor,
+        due: t.Dict[Investigator, float],
+        running: t.Dict[Future, Investigator],
+    ) -> None:
+        available = self.workers - len(running)
+        if available <= 0:
+            return
+        now = time.monotonic()
+        ready = [
+            investigator for investigator, at in due.items() if at <= now
+        ]
+        ready.sort(key=lambda investigator: investigator.backlog, reverse=True)
+        for investigator in ready[:available]:
+            del due[investigator]
+            running[executor.submit(investigator.step)] = investigator
+
+    def _timeout(
+        self,
+        due: t.Dict[Investigator, float],
+        running: t.Dict[Future, Investigator],
+    ) -> float:
+        # Nothing else can be submitted until a worker frees up.
+        if not due or len(running) >= self.workers:
+            return self.interval
+        timeout = min(due.values()) - time.monotonic()
+        return min(max(timeout, 0.0), self.interval)
@@ -0,0 +1,341 @@
+"""Versioned migrations of the database schema."""
+
+import logging
+import typing as t
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+
+from scrywarden import database as db
+from scrywarden.timing import benchmark
+
+if t.TYPE_CHECKING:
+    from scrywarden.partitioning import Partitioning
+
+logger = logging.getLogger(__name__)
+
+# Name of the advisory lock held while migrating.
+LOCK_NAME = 'scrywarden_migrations'
+
+# Number of rows updated per transaction when backfilling columns.
+BACKFILL_SIZE = 100000
+
+metadata = sa.MetaData()
+
+SchemaVersion = sa.Table(
+    'schema_version', metadata,
+    sa.Column('version', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('description', sa.String, nullable=False),
+    sa.Column(
+        'applied_at', sa.DateTime(timezone=True), nullable=False,
+        server_default=sa.func.now(),
+    ),
+)
+"""Migrations that were applied to the database."""
+
+
+class Migration(t.NamedTuple):
+    """Upgrade step of the database schema.
+
+    Steps are idempotent, since they also run on databases whose tables were
+    just created with the current schema. Transactional steps run inside a
+    transaction. Other steps run in autocommit mode so they can use
+    statements such as `CREATE INDEX CONCURRENTLY`.
+    """
+
+    version: int
+    description: str
+    upgrade: t.Callable[[Connection], None]
+    transactional: bool = True
+
+
+def migrate(
+    engine: Engine,
+    partitioning: t.Optional['Partitioning'] = None,
+) -> None:
+    """Brings the connected database up to the current schema version.
+
+    Creates the missing tables and then applies every migration newer than
+    the recorded schema version in order. Concurrent processes wait for
+    each other while migrating.
+
+    Migrations upgrade PostgreSQL databases created by earlier versions.
+    Other databases are always created with the current schema, so their
+    migrations are only recorded.
+
+    Parameters
+    ----------
+    engine: Engine
+        SQLAlchemy engine.
+    partitioning: Optional[Partitioning]
+        Partitioning of the event tables. When given, the event tables of
+        new databases are created as partitioned tables and their upcoming
+        partitions are created.
+    """
+    if engine.dialect.name != 'postgresql':
+        _migrate(engine, partitioning)
+        return
+    with engine.connect() as lock:
+        lock.execute(sa.select([
+            sa.func.pg_advisory_lock(sa.func.hashtext(LOCK_NAME)),
+        ]))
+        try:
+            _migrate(engine, partitioning)
+        finally:
+            lock.execute(sa.select([
+                sa.func.pg_advisory_unlock(sa.func.hashtext(LOCK_NAME)),
+            ]))
+
+
+def _migrate(
+    engine: Engine,
+    partitioning: t.Optional['Partitioning'],
+) -> None:
+    if partitioning is not None:
+        partitioning.create_tables(engine)
+    db.Base.metadata.create_all(engine)
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        version = connection.execute(
+            sa.select([sa.func.max(SchemaVersion.c.version)]),
+        ).scalar() or 0
+    pending = [
+        migration for migration in MIGRATIONS if migration.version > version
+    ]
+    if engine.dialect.name != 'postgresql':
+        with engine.begin() as connection:
+            for migration in pending:
+                _record(connection, migration)
+        return
+    if pending:
+        logger.info(
+            "Migrating database from version %d to %d", version,
+            pending[-1].version,
+        )
+    for migration in pending:
+        with benchmark() as elapsed:
+            _apply(engine, migration)
+            logger.info(
+                "Applied migration %d '%s' in %.2f seconds",
+                migration.version, migration.description, elapsed(),
+            )
+    if partitioning is not None:
+        with engine.begin() as connection:
+            partitioning.maintain(connection)
+
+
+def _apply(engine: Engine, migration: Migration) -> None:
+    if migration.transactional:
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            _record(connection, migration)
+        return
+    with engine.connect() as connection:
+        migration.upgrade(
+            connection.execution_options(isolation_level='AUTOCOMMIT'),
+        )
+    with engine.begin() as connection:
+        _record(connection, migration)
+
+
+def _record(connection: Connection, migration: Migration) -> None:
+    connection.execute(SchemaVersion.insert().values(
+        version=migration.version, description=migration.description,
+    ))
+
+
+def _columns(connection: Connection, table: str) -> t.Set[str]:
+    return {
+        column['name'] for column in sa.inspect(connection).get_columns(table)
+    }
+
+
+def _add_investigation_watermarks(connection: Connection) -> None:
+    """Adds and backfills the investigation watermark columns.
+
+    Existing investigations get their last event backfilled from their
+    assigned events once, when the columns are first added.
+    """
+    if 'last_event_id' in _columns(connection, db.Investigation.__tablename__):
+        return
+    connection.execute(sa.text("""
+        ALTER TABLE investigation
+            ADD COLUMN window_start TIMESTAMP WITH TIME ZONE,
+            ADD COLUMN window_end TIMESTAMP WITH TIME ZONE,
+            ADD COLUMN last_event_id BIGINT
+    """))
+    connection.execute(sa.text("""
+        UPDATE investigation
+        SET last_event_id = last_event.event_id
+        FROM (
+            SELECT DISTINCT ON (investigation_event.investigation_id)
+                investigation_event.investigation_id, event.event_id
+            FROM investigation_event
+            JOIN event ON event.event_id = investigation_event.event_id
+            ORDER BY
+                investigation_event.investigation_id,
+                event.created_at DESC,
+                event.event_id DESC
+        ) AS last_event
+        WHERE investigation.investigation_id = last_event.investigation_id
+    """))
+
+
+def _add_partition_keys(connection: Connection) -> None:
+    """Adds the creation time to the tables partitioned by it.
+
+    Rows that existed before get the time of the migration, which is only
+    used to place rows in partitions.
+    """
+    for table in (
+        db.Message.__tablename__, db.Anomaly.__tablename__,
+        db.InvestigationEvent.name,
+    ):
+        if 'created_at' in _columns(connection, table):
+            continue
+        connection.execute(sa.text(f"""
+            ALTER TABLE {table} ADD COLUMN created_at
+                TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        """))
+
+
+def _add_query_indexes(connection: Connection) -> None:
+    """Creates the indexes the collector and investigator queries rely on.
+
+    Anomalies are looked up by event through their unique event and field
+    index, so they don't get a separate event index.
+    """
+    for name in (
+        'ix_event_actor_id_created_at',
+        'ix_investigation_investigation_group_id_created_at',
+        'ix_investigation_event_event_id',
+    ):
+        _create_index(connection, name)
+
+
+def _add_event_profiles(connection: Connection) -> None:
+    """Stores the profile of the actor on every event.
+
+    Existing events are backfilled in batches that are committed one at a
+    time, so the backfill neither holds locks on the whole table nor starts
+    over when interrupted.
+    """
+    if 'profile_id' not in _columns(connection, db.Event.__tablename__):
+        connection.execute(sa.text("""
+            ALTER TABLE event ADD COLUMN profile_id INTEGER
+                REFERENCES profile (profile_id) ON DELETE CASCADE
+        """))
+    first, last = connection.execute(sa.text("""
+        SELECT min(event_id), max(event_id) FROM event
+        WHERE profile_id IS NULL
+    """)).first()
+    if first is not None:
+        logger.info("Backfilling the profiles of events %d to %d", first, last)
+    for start in range(first or 0, (last or -1) + 1, BACKFILL_SIZE):
+        connection.execute(sa.text("""
+            UPDATE event SET profile_id = actor.profile_id
+            FROM actor
+            WHERE actor.actor_id = event.actor_id
+                AND event.profile_id IS NULL
+                AND event.event_id >= :start AND event.event_id < :end
+        """), start=start, end=start + BACKFILL_SIZE)
+    connection.execute(sa.text(
+        'ALTER TABLE event ALTER COLUMN profile_id SET NOT NULL',
+    ))
+    _create_index(connection, 'ix_event_profile_id_created_at')
+
+
+def _add_feature_hashes(connection: Connection) -> None:
+    """Makes features unique by the hash of their value.
+
+    Existing features are backfilled in committed batches before the hash
+    index replaces the unique constraint on the full value.
+    """
+    if 'value_hash' not in _columns(connection, db.Feature.__tablename__):
+        connection.execute(sa.text(
+            'ALTER TABLE feature ADD COLUMN value_hash BIGINT',
+        ))
+    update = db.Feature.__table__.update().values(
+        value_hash=db.hash_value_sql(db.Feature.value),
+    ).where(db.Feature.value_hash.is_(None))
+    first, last = connection.execute(sa.text("""
+        SELECT min(feature_id), max(feature_id) FROM feature
+        WHERE value_hash IS NULL
+    """)).first()
+    if first is not None:
+        logger.info("Hashing the values of features %d to %d", first, last)
+    for start in range(first or 0, (last or -1) + 1, BACKFILL_SIZE):
+        connection.execute(update.where(
+            db.Feature.id.between(start, start + BACKFILL_SIZE - 1),
+        ))
+    # Catch features created while backfilling.
+    connection.execute(update)
+    connection.execute(sa.text(
+        'ALTER TABLE feature ALTER COLUMN value_hash SET NOT NULL',
+    ))
+    _create_index(connection, 'ux_feature_field_id_actor_id_value_hash')
+    connection.execute(sa.text("""
+        ALTER TABLE feature
+            DROP CONSTRAINT IF EXISTS feature_field_id_actor_id_value_key
+    """))
+
+
+def _add_investigator_heartbeats(connection: Connection) -> None:
+    """Adds the heartbeat time of running investigators."""
+    if 'heartbeat_at' in _columns(connection, db.Investigator.__tablename__):
+        return
+    connection.execute(sa.text("""
+        ALTER TABLE investigator ADD COLUMN heartbeat_at
+            TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    """))
+
+
+def _create_index(connection: Connection, name: str) -> None:
+    """Creates a model index if it does not exist yet.
+
+    Indexes are built concurrently so events can still be written while
+    they are built. Partitioned tables don't support building concurrently
+    and build the index on every partition instead. Indexes left invalid by
+    an interrupted build are dropped the same way and rebuilt.
+    """
+    index = next(
+        index for table in db.Base.metadata.tables.values()
+        for index in table.indexes if index.name == name
+    )
+    valid = connection.execute(sa.text("""
+        SELECT pg_index.indisvalid FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name
+    """), name=name).scalar()
+    if valid:
+        return
+    partitioned = connection.execute(sa.text("""
+        SELECT relkind = 'p' FROM pg_class WHERE relname = :name
+    """), name=index.table.name).scalar()
+    concurrently = '' if partitioned else 'CONCURRENTLY '
+    if valid is not None:
+        logger.warning("Rebuilding invalid index %s", name)
+        connection.execute(sa.text(f'DROP INDEX {concurrently}"{name}"'))
+    columns = ', '.join(column.name for column in index.columns)
+    logger.info("Creating index %s", name)
+    connection.execute(sa.text(
+        f"CREATE {'UNIQUE ' if index.unique else ''}INDEX {concurrently}"
+        f'"{name}" ON {index.table.name} ({columns})',
+    ))
+
+
+MIGRATIONS: t.List[Migration] = [
+    Migration(1, 'investigation watermarks', _add_investigation_watermarks),
+    Migration(2, 'partition keys', _add_partition_keys),
+    Migration(
+        3, 'query indexes', _add_query_indexes, transactional=False,
+    ),
+    Migration(
+        4, 'event profiles', _add_event_profiles, transactional=False,
+    ),
+    Migration(
+        5, 'feature hashes', _add_feature_hashes, transactional=False,
+    ),
+    Migration(6, 'investigator heartbeats', _add_investigator_heartbeats),
+]
+"""Migrations of the database schema in the order they are applied."""
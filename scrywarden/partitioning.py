@@ -0,0 +1,401 @@
+"""Manages the time partitioned tables of the event data."""
+
+import logging
+import typing as t
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+
+from scrywarden import database as db
+from scrywarden.config import parsers, Config
+from scrywarden.config.exceptions import ValidationError
+from scrywarden.missing import MISSING
+
+logger = logging.getLogger(__name__)
+
+# Name suffix formats of the partitions of each interval. Weekly partitions
+# are named after the Monday they start on.
+INTERVALS = {
+    'day': '%Y%m%d',
+    'week': '%Y%m%d',
+    'month': '%Y%m',
+}
+
+TABLES: t.Dict[str, str] = {
+    db.Message.__tablename__: """
+        CREATE TABLE message (
+            message_id UUID NOT NULL,
+            data JSONB,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (message_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """,
+    db.Event.__tablename__: """
+        CREATE TABLE event (
+            event_id BIGSERIAL NOT NULL,
+            message_id UUID NOT NULL,
+            actor_id INTEGER NOT NULL
+                REFERENCES actor (actor_id) ON DELETE CASCADE,
+            profile_id INTEGER NOT NULL
+                REFERENCES profile (profile_id) ON DELETE CASCADE,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (event_id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE INDEX ix_event_created_at ON event (created_at)
+    """,
+    db.Anomaly.__tablename__: """
+        CREATE TABLE anomaly (
+            anomaly_id BIGSERIAL NOT NULL,
+            event_id BIGINT NOT NULL,
+            field_id INTEGER NOT NULL
+                REFERENCES field (field_id) ON DELETE CASCADE,
+            feature_id INTEGER NOT NULL
+                REFERENCES feature (feature_id) ON DELETE CASCADE,
+            score FLOAT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (anomaly_id, created_at),
+            UNIQUE (event_id, field_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """,
+    db.InvestigationEvent.name: """
+        CREATE TABLE investigation_event (
+            investigation_id INTEGER NOT NULL
+                REFERENCES investigation (investigation_id)
+                ON DELETE CASCADE,
+            event_id BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            UNIQUE (investigation_id, event_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """,
+}
+"""Partitioned table definitions of the event data.
+
+Primary keys and unique constraints of partitioned tables must contain the
+partition key, so foreign keys to the partitioned tables are left out. Rows
+of the same event are kept in partitions of the same time range by giving
+them the creation time of the event.
+"""
+
+# Name of the advisory lock held while changing partitions.
+LOCK_NAME = 'scrywarden_partitions'
+
+
+def is_valid_interval(value: str) -> None:
+    """Determines if the partition interval in the config is supported."""
+    if value not in INTERVALS:
+        raise ValidationError(
+            f"{value!r} is not a valid interval, expected one of "
+            f"{', '.join(map(repr, INTERVALS))}",
+        )
+
+
+class Partitioning:
+    """Partitions the event data tables by time range.
+
+    The message, event, anomaly and investigation event tables only grow, so
+    they are created as PostgreSQL range partitioned tables on the time the
+    event was created. Partitions are created ahead of time and on demand
+    when older data arrives. Instead of deleting old rows, whole partitions
+    past the retention are dropped, which does not leave any dead rows for
+    vacuum to clean up.
+
+    Partitioning is only applied when the tables are created. Existing
+    databases keep their tables and are left untouched.
+
+    Parameters
+    ----------
+    interval: str
+        Time range of each partition, either `day`, `week` or `month`.
+        Defaults to `day`.
+    premake: int
+        Number of future partitions to keep created. Defaults to 3.
+    retention: int
+        Number of days to keep the event data for. Partitions that ended
+        before then are dropped. Defaults to 0, which keeps everything.
+    check_interval: float
+        Number of seconds between partition maintenance runs. Defaults to
+        1 hour.
+    """
+    PARSER = parsers.Options({
+        'interval': parsers.String(validators=[is_valid_interval]),
+        'premake': parsers.Integer(),
+        'retention': parsers.Integer(),
+        'check_interval': parsers.Float(),
+    })
+
+    def __init__(
+        self,
+        interval: str = 'day',
+        premake: int = 3,
+        retention: int = 0,
+        check_interval: float = 3600.,
+    ):
+        self.interval: str = interval
+        self.premake: int = premake
+        self.retention: int = retention
+        self.check_interval: float = check_interval
+        self._partitions: t.Set[datetime] = set()
+
+    def configure(self, config: Config) -> Config:
+        config = config.parse(self.PARSER)
+        self.interval = config.get_value('interval', self.interval)
+        self.premake = config.get_value('premake', self.premake)
+        self.retention = config.get_value('retention', self.retention)
+        self.check_interval = config.get_value(
+            'check_interval', self.check_interval,
+        )
+        return config
+
+    def period(self, timestamp: datetime) -> t.Tuple[datetime, datetime]:
+        """Returns the time range of the partition containing a timestamp.
+
+        Parameters
+        ----------
+        timestamp: datetime
+            Timezone aware timestamp.
+
+        Returns
+        -------
+        Tuple[datetime, datetime]
+            Inclusive start and exclusive end of the partition in UTC.
+        """
+        start = timestamp.astimezone(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0,
+        )
+        if self.interval == 'day':
+            return start, start + timedelta(days=1)
+        if self.interval == 'week':
+            start -= timedelta(days=start.weekday())
+            return start, start + timedelta(weeks=1)
+        start = start.replace(day=1)
+        return start, (start + timedelta(days=32)).replace(day=1)
+
+    def partition_name(self, table: str, start: datetime) -> str:
+        """Returns the name of the partition of a table starting at a time."""
+        return f'{table}_p{start:{INTERVALS[self.interval]}}'
+
+    def partition_start(
+        self,
+        table: str,
+        name: str,
+    ) -> t.Optional[datetime]:
+        """Parses the start of a partition from its name.
+
+        Returns None for partitions that were not created by this class.
+        """
+        prefix = f'{table}_p'
+        if not name.startswith(prefix):
+            return None
+        try:
+            start = datetime.strptime(
+                name[len(prefix):], INTERVALS[self.interval],
+            ).replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+        if self.period(start)[0] != start:
+            return None
+        return start
+
+    def create_tables(self, engine: Engine) -> None:
+        """Creates the partitioned tables if the database has none yet.
+
+        Tables the partitioned tables reference are created first. Called
+        by `scrywarden.migrations.migrate` before the remaining tables are
+        created.
+
+        Parameters
+        ----------
+        engine: Engine
+            SQLAlchemy engine.
+        """
+        if engine.dialect.name != 'postgresql':
+            logger.warning(
+                "Partitioning is only supported on PostgreSQL, skipping",
+            )
+            return
+        with engine.begin() as connection:
+            existing = set(sa.inspect(connection).get_table_names())
+            missing = [name for name in TABLES if name not in existing]
+            if not missing:
+                return
+            if len(missing) < len(TABLES):
+                logger.warning(
+                    "Tables %s already exist without partitioning, "
+                    "partitioning is only applied to new databases",
+                    ', '.join(sorted(TABLES.keys() - set(missing))),
+                )
+                return
+            db.Base.metadata.create_all(connection, tables=[
+                table for table in db.Base.metadata.sorted_tables
+                if table.name not in TABLES
+            ])
+            for name in missing:
+                logger.info("Creating partitioned table %s", name)
+                connection.execute(sa.text(TABLES[name]))
+
+    def is_partitioned(self, connection: Connection) -> bool:
+        """Returns if the event tables of the database are partitioned."""
+        if connection.dialect.name != 'postgresql':
+            return False
+        return bool(connection.execute(sa.text("""
+            SELECT count(*) FROM pg_class
+            WHERE relname = :name AND relkind = 'p'
+        """), name=db.Event.__tablename__).scalar())
+
+    def maintain(
+        self,
+        connection: Connection,
+        now: t.Optional[datetime] = None,
+    ) -> None:
+        """Creates the upcoming partitions and drops the expired ones.
+
+        Parameters
+        ----------
+        connection: Connection
+            SQLAlchemy connection inside of a transaction.
+        now: datetime
+            Current time. Defaults to the current UTC time.
+        """
+        if not self.is_partitioned(connection):
+            return
+        now = now or datetime.now(timezone.utc)
+        self._lock_partitions(connection)
+        partitions = self._get_partitions(connection)
+        existing = set.intersection(*partitions.values())
+        start, end = self.period(now)
+        for _ in range(self.premake + 1):
+            self._create_partition(connection, start, end, existing)
+            start, end = end, self.period(end)[1]
+        expired = self.expired(set.union(*partitions.values()), now)
+        for start in sorted(expired):
+            for table, starts in partitions.items():
+                if start not in starts:
+                    continue
+                name = self.partition_name(table, start)
+                logger.info("Dropping expired partition %s", name)
+                connection.execute(sa.text(f'DROP TABLE "{name}"'))
+            existing.discard(start)
+        self._partitions = existing
+
+    def expired(
+        self,
+        starts: t.Iterable[datetime],
+        now: datetime,
+    ) -> t.Set[datetime]:
+        """Returns the partition starts that are past the retention.
+
+        A partition only expires once all of its time range is older than
+        the retention.
+        """
+        if self.retention <= 0:
+            return set()
+        cutoff = now - timedelta(days=self.retention)
+        return {
+            start for start in starts if self.period(start)[1] <= cutoff
+        }
+
+    def ensure(
+        self,
+        connection: Connection,
+        timestamps: t.Iterable[datetime],
+    ) -> None:
+        """Makes sure partitions exist for the given timestamps.
+
+        Partitions that are already known are skipped without querying the
+        database, so this is cheap when the data falls in the partitions
+        created ahead of time. Known partitions past the retention are
+        checked again, since another process may have dropped them.
+
+        Parameters
+        ----------
+        connection: Connection
+            SQLAlchemy connection.
+        timestamps: Iterable[datetime]
+            Creation times of the rows about to be inserted.
+        """
+        self._partitions -= self.expired(
+            self._partitions, datetime.now(timezone.utc),
+        )
+        periods = {
+            period for period in map(self.period, timestamps)
+            if period[0] not in self._partitions
+        }
+        if not periods or not self.is_partitioned(connection):
+            return
+        self._lock_partitions(connection)
+        existing = set.intersection(
+            *self._get_partitions(connection).values(),
+        )
+        for start, end in sorted(periods):
+            self._create_partition(connection, start, end, existing)
+        self._partitions.update(existing)
+
+    def _lock_partitions(self, connection: Connection) -> None:
+        connection.execute(sa.select([
+            sa.func.pg_advisory_xact_lock(sa.func.hashtext(LOCK_NAME)),
+        ]))
+
+    def _get_partitions(
+        self,
+        connection: Connection,
+    ) -> t.Dict[str, t.Set[datetime]]:
+        """Returns the starts of the partitions of each table."""
+        rows = connection.execute(sa.text("""
+            SELECT parent.relname, child.relname
+            FROM pg_inherits
+            JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname IN :tables
+        """).bindparams(sa.bindparam('tables', expanding=True)), tables=[
+            *TABLES,
+        ]).fetchall()
+        partitions: t.Dict[str, t.Set[datetime]] = {
+            table: set() for table in TABLES
+        }
+        for table, name in rows:
+            start = self.partition_start(table, name)
+            if start is not None:
+                partitions[table].add(start)
+        return partitions
+
+    def _create_partition(
+        self,
+        connection: Connection,
+        start: datetime,
+        end: datetime,
+        existing: t.Set[datetime],
+    ) -> None:
+        if start in existing:
+            return
+        for table in TABLES:
+            name = self.partition_name(table, start)
+            logger.info("Creating partition %s", name)
+            connection.execute(sa.text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {table} '
+                f"FOR VALUES FROM ('{start.isoformat()}') "
+                f"TO ('{end.isoformat()}')",
+            ))
+        existing.add(start)
+
+
+def parse_partitioning(config: Config) -> t.Optional[Partitioning]:
+    """Parses the partitioning of the database config.
+
+    Parameters
+    ----------
+    config: Config
+        Database configuration object.
+
+    Returns
+    -------
+    Optional[Partitioning]
+        Configured partitioning, or None if the config has no partitioning
+        section.
+    """
+    config = config.get('partitioning')
+    if config.value is MISSING:
+        return None
+    partitioning = Partitioning()
+    partitioning.configure(config)
+    return partitioning
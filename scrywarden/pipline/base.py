@@ -6,17 +6,20 @@ from queue import Queue
 from uuid import UUID, uuid4
 
 import pandas as pa
-import sqlalchemy.dialects.postgresql as pg
 from sqlalchemy.orm import Session, sessionmaker
 
 import scrywarden.database as db
 from scrywarden.pipline.entry import PipelineEntry
+from scrywarden.pipline.router import Router
 from scrywarden.entry import Entry
+from scrywarden.partitioning import Partitioning
 from scrywarden.config import parsers, Config
 from scrywarden.timing import benchmark
 from scrywarden.transport.entry import TransportEntry
 from scrywarden.transport.message import Message
 from scrywarden.profile.base import Profile, sync_profiles
+from scrywarden.profile.extraction import ExtractionPlan
+from scrywarden.storage import get_storage
 from scrywarden.transport.base import Transport
 
 logger = logging.getLogger(__name__)
@@ -49,10 +52,30 @@ class Pipeline:
         after a message is first received in the queue. This helps to keep
         messages moving at a steady pace even before the queue limit is
         reached.
+    index_messages: bool
+        If messages should build a flattened field index before being
+        identified by the profiles. Speeds up lookups when many profiles
+        inspect the same messages. Defaults to False.
+    partitioning: Optional[Partitioning]
+        Partitioning of the event tables. When given, partitions are created
+        for the processed messages before they are inserted and expired
+        partitions are dropped every `check_interval` seconds.
+    feature_deltas: bool
+        If feature counts should be incremented by appending deltas to the
+        `feature_delta` table instead of updating the feature rows. Avoids
+        pipelines waiting on each other to update popular features.
+        Defaults to False.
+    compact_interval: float
+        Number of seconds between merging the pending feature deltas into
+        the feature counts. Defaults to 60 seconds. Only used with feature
+        deltas.
     """
     PARSER = parsers.Options({
         'queue_size': parsers.Integer(),
         'timeout': parsers.Float(),
+        'index_messages': parsers.Boolean(),
+        'feature_deltas': parsers.Boolean(),
+        'compact_interval': parsers.Float(),
     })
 
     def __init__(
@@ -62,19 +85,31 @@ class Pipeline:
         session_factory: sessionmaker,
         queue_size: int = 500,
         timeout: float = 10.0,
+        index_messages: bool = False,
+        partitioning: t.Optional[Partitioning] = None,
+        feature_deltas: bool = False,
+        compact_interval: float = 60.0,
     ):
         self.transports: t.List[Transport] = list(transports)
         self.profiles: t.Tuple[Profile, ...] = tuple(profiles)
+        self._router: Router = Router(self.profiles)
+        self._plan: ExtractionPlan = ExtractionPlan(self.profiles)
         self._profiles_by_id: t.Dict[int, Profile] = {}
         self._session_factory: sessionmaker = session_factory
         self._queue_size: int = queue_size
         self._queue: 't.Optional[Queue[Entry]]' = None
         self._timeout_length: float = timeout
+        self._index_messages: bool = index_messages
         self._timeout: threading.Event = threading.Event()
         self._shutdown: threading.Event = threading.Event()
         self._process_id: UUID = uuid4()
         self._timer: t.Optional[threading.Timer] = None
         self._messages: t.List[Message] = []
+        self._partitioning: t.Optional[Partitioning] = partitioning
+        self._next_maintenance: float = 0.0
+        self._feature_deltas: bool = feature_deltas
+        self._compact_interval: float = compact_interval
+        self._next_compaction: float = 0.0
 
     def configure(self, config: Config) -> Config:
         """Configures the pipeline according to the YAML config.
@@ -94,6 +129,15 @@ class Pipeline:
         self._timeout_length = config.get_value(
             'timeout', self._timeout_length,
         )
+        self._index_messages = config.get_value(
+            'index_messages', self._index_messages,
+        )
+        self._feature_deltas = config.get_value(
+            'feature_deltas', self._feature_deltas,
+        )
+        self._compact_interval = config.get_value(
+            'compact_interval', self._compact_interval,
+        )
         return config
 
     def start(self):
@@ -158,14 +202,18 @@ class Pipeline:
         self._cancel_timeout()
         messages = self._messages
         self._messages = []
+        if self._index_messages:
+            messages = [message.with_index() for message in messages]
         logger.info("Processing %d messages", len(messages))
         dfs: t.List[pa.DataFrame] = []
         indexed_messages: t.Dict[int, Message] = {
             message.id.int: message for message in messages
         }
         with benchmark() as elapsed:
+            routed = self._router.dispatch(messages)
+            batch = self._plan.batch(messages)
             for profile in self.profiles:
-                dfs.append(profile.identify(messages))
+                dfs.append(profile.identify(routed[profile], batch=batch))
             logger.info(
                 "%d messages identified between %d profiles in %.2f seconds",
                 len(messages), len(self.profiles), elapsed(),
@@ -206,6 +254,8 @@ class Pipeline:
         scored_values = pa.concat(scored_values, ignore_index=True)
         anomalies = scored_values[scored_values['score'] > 0.0]
         logger.debug("Anomalies\n%s", anomalies)
+        if self._partitioning is not None:
+            self._maintain_partitions(anomalies)
         with self._session() as session:
             features = self._update_features(session, values).drop(
                 columns=['count'],
@@ -217,7 +267,18 @@ class Pipeline:
                 features, 'left', left_on=['field_id', 'actor_id', 'value'],
                 right_index=True,
             )
+            collisions = anomalies['feature_id'].isna()
+            if collisions.any():
+                logger.warning(
+                    "Skipping %d anomalies of values whose hash collides "
+                    "with another feature value", collisions.sum(),
+                )
+                anomalies = anomalies[~collisions]
             self._generate_events(session, indexed_messages, anomalies)
+        if self._feature_deltas and (
+            time.monotonic() >= self._next_compaction
+        ):
+            self._compact_features()
 
     def _generate_events(
         self,
@@ -225,6 +286,7 @@ class Pipeline:
         messages: t.Dict[int, Message],
         anomalies: pa.DataFrame,
     ) -> None:
+        storage = get_storage(session)
         message_ids = anomalies['message_id'].drop_duplicates()
         message_values = []
         for message_id in message_ids.values:
@@ -232,13 +294,15 @@ class Pipeline:
             message_values.append({
                 'message_id': str(message.id),
                 'data': message.data,
+                'created_at': message.timestamp,
             })
         if message_values:
-            statement = pg.insert(db.Message.__table__).values(
-                message_values,
-            ).on_conflict_do_nothing(index_elements=[db.Message.id])
             with benchmark() as elapsed:
-                session.execute(statement)
+                # Partitioned messages are unique with their creation time,
+                # so any conflicting message is skipped.
+                storage.insert_ignore(
+                    session, db.Message.__table__, message_values,
+                )
                 logger.info(
                     "%d messages upserted in %.2f seconds",
                     len(message_values), elapsed(),
@@ -260,34 +324,81 @@ class Pipeline:
                     events.append({
                         'message_id': str(UUID(int=message_id)),
                         'actor_id': int(actor_id),
+                        'profile_id': int(profile_id),
                         'created_at': timestamp.to_pydatetime(),
                     })
                     event_anomalies.append(anomaly_instances)
         if events:
             with benchmark() as elapsed:
-                result = session.execute(
-                    pg.insert(db.Event.__table__).returning(
-                        db.Event.id,
-                    ).values(events),
+                event_ids = storage.insert_returning(
+                    session, db.Event.__table__, events, db.Event.id,
                 )
                 logger.info(
                     "%d events created in %.2f seconds", len(events),
                     elapsed(),
                 )
             flattened_anomalies = []
-            for index, row in enumerate(result):
+            for index, event_id in enumerate(event_ids):
                 for instance in event_anomalies[index]:
-                    instance['event_id'] = row[0]
+                    instance['event_id'] = event_id
+                    instance['created_at'] = events[index]['created_at']
                     flattened_anomalies.append(instance)
             del event_anomalies
             with benchmark() as elapsed:
-                session.execute(pg.insert(db.Anomaly.__table__).values(
-                    flattened_anomalies,
-                ))
+                storage.insert(
+                    session, db.Anomaly.__table__, flattened_anomalies,
+                )
                 logger.info(
                     "%d event anomalies created in %.2f seconds",
                     len(flattened_anomalies), elapsed(),
                 )
+            # Notifications are only delivered once the session commits, so
+            # collectors never wake up before the events are visible.
+            for profile_id in anomalies['profile_id'].unique():
+                db.notify(
+                    session, db.channel(db.EVENTS_CHANNEL, int(profile_id)),
+                )
+
+    def _maintain_partitions(self, anomalies: pa.DataFrame) -> None:
+        """Makes sure the partitions of the anomalies exist.
+
+        Also drops the expired partitions when maintenance is due.
+        """
+        timestamps = anomalies['timestamp'].drop_duplicates()
+        with self._session() as session:
+            connection = session.connection()
+            if time.monotonic() >= self._next_maintenance:
+                with benchmark() as elapsed:
+                    self._partitioning.maintain(connection)
+                    logger.info(
+                        "Partitions maintained in %.2f seconds", elapsed(),
+                    )
+                self._next_maintenance = (
+                    time.monotonic() + self._partitioning.check_interval
+                )
+            self._partitioning.ensure(
+                connection, timestamps.dt.to_pydatetime(),
+            )
+
+    def _compact_features(self) -> None:
+        """Merges the pending feature deltas into the feature counts.
+
+        Each transaction merges a bounded number of deltas, so compacting a
+        large backlog doesn't hold the feature locks for long.
+        """
+        with benchmark() as elapsed:
+            total = 0
+            while True:
+                with self._session() as session:
+                    merged = db.compact_features(session)
+                total += merged
+                if merged < db.COMPACT_SIZE:
+                    break
+            logger.info(
+                "%d feature deltas compacted in %.2f seconds", total,
+                elapsed(),
+            )
+        self._next_compaction = time.monotonic() + self._compact_interval
 
     def _update_features(
         self,
@@ -306,17 +417,22 @@ class Pipeline:
                 'field_id': int(field_id),
                 'actor_id': int(actor_id),
                 'value': value,
+                'value_hash': db.hash_value(value),
                 'count': int(row['value_count']),
             })
-        statement = pg.insert(db.Feature.__table__).values(updates)
-        statement = statement.on_conflict_do_update(
-            index_elements=[
-                db.Feature.field_id, db.Feature.actor_id, db.Feature.value,
-            ],
-            set_={'count': db.Feature.count + statement.excluded.count},
-        )
+        if self._feature_deltas:
+            return self._add_feature_deltas(session, values, updates)
         with benchmark() as elapsed:
-            session.execute(statement)
+            # Values whose hash collides with a different value are skipped
+            # instead of adding to the count of the other value.
+            get_storage(session).add_counts(
+                session, db.Feature.__table__, updates,
+                index_elements=[
+                    db.Feature.field_id, db.Feature.actor_id,
+                    db.Feature.value_hash,
+                ],
+                count=db.Feature.count, verify=[db.Feature.value],
+            )
             logger.info(
                 "%d features updated in %.2f seconds", len(updates), elapsed(),
             )
@@ -324,6 +440,55 @@ class Pipeline:
             session, values['field_id'], values['actor_id'],
         )
 
+    def _add_feature_deltas(
+        self,
+        session: Session,
+        values: pa.DataFrame,
+        updates: t.List[t.Dict[str, t.Any]],
+    ) -> pa.DataFrame:
+        """Appends the feature count increments as feature deltas.
+
+        Missing features are created with a count of zero first. Existing
+        feature rows are never updated, so no row locks are taken on them.
+        """
+        storage = get_storage(session)
+        with benchmark() as elapsed:
+            storage.insert_ignore(
+                session, db.Feature.__table__,
+                [{**update, 'count': 0} for update in updates],
+                index_elements=[
+                    db.Feature.field_id, db.Feature.actor_id,
+                    db.Feature.value_hash,
+                ],
+            )
+            features = self._get_features(
+                session, values['field_id'], values['actor_id'],
+            )
+            feature_ids = dict(zip(
+                zip(
+                    features['field_id'], features['actor_id'],
+                    features['value'],
+                ),
+                features['feature_id'],
+            ))
+            deltas = []
+            for update in updates:
+                key = (update['field_id'], update['actor_id'], update['value'])
+                # Values whose hash collides with a different value have no
+                # feature of their own and are skipped.
+                if key in feature_ids:
+                    deltas.append({
+                        'feature_id': int(feature_ids[key]),
+                        'count': update['count'],
+                    })
+            if deltas:
+                storage.insert(session, db.FeatureDelta.__table__, deltas)
+            logger.info(
+                "%d feature deltas added in %.2f seconds", len(deltas),
+                elapsed(),
+            )
+        return features
+
     def _get_features(
         self,
         session: Session,
@@ -365,7 +530,7 @@ class Pipeline:
             db.Feature.field_id.label('field_id'),
             db.Feature.actor_id.label('actor_id'),
             db.Feature.value.label('value'),
-            db.Feature.count.label('count'),
+            db.feature_count().label('count'),
         ).filter(
             db.Feature.field_id.in_(
                 field_ids.drop_duplicates().values.astype('object'),
@@ -390,14 +555,15 @@ class Pipeline:
         values: pa.DataFrame,
     ) -> pa.DataFrame:
         unique_pa = values[['profile_id', 'actor_name']].drop_duplicates()
-        statement = pg.insert(db.Actor.__table__).values([
+        actors = [
             {'profile_id': row['profile_id'], 'name': row['actor_name']}
             for _, row in unique_pa.iterrows()
-        ]).on_conflict_do_nothing(
-            index_elements=[db.Actor.profile_id, db.Actor.name],
-        )
+        ]
         with benchmark() as elapsed:
-            session.execute(statement)
+            get_storage(session).insert_ignore(
+                session, db.Actor.__table__, actors,
+                index_elements=[db.Actor.profile_id, db.Actor.name],
+            )
             session.commit()
             logger.info(
                 "%d actors upserted in %.2f seconds", len(unique_pa),
@@ -473,8 +639,7 @@ class Pipeline:
         if source == TransportEntry.SOURCE:
             logger.debug("Received transport entry")
             if kind == TransportEntry.Types.MESSAGE:
-                logger.debug(
-                    "Received transport message %s %s", data.id, data.data)
+                logger.debug("Received transport message %s", data.id)
                 self._messages.append(data)
                 return self._start_timeout()
             if kind == TransportEntry.Types.SHUTDOWN:
@@ -0,0 +1,87 @@
+"""Contains the routing index that dispatches messages to profiles."""
+
+import typing as t
+
+from scrywarden.profile.base import Profile
+from scrywarden.transport.message import Message
+
+
+class Router:
+    """Dispatches messages only to the profiles that can match them.
+
+    Profiles declaring a `ROUTE` are indexed by their route field and values,
+    so finding the candidate profiles of a message is a dictionary lookup per
+    route field instead of a `matches` call per profile. Profiles without a
+    route are candidates for every message. Candidates are then filtered by
+    their `REQUIRES` fields.
+
+    Parameters
+    ----------
+    profiles: Iterable[Profile]
+        Profiles to route messages to.
+    """
+    def __init__(self, profiles: t.Iterable[Profile]):
+        self.profiles: t.Tuple[Profile, ...] = tuple(profiles)
+        self._unrouted: t.List[Profile] = []
+        self._routes: t.Dict[
+            t.Tuple[str, ...], t.Dict[t.Any, t.List[Profile]],
+        ] = {}
+        for profile in self.profiles:
+            if profile.ROUTE is None:
+                self._unrouted.append(profile)
+                continue
+            key = profile.ROUTE.key
+            key = (key,) if isinstance(key, str) else tuple(key)
+            table = self._routes.setdefault(key, {})
+            for value in profile.ROUTE.values:
+                table.setdefault(value, []).append(profile)
+
+    def candidates(self, message: Message) -> t.List[Profile]:
+        """Returns the profiles a message can be dispatched to.
+
+        Parameters
+        ----------
+        message: Message
+            Message to route.
+
+        Returns
+        -------
+        List[Profile]
+            Profiles whose routing declarations the message satisfies.
+        """
+        profiles = [*self._unrouted]
+        for key, table in self._routes.items():
+            try:
+                profiles.extend(table.get(message.get(key), ()))
+            except TypeError:
+                # Unhashable JSON values can never match a route value.
+                continue
+        return [
+            profile for profile in profiles
+            if all(key in message for key in profile.REQUIRES)
+        ]
+
+    def dispatch(
+        self,
+        messages: t.Iterable[Message],
+    ) -> t.Dict[Profile, t.List[Message]]:
+        """Groups messages by the profiles they can be dispatched to.
+
+        Parameters
+        ----------
+        messages: Iterable[Message]
+            Messages to route.
+
+        Returns
+        -------
+        Dict[Profile, List[Message]]
+            Routed messages indexed by profile. Every profile is present even
+            if no messages were routed to it.
+        """
+        routed: t.Dict[Profile, t.List[Message]] = {
+            profile: [] for profile in self.profiles
+        }
+        for message in messages:
+            for profile in self.candidates(message):
+                routed[profile].append(message)
+        return routed
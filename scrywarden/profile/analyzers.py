@@ -18,20 +18,53 @@ class Analyzer:
     ----------
     session_factory: Optional[sessionmaker]
         SQLAlchemy session factory.
+    replica: Optional[Replica]
+        Read replica to read from while it is caught up with the primary.
 
     Attributes
     ----------
     session_factory: Optional[sessionmaker]
         SQLAlchemy session factory.
+    replica: Optional[Replica]
+        Read replica to read from.
     """
     PARSER: t.Optional[parsers.Parser] = None
 
-    def __init__(self, session_factory: t.Optional[sessionmaker] = None):
+    def __init__(
+        self,
+        session_factory: t.Optional[sessionmaker] = None,
+        replica: t.Optional[db.Replica] = None,
+    ):
         self.session_factory: t.Optional[sessionmaker] = session_factory
+        self.replica: t.Optional[db.Replica] = replica
+
+    def __getstate__(self) -> t.Dict[str, t.Any]:
+        # Database connections can't be sent to analyzer processes.
+        return {**self.__dict__, 'session_factory': None, 'replica': None}
 
     def _session(self, **kwargs) -> t.ContextManager[Session]:
         return db.managed_session(self.session_factory, **kwargs)
 
+    def _read_session(
+        self,
+        max_lag: float = 0.0,
+        **kwargs,
+    ) -> t.ContextManager[Session]:
+        """Opens a read only session on the replica if it is fresh enough.
+
+        Parameters
+        ----------
+        max_lag: float
+            Number of seconds the read tolerates the replica lagging behind
+            the primary. Defaults to 0 seconds.
+        kwargs: Dict
+            Keyword arguments to pass to the session factory.
+        """
+        factory = self.session_factory
+        if self.replica is not None:
+            factory = self.replica.route(max_lag)
+        return db.managed_session(factory, **kwargs)
+
     def analyze(self, anomalies: pa.DataFrame) -> pa.DataFrame:
         """Analyzes a given anomaly list for malicious anomalies.
 
@@ -2,7 +2,6 @@ import logging
 import typing as t
 from types import MappingProxyType
 
-import orjson
 import pandas as pa
 from pandas import DataFrame
 from sqlalchemy.orm import Session, joinedload
@@ -10,10 +9,12 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from scrywarden import database as db
 from scrywarden.exceptions import ProfileError
+from scrywarden.profile.extraction import ExtractionBatch, serialize
 from scrywarden.profile.fields import Field
 from scrywarden.config import Config
 from scrywarden.config.parsers import Parser
-from scrywarden.transport.message import Message
+from scrywarden.transport.message import Message, normalize
+from scrywarden.typing import JSONValue
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +83,17 @@ class ProfileField(t.NamedTuple):
         return ProfileField(self.instance, model=model)
 
 
+class Route(t.NamedTuple):
+    """Message field value that a profile is routed on.
+
+    Messages are only dispatched to the profile if the value of the message
+    field is one of the given values. Values must be hashable JSON values.
+    """
+
+    key: t.Sequence[str]  # Message field to route on.
+    values: t.FrozenSet[JSONValue]  # Field values routed to the profile.
+
+
 class FieldMapping(t.Mapping[str, ProfileField]):
     """Helper class that contains profile field information.
 
@@ -162,11 +174,38 @@ class Profile(metaclass=ProfileMeta):
     behavioral profile. If the previous example data was passed to this
     profile, then it would return `"Bob"` which is the the `person` key value
     from the JSON object.
+
+    Profiles can also declare which messages they can match through the
+    `REQUIRES` and `ROUTE` class attributes. The pipeline uses these to build
+    a routing index so messages are only dispatched to candidate profiles::
+
+        from scrywarden.profile import Profile, Route, fields
+
+        class Example(Base):
+            REQUIRES = ('greeting', 'person')
+            ROUTE = Route('type', frozenset({'greeting'}))
+
+            greeting = fields.Single()
+
+            def get_actor(message: Message) -> str:
+                return message['person']
+
+    When either attribute is set, the default `matches` method checks the
+    declarations so it does not need to be overridden.
     """
     __fields__: t.Tuple[Field, ...]
 
     PARSER: t.Optional[Parser] = None
 
+    REQUIRES: t.Tuple[t.Sequence[str], ...] = ()
+    """Message fields that must be present for the profile to match."""
+
+    ROUTE: t.Optional[Route] = None
+    """Message field value the profile is routed on."""
+
+    ACTOR: t.Optional[t.Sequence[str]] = None
+    """Message field containing the actor name used by `get_actor`."""
+
     def __init__(self, name: str = ''):
         self.name: str = name
         self.model: t.Optional[db.Profile] = None
@@ -174,6 +213,14 @@ class Profile(metaclass=ProfileMeta):
             field.name: ProfileField(field) for field in self.__fields__
         })
 
+    @property
+    def plans_actor(self) -> bool:
+        """Returns if the actor can be read from a shared extraction batch."""
+        return (
+            self.ACTOR is not None
+            and type(self).get_actor is Profile.get_actor
+        )
+
     def matches(self, message: Message) -> bool:
         """Method that determines if a message matches the profile.
 
@@ -191,7 +238,35 @@ class Profile(metaclass=ProfileMeta):
         bool
             If the given message matches the profile.
         """
-        raise NotImplementedError()
+        if not self.REQUIRES and self.ROUTE is None:
+            raise NotImplementedError()
+        return self.routes(message)
+
+    def routes(self, message: Message) -> bool:
+        """Determines if a message satisfies the profile routing declarations.
+
+        Checks that the message contains every field in `REQUIRES` and that
+        the `ROUTE` field value is one of the routed values.
+
+        Parameters
+        ----------
+        message: Message
+            Message to check.
+
+        Returns
+        -------
+        bool
+            If the message can be routed to the profile.
+        """
+        for key in self.REQUIRES:
+            if key not in message:
+                return False
+        if self.ROUTE is None:
+            return True
+        try:
+            return message.get(self.ROUTE.key) in self.ROUTE.values
+        except TypeError:
+            return False
 
     def get_actor(self, message: Message) -> str:
         """Method that determines the actor of a given message.
@@ -211,7 +286,9 @@ class Profile(metaclass=ProfileMeta):
         str
             Name of the actor.
         """
-        raise NotImplementedError()
+        if self.ACTOR is None:
+            raise NotImplementedError()
+        return message[self.ACTOR]
 
     def configure(self, config: Config) -> Config:
         """Optional overridable method that configures class from config.
@@ -261,7 +338,11 @@ class Profile(metaclass=ProfileMeta):
             session.flush()
         self.fields = FieldMapping(fields)
 
-    def identify(self, messages: t.Iterable[Message]) -> pa.DataFrame:
+    def identify(
+        self,
+        messages: t.Iterable[Message],
+        batch: t.Optional[ExtractionBatch] = None,
+    ) -> pa.DataFrame:
         """Creates a dataframe of the retrieved message field values.
 
         The created dataframe contains the following columns:
@@ -277,6 +358,9 @@ class Profile(metaclass=ProfileMeta):
         ----------
         messages: Iterable[Messages]
             Iterable of messages to process.
+        batch: Optional[ExtractionBatch]
+            Shared extraction batch containing the messages. Planned keys are
+            read from the batch instead of each message.
 
         Returns
         -------
@@ -284,7 +368,7 @@ class Profile(metaclass=ProfileMeta):
             Dataframe containing the identified messages for the profile.
         """
         df = pa.DataFrame(
-            self._generate_rows(messages),
+            self._generate_rows(messages, batch=batch),
             columns=[
                 'message_id', 'timestamp', 'actor_name',
                 'field_id', 'value',
@@ -347,43 +431,72 @@ class Profile(metaclass=ProfileMeta):
             features = update_feature_count(group, features)
         return pa.concat(results, ignore_index=True), features
 
-    def _get_actor_name(self, message: Message) -> str:
-        actor_name = self.get_actor(message)
+    def _get_actor_name(
+        self,
+        message: Message,
+        batch: t.Optional[ExtractionBatch] = None,
+    ) -> str:
+        if batch is not None and self.plans_actor:
+            actor_name = batch.value(message, normalize(self.ACTOR))
+        else:
+            actor_name = self.get_actor(message)
         if not isinstance(actor_name, str):
             raise ValueError(
                 f"Message {message.id} actor must be a string value",
             )
         return actor_name
 
-    def _get_field_value(self, field: Field, message: Message) -> str:
+    def _get_field_value(
+        self,
+        field: Field,
+        message: Message,
+        batch: t.Optional[ExtractionBatch] = None,
+    ) -> str:
+        keys = None
+        if batch is not None and field.plans_value:
+            keys = field.get_keys()
+        if keys is not None:
+            try:
+                values = [batch.serialized(message, key) for key in keys]
+            except ValueError as error:
+                raise self._serialization_error(field, message) from error
+            return field.compose(values)
         value = field.get_value(message)
         if value is None:
             return ''
         try:
-            serialized_value = str(
-                orjson.dumps(value, option=orjson.OPT_SORT_KEYS), 'utf-8'
-            )
-        except Exception as error:
-            raise ValueError(
-                f"Message {message.id} value for field {field.name!r} is not "
-                "JSON serializable",
-            ) from error
-        return serialized_value
-
-    def _generate_rows(self, messages: t.Iterable[Message]) -> t.Iterator[
-        t.Tuple[int, str, int, str],
-    ]:
+            return serialize(value)
+        except ValueError as error:
+            raise self._serialization_error(field, message) from error
+
+    def _serialization_error(
+        self,
+        field: Field,
+        message: Message,
+    ) -> ValueError:
+        return ValueError(
+            f"Message {message.id} value for field {field.name!r} is not "
+            "JSON serializable",
+        )
+
+    def _generate_rows(
+        self,
+        messages: t.Iterable[Message],
+        batch: t.Optional[ExtractionBatch] = None,
+    ) -> t.Iterator[t.Tuple[int, str, int, str]]:
         for message in messages:
             if not self.matches(message):
                 continue
             try:
-                actor_name = self._get_actor_name(message)
+                actor_name = self._get_actor_name(message, batch=batch)
             except Exception as error:
                 logger.exception(error)
                 continue
             for field in self.fields.values():
                 try:
-                    value = self._get_field_value(field.instance, message)
+                    value = self._get_field_value(
+                        field.instance, message, batch=batch,
+                    )
                 except Exception as error:
                     logger.exception(error)
                     continue
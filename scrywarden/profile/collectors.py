@@ -4,12 +4,14 @@ import typing as t
 from datetime import timedelta, datetime, timezone
 
 import pandas as pa
-from sqlalchemy.orm import sessionmaker, Session
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker, Session, Query
 
 from scrywarden import database as db
 from scrywarden.config import parsers, Config
 from scrywarden.exceptions import ConfigError
 from scrywarden.profile import Profile
+from scrywarden.storage import get_storage
 from scrywarden.timing import ExponentialBackoff, benchmark
 
 logger = logging.getLogger(__name__)
@@ -26,6 +28,24 @@ class Collector:
         SQLAlchemy session factory.
     shutdown: threading.Event
         Threading event that indicates a shutdown occurred.
+    listen: bool
+        If waiting for new events should wake up as soon as the pipeline
+        notifies that events were created, instead of only polling. Defaults
+        to True.
+    block: bool
+        If collecting should wait until anomalies are available. When False,
+        collecting returns nothing instead of waiting, which lets a scheduler
+        share worker threads between profiles. Defaults to True.
+    partition: Optional[Tuple[int, int]]
+        Partition index and partition count. When set, only events of actors
+        whose ID modulo the count equals the index are collected.
+    replica: Optional[Replica]
+        Read replica to collect anomalies from while its replication lag is
+        within `max_lag`. Events are still assigned on the primary.
+    max_lag: float
+        Number of seconds the replica may lag behind the primary to collect
+        from it. Defaults to 0 seconds, which only reads from a caught up
+        replica.
 
     Attributes
     ----------
@@ -33,6 +53,16 @@ class Collector:
         SQLAlchemy session factory.
     shutdown: threading.Event
         Threading event that indicates a shutdown occurred.
+    listen: bool
+        If waiting for new events listens for pipeline notifications.
+    block: bool
+        If collecting waits until anomalies are available.
+    partition: Optional[Tuple[int, int]]
+        Partition index and partition count of the collected actors.
+    replica: Optional[Replica]
+        Read replica to collect anomalies from.
+    max_lag: float
+        Number of seconds the replica may lag behind to collect from it.
     """
     PARSER: t.Optional[parsers.Parser] = None
 
@@ -40,13 +70,140 @@ class Collector:
         self,
         session_factory: t.Optional[sessionmaker] = None,
         shutdown: t.Optional[threading.Event] = None,
+        listen: bool = True,
+        block: bool = True,
+        partition: t.Optional[t.Tuple[int, int]] = None,
+        replica: t.Optional[db.Replica] = None,
+        max_lag: float = 0.,
     ):
         self.session_factory: t.Optional[sessionmaker] = session_factory
         self.shutdown: t.Optional[threading.Event] = shutdown
+        self.listen: bool = listen
+        self.block: bool = block
+        self.partition: t.Optional[t.Tuple[int, int]] = partition
+        self.replica: t.Optional[db.Replica] = replica
+        self.max_lag: float = max_lag
+        self._listener: t.Optional[db.Listener] = None
 
     def _session(self, **kwargs) -> t.ContextManager[Session]:
         return db.managed_session(self.session_factory, **kwargs)
 
+    def _read_session(self, **kwargs) -> t.ContextManager[Session]:
+        """Opens a read only session on the replica if it is fresh enough."""
+        factory = self.session_factory
+        if self.replica is not None:
+            factory = self.replica.route(self.max_lag)
+        return db.managed_session(factory, **kwargs)
+
+    def assign(
+        self,
+        session: Session,
+        investigation: db.Investigation,
+        anomalies: pa.DataFrame,
+    ) -> t.List[int]:
+        """Assigns the events of collected anomalies to an investigation.
+
+        By default the event IDs of the anomalies are inserted from the
+        client. Collectors that know the query the anomalies were selected
+        with can override this to assign the events in the database.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        investigation: Investigation
+            Investigation to assign the events to.
+        anomalies: DataFrame
+            Collected anomalies.
+
+        Returns
+        -------
+        List[int]
+            IDs of the assigned events.
+        """
+        events = anomalies.drop_duplicates('event_id')
+        assigned_events = []
+        for event_id in events['event_id'].astype('object').values:
+            assigned_events.append({
+                'investigation_id': investigation.id,
+                'event_id': event_id,
+            })
+        # Assigned events are placed in the partition of the event.
+        if 'created_at' in events:
+            for assigned_event, created_at in zip(
+                assigned_events, events['created_at'].dt.to_pydatetime(),
+            ):
+                assigned_event['created_at'] = created_at
+        get_storage(session).insert(
+            session, db.InvestigationEvent, assigned_events,
+        )
+        return [
+            assigned_event['event_id'] for assigned_event in assigned_events
+        ]
+
+    def _filter_events(self, query: Query, profile: db.Profile) -> Query:
+        """Filters an event query to the events of the profile partition."""
+        query = query.filter(db.Event.profile_id == profile.id)
+        if self.partition is not None:
+            index, count = self.partition
+            query = query.filter(db.Event.actor_id % count == index)
+        return query
+
+    def ready(
+        self,
+        profile: Profile,
+        previous: t.Optional[db.Investigation] = None,
+    ) -> bool:
+        """Returns if anomalies can be collected without waiting.
+
+        Used to skip creating investigations that would find nothing when
+        the collector does not block. Defaults to always being ready.
+
+        Parameters
+        ----------
+        profile: Profile
+            Profile to collect anomalies from.
+        previous: Optional[Investigation]
+            Previous investigation of the profile if one occurred.
+
+        Returns
+        -------
+        bool
+            True if a window of anomalies is available, False otherwise.
+        """
+        return True
+
+    def close(self) -> None:
+        """Releases any resources held by the collector."""
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def _listen(self, profile: db.Profile) -> None:
+        """Starts listening for new events of the profile if enabled."""
+        if not (self.listen and self.block) or self._listener is not None:
+            return
+        self._listener = db.Listener(
+            self.session_factory, db.channel(db.EVENTS_CHANNEL, profile.id),
+            self.shutdown,
+        )
+        self._listener.listen()
+
+    def _wait_for_events(self, timeout: float) -> bool:
+        """Waits for new events or until the timeout passes.
+
+        Wakes up early when listening and the pipeline notifies that events
+        were created for the profile.
+
+        Returns
+        -------
+        bool
+            True if a shutdown occurred, False otherwise.
+        """
+        if self._listener is None or timeout <= 0:
+            return self.shutdown.wait(timeout)
+        return self._listener.wait(timeout)
+
     def collect(
         self,
         profile: Profile,
@@ -81,6 +238,35 @@ class Collector:
         """
         raise NotImplementedError()
 
+    def collect_pages(
+        self,
+        profile: Profile,
+        investigation: db.Investigation,
+        previous: t.Optional[db.Investigation] = None,
+    ) -> t.Iterator[pa.DataFrame]:
+        """Collects anomalies from a given profile in bounded-size pages.
+
+        Each page has the same schema as the dataframe returned by `collect`.
+        Pages never split the anomalies of an event, so each page can be
+        analyzed on its own. By default the whole `collect` result is
+        returned as a single page.
+
+        Parameters
+        ----------
+        profile: Profile
+            Profile to retrieve related anomalies from.
+        investigation: scrywarden.database.Investigation
+            Current investigation object.
+        previous: Optional[scrywarden.database.Investigation]
+            Previous investigation object.
+
+        Returns
+        -------
+        Iterator[DataFrame]
+            Iterator of dataframes containing the anomalies to analyze.
+        """
+        yield self.collect(profile, investigation, previous=previous)
+
     def configure(self, config: Config) -> Config:
         """Configures the collector from a config object.
 
@@ -106,16 +292,14 @@ class Collector:
     ) -> t.Optional[db.Event]:
         """Helper utility that retrieves the first event of the profile."""
         logger.debug("Retrieving first event of profile '%s'", profile.name)
+        self._listen(profile)
         backoff = ExponentialBackoff(initialize=True, **kwargs)
-        while not self.shutdown.wait(backoff.timeout):
-            with self._session(expire_on_commit=False) as session:
-                first_event = session.query(db.Event).join(
-                    (db.Actor, db.Event.actor),
-                    (db.Profile, db.Actor.profile),
-                ).filter(
-                    db.Profile.id == profile.id,
+        while not self._wait_for_events(backoff.timeout):
+            with self._read_session(expire_on_commit=False) as session:
+                first_event = self._filter_events(
+                    session.query(db.Event), profile,
                 ).order_by(db.Event.created_at.asc()).first()
-                if first_event:
+                if first_event or not self.block:
                     return first_event
                 logger.info(
                     "First event not found trying again in %.2f seconds",
@@ -137,7 +321,8 @@ class TimeRangeCollector(Collector):
     2. Retrieve anomalies starting from the previous steps start time plus
     the given number of seconds.
     3. If no anomalies are found, search for the next event past the given
-    time range. If an event is not found, wait a set interval and try again
+    time range. If an event is not found, wait a set interval or until the
+    pipeline notifies that new events were created and try again
     from step 2. If an event is found, then retrieve anomalies starting from
     the timestamp of the event to the starting  time plus the give number
     of seconds.
@@ -149,6 +334,11 @@ class TimeRangeCollector(Collector):
     past now - 15 seconds, it waits until that delayed time. This is important
     if you some ingest that comes in delayed.
 
+    Windows containing a large number of events can be fetched in pages
+    by setting `page_size`. Pages are fetched with keyset pagination on the
+    event creation time and ID, so peak memory is bounded by the page size
+    instead of the window size.
+
     Parameters
     ----------
     seconds: float
@@ -158,12 +348,29 @@ class TimeRangeCollector(Collector):
         Defaults to 10 seconds.
     delay: float
         Number of seconds to offset the current time to in the past. Deafults
+        to 0 seconds. This is the time the pipeline gets to commit the
+        events of a window.
+    page_size: int
+        Maximum number of events to fetch per page. Defaults to 0, which
+        fetches the whole window at once.
+    listen: bool
+        If waiting for events should wake up on pipeline notifications.
+        Polling every `interval` seconds remains the fallback. Defaults to
+        True.
+    max_lag: float
+        Number of seconds a read replica may lag behind the primary to
+        collect from it. When a replica is used, windows are collected
+        `delay` plus `max_lag` seconds after they end, since events only
+        reach the replica after they are committed on the primary. Defaults
         to 0 seconds.
     """
     PARSER = parsers.Options({
         'seconds': parsers.Float(),
         'interval': parsers.Float(),
         'delay': parsers.Float(),
+        'page_size': parsers.Integer(),
+        'listen': parsers.Boolean(),
+        'max_lag': parsers.Float(),
     })
 
     def __init__(
@@ -171,12 +378,24 @@ class TimeRangeCollector(Collector):
         seconds: float = 60.,
         interval: float = 10.,
         delay: float = 0.,
+        page_size: int = 0,
         **kwargs,
     ):
         super().__init__(**kwargs)
         self.seconds: float = seconds
         self.interval: float = interval
         self.delay: float = delay
+        self.page_size: int = page_size
+
+    @property
+    def total_delay(self) -> float:
+        """Number of seconds after their end that windows are collected.
+
+        The replication lag tolerated from a replica adds to the delay.
+        """
+        if self.replica is None:
+            return self.delay
+        return self.delay + self.max_lag
 
     def collect(
         self,
@@ -184,22 +403,168 @@ class TimeRangeCollector(Collector):
         investigation: db.Investigation,
         previous: t.Optional[db.Investigation] = None,
     ) -> pa.DataFrame:
+        pages = [*self.collect_pages(profile, investigation, previous)]
+        if not pages:
+            return pa.DataFrame()
+        return pa.concat(pages, ignore_index=True)
+
+    def collect_pages(
+        self,
+        profile: Profile,
+        investigation: db.Investigation,
+        previous: t.Optional[db.Investigation] = None,
+    ) -> t.Iterator[pa.DataFrame]:
         if not previous:
-            return self._create_initial_investigation(profile.model)
-        last_event: db.Event = self._get_last_investigation_event(previous)
-        return self._loop_until_anomalies(profile.model, last_event.created_at)
+            logger.info("Creating initial investigation")
+            first_event = self._get_first_event(profile.model)
+            if not first_event:
+                return
+            start = first_event.created_at - timedelta(seconds=1)
+        else:
+            start = self._get_previous_end(previous)
+        window = self._loop_until_anomalies(profile.model, start)
+        if window is None:
+            return
+        start, end, page = window
+        investigation.window_start = start
+        investigation.window_end = end
+        yield page
+        while self.page_size and (
+            page['event_id'].nunique() >= self.page_size
+        ):
+            last = page.iloc[-1]
+            with self._read_session() as session:
+                page = self._fetch_anomalies(
+                    session, profile.model, start, end,
+                    after=(last['created_at'], last['event_id']),
+                )
+            if page.empty:
+                return
+            yield page
+
+    def ready(
+        self,
+        profile: Profile,
+        previous: t.Optional[db.Investigation] = None,
+    ) -> bool:
+        start = self._get_previous_end(previous) if previous else None
+        with self._read_session() as session:
+            query = self._filter_events(
+                session.query(db.Event.created_at), profile.model,
+            )
+            if start is not None:
+                query = query.filter(db.Event.created_at > start)
+            next_event = query.order_by(db.Event.created_at.asc()).first()
+        if next_event is None:
+            return False
+        created_at = next_event[0]
+        # Mirrors how the window is chosen when collecting.
+        if start is None:
+            start = created_at - timedelta(seconds=1)
+        elif created_at > start + timedelta(
+            seconds=self._window_seconds(start),
+        ):
+            start = created_at - timedelta(microseconds=1)
+        end = start + timedelta(
+            seconds=self._window_seconds(start) + self.total_delay,
+        )
+        return end <= datetime.now(timezone.utc)
+
+    def assign(
+        self,
+        session: Session,
+        investigation: db.Investigation,
+        anomalies: pa.DataFrame,
+    ) -> t.List[int]:
+        """Assigns the events of a collected page in the database.
+
+        Claims the events of the profile between the first and last event of
+        the page in keyset order with a single `INSERT ... SELECT`, which
+        returns the claimed event IDs, so the collected IDs are never sent
+        to the database. The page may have been fetched from a replica or in
+        an earlier transaction, so events committed after it was fetched
+        can fall in the same range. Those are found in the returned IDs and
+        unassigned in the same transaction, so they are collected by the
+        next investigation instead of being assigned without being
+        analyzed.
+        """
+        if anomalies.empty:
+            return []
+        keys = anomalies[['created_at', 'event_id']].drop_duplicates(
+            'event_id',
+        ).sort_values(['created_at', 'event_id'])
+        (first_created_at, first_id), (last_created_at, last_id) = (
+            keys.iloc[0], keys.iloc[-1],
+        )
+        first_created_at = sa.literal(
+            first_created_at.to_pydatetime(), db.Timestamp,
+        )
+        last_created_at = sa.literal(
+            last_created_at.to_pydatetime(), db.Timestamp,
+        )
+        key = sa.tuple_(db.Event.created_at, db.Event.id)
+        events = self._filter_events(session.query(
+            sa.literal(investigation.id).label('investigation_id'),
+            db.Event.id.label('event_id'),
+            db.Event.created_at.label('created_at'),
+        ), investigation.group.profile).filter(
+            # Lets partitioned event tables skip the other partitions.
+            db.Event.created_at.between(first_created_at, last_created_at),
+            key >= sa.tuple_(first_created_at, sa.literal(int(first_id))),
+            key <= sa.tuple_(last_created_at, sa.literal(int(last_id))),
+        )
+        claimed = get_storage(session).insert_select_returning(
+            session, db.InvestigationEvent,
+            ['investigation_id', 'event_id', 'created_at'], events.statement,
+            db.InvestigationEvent.c.event_id,
+        )
+        collected = set(keys['event_id'].tolist())
+        late = [event_id for event_id in claimed if event_id not in collected]
+        if late:
+            logger.warning(
+                "Unassigning %d events committed after the page was fetched",
+                len(late),
+            )
+            session.execute(db.InvestigationEvent.delete().where(sa.and_(
+                db.InvestigationEvent.c.investigation_id == investigation.id,
+                db.InvestigationEvent.c.event_id.in_(late),
+            )))
+        return [event_id for event_id in claimed if event_id in collected]
 
     def configure(self, config: Config) -> Config:
         self.seconds = config.get_value('seconds', self.seconds)
         self.interval = config.get_value('interval', self.interval)
+        self.delay = config.get_value('delay', self.delay)
+        self.page_size = config.get_value('page_size', self.page_size)
+        self.listen = config.get_value('listen', self.listen)
+        self.max_lag = config.get_value('max_lag', self.max_lag)
         return config
 
+    def _get_previous_end(self, previous: db.Investigation) -> datetime:
+        """Returns where the previous investigation stopped.
+
+        Reads the last event recorded on the previous investigation by its
+        primary key. Investigations created before the watermark was
+        recorded fall back to searching their assigned events.
+        """
+        last_event: t.Optional[db.Event] = None
+        if previous.last_event_id is not None:
+            with self._read_session(expire_on_commit=False) as session:
+                last_event = session.query(db.Event).get(
+                    previous.last_event_id,
+                )
+        if last_event is None and previous.window_end is None:
+            last_event = self._get_last_investigation_event(previous)
+        if last_event is None:
+            return previous.window_end
+        return last_event.created_at
+
     def _get_last_investigation_event(
         self,
         investigation: db.Investigation,
-    ) -> db.Event:
+    ) -> t.Optional[db.Event]:
         logger.debug("Getting last investigation event")
-        with self._session(expire_on_commit=False) as session:
+        with self._read_session(expire_on_commit=False) as session:
             with benchmark(
                 "Last investigation event fetched in %.2f seconds",
                 logger=logger, level=logging.DEBUG,
@@ -217,40 +582,67 @@ class TimeRangeCollector(Collector):
         self,
         profile: db.Profile,
         start: datetime,
-    ) -> pa.DataFrame:
+    ) -> t.Optional[t.Tuple[datetime, datetime, pa.DataFrame]]:
+        """Searches for the first window containing anomalies.
+
+        Returns the start and end of the window along with the first page
+        of its anomalies, or None if a shutdown occurred first.
+        """
         timeout = 0.0
         logger.debug("Looping until events are found")
-        while not self.shutdown.wait(timeout):
-            with self._session() as session:
-                anomalies = self._fetch_anomalies(session, profile, start)
+        self._listen(profile)
+        while not self._wait_for_events(timeout):
+            with self._read_session() as session:
+                end = start + timedelta(seconds=self._window_seconds(start))
+                if self._wait(end):
+                    return None
+                anomalies = self._fetch_anomalies(session, profile, start, end)
                 if not anomalies.empty:
-                    return anomalies
-                next_event: t.Optional[db.Event] = session.query(
-                    db.Event,
-                ).join(
-                    (db.Actor, db.Event.actor),
-                    (db.Profile, db.Actor.profile),
+                    return start, end, anomalies
+                next_event: t.Optional[db.Event] = self._filter_events(
+                    session.query(db.Event), profile,
                 ).filter(
-                    db.Profile.id == profile.id,
                     db.Event.created_at > start,
                 ).order_by(db.Event.created_at.asc()).first()
                 if next_event:
-                    return self._fetch_anomalies(
-                        session, profile, next_event.created_at,
+                    # Start right before the event since the window start
+                    # is exclusive.
+                    start = next_event.created_at - timedelta(microseconds=1)
+                    end = start + timedelta(
+                        seconds=self._window_seconds(start),
+                    )
+                    if self._wait(end):
+                        return None
+                    anomalies = self._fetch_anomalies(
+                        session, profile, start, end,
                     )
+                    return start, end, anomalies
+            if not self.block:
+                return None
             timeout = self.interval
             logger.debug(
                 "Matching events not found retrying in %.2f seconds", timeout,
             )
-        return pa.DataFrame()
+        return None
+
+    def _window_seconds(self, start: datetime) -> float:
+        """Returns the length of the window starting at the given time."""
+        return self.seconds
 
     def _wait(self, target: datetime) -> bool:
+        """Waits until the target time plus the delay has passed.
+
+        Returns True if a shutdown occurred or if the target has not passed
+        yet and the collector does not block.
+        """
         timeout: float = 0.0
         while not self.shutdown.wait(timeout):
             now = datetime.now(timezone.utc)
             logger.debug("Target start time %s current time %s", target, now)
-            if target + timedelta(seconds=self.delay) <= now:
+            if target + timedelta(seconds=self.total_delay) <= now:
                 break
+            if not self.block:
+                return True
             timeout = (target - now).seconds
             logger.debug(
                 "Search interval is beyond the current time + delay waiting "
@@ -263,11 +655,39 @@ class TimeRangeCollector(Collector):
         session: Session,
         profile: db.Profile,
         start: datetime,
+        end: datetime,
+        after: t.Optional[t.Tuple[datetime, int]] = None,
     ) -> pa.DataFrame:
-        end = start + timedelta(seconds=self.seconds)
-        if self._wait(end):
-            return pa.DataFrame()
-        logger.info("Fetching events between %s and %s", start, end)
+        """Fetches the anomalies of a window or of one page of the window.
+
+        When paging, at most `page_size` events ordered by creation time and
+        ID are selected past the `after` keyset.
+        """
+        if after is None:
+            logger.info("Fetching events between %s and %s", start, end)
+        else:
+            logger.info(
+                "Fetching events between %s and %s after event %d", start,
+                end, after[1],
+            )
+        events = self._filter_events(
+            session.query(db.Event.id.label('event_id')), profile,
+        ).filter(
+            db.Event.created_at > start,
+            db.Event.created_at <= end,
+        )
+        if after is not None:
+            events = events.filter(
+                sa.tuple_(db.Event.created_at, db.Event.id) > sa.tuple_(
+                    sa.literal(after[0].to_pydatetime(), db.Timestamp),
+                    sa.literal(int(after[1])),
+                ),
+            )
+        if self.page_size:
+            events = events.order_by(
+                db.Event.created_at.asc(), db.Event.id.asc(),
+            ).limit(self.page_size)
+        events = events.subquery()
         query = session.query(
             db.Event.id.label('event_id'),
             db.Event.message_id.label('message_id'),
@@ -277,30 +697,180 @@ class TimeRangeCollector(Collector):
             db.Anomaly.field_id.label('field_id'),
             db.Anomaly.score.label('score'),
         ).join(
+            (events, events.c.event_id == db.Event.id),
             (db.Anomaly, db.Event.anomalies),
-            (db.Actor, db.Event.actor),
-            (db.Profile, db.Actor.profile),
-        ).filter(
-            db.Event.created_at > start,
-            db.Event.created_at <= end,
-            db.Profile.id == profile.id,
         )
+        if self.page_size:
+            query = query.order_by(
+                db.Event.created_at.asc(), db.Event.id.asc(),
+            )
         return pa.read_sql_query(
             query.statement, session.connection(), parse_dates=['created_at'],
         )
 
-    def _create_initial_investigation(
+
+class AdaptiveTimeRangeCollector(TimeRangeCollector):
+    """Time range collector that sizes windows by the observed event density.
+
+    Instead of a fixed window, the collector targets a number of events per
+    investigation. After every window it observes the number of events per
+    second and sizes the next window so it would contain the target number
+    of events, smoothing the change and keeping it between `min_seconds` and
+    `max_seconds`. Quiet periods then get fewer, larger windows and floods
+    get more, smaller ones.
+
+    The target can also be given as a memory budget, which is converted to
+    a number of events using the observed memory used per event.
+
+    When the collector is behind `now - delay` by more than `catch_up`
+    seconds, the target is multiplied by `catch_up_factor` so the collector
+    catches up with fewer, larger investigations. Use `page_size` to keep
+    the memory of those windows bounded.
+
+    The first window uses `seconds` until an observation has been made.
+
+    Parameters
+    ----------
+    target_events: int
+        Number of events to target per window. Defaults to 10000.
+    memory: int
+        Number of bytes of anomalies to target per window. Defaults to 0,
+        which only targets the number of events.
+    min_seconds: float
+        Minimum length of a window. Defaults to 1 second.
+    max_seconds: float
+        Maximum length of a window. Defaults to 3600 seconds.
+    smoothing: float
+        Weight of the newest observation between 0 and 1 when sizing the
+        next window. Defaults to 0.5.
+    catch_up: float
+        Number of seconds behind `now - delay` after which windows are
+        widened. Defaults to 0, which disables catching up.
+    catch_up_factor: float
+        Multiplier of the target while catching up. Defaults to 2.
+    """
+    PARSER = TimeRangeCollector.PARSER.extend({
+        'target_events': parsers.Integer(),
+        'memory': parsers.Integer(),
+        'min_seconds': parsers.Float(),
+        'max_seconds': parsers.Float(),
+        'smoothing': parsers.Float(),
+        'catch_up': parsers.Float(),
+        'catch_up_factor': parsers.Float(),
+    })
+
+    def __init__(
+        self,
+        target_events: int = 10000,
+        memory: int = 0,
+        min_seconds: float = 1.,
+        max_seconds: float = 3600.,
+        smoothing: float = .5,
+        catch_up: float = 0.,
+        catch_up_factor: float = 2.,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.target_events: int = target_events
+        self.memory: int = memory
+        self.min_seconds: float = min_seconds
+        self.max_seconds: float = max_seconds
+        self.smoothing: float = smoothing
+        self.catch_up: float = catch_up
+        self.catch_up_factor: float = catch_up_factor
+        self._density: t.Optional[float] = None
+        self._event_size: t.Optional[float] = None
+
+    def configure(self, config: Config) -> Config:
+        config = super().configure(config)
+        self.target_events = config.get_value(
+            'target_events', self.target_events,
+        )
+        self.memory = config.get_value('memory', self.memory)
+        self.min_seconds = config.get_value('min_seconds', self.min_seconds)
+        self.max_seconds = config.get_value('max_seconds', self.max_seconds)
+        self.smoothing = config.get_value('smoothing', self.smoothing)
+        self.catch_up = config.get_value('catch_up', self.catch_up)
+        self.catch_up_factor = config.get_value(
+            'catch_up_factor', self.catch_up_factor,
+        )
+        return config
+
+    def collect_pages(
         self,
-        profile: db.Profile,
-    ) -> pa.DataFrame:
-        logger.info("Creating initial investigation")
-        first_event = self._get_first_event(profile)
-        if not first_event:
-            return pa.DataFrame()
-        return self._loop_until_anomalies(
-            profile, first_event.created_at - timedelta(seconds=1),
+        profile: Profile,
+        investigation: db.Investigation,
+        previous: t.Optional[db.Investigation] = None,
+    ) -> t.Iterator[pa.DataFrame]:
+        events = 0
+        size = 0
+        for page in super().collect_pages(profile, investigation, previous):
+            events += page['event_id'].nunique()
+            size += int(page.memory_usage(deep=True).sum())
+            yield page
+        if events and investigation.window_start is not None:
+            self.observe(
+                investigation.window_end - investigation.window_start,
+                events, size,
+            )
+
+    def observe(self, window: timedelta, events: int, size: int) -> None:
+        """Records the density and memory size of a collected window.
+
+        Parameters
+        ----------
+        window: timedelta
+            Length of the collected window.
+        events: int
+            Number of events collected in the window.
+        size: int
+            Memory used by the collected anomalies in bytes.
+        """
+        density = events / max(window.total_seconds(), 1e-6)
+        event_size = size / events
+        self._density = self._smooth(self._density, density)
+        self._event_size = self._smooth(self._event_size, event_size)
+        logger.debug(
+            "Observed %.2f events per second and %.0f bytes per event",
+            self._density, self._event_size,
         )
 
+    def target(self, start: datetime) -> float:
+        """Returns the number of events to target in the window.
+
+        Parameters
+        ----------
+        start: datetime
+            Start of the window.
+
+        Returns
+        -------
+        float
+            Targeted number of events.
+        """
+        target = float(self.target_events)
+        if self.memory and self._event_size:
+            target = min(target, self.memory / self._event_size)
+        if self.catch_up:
+            now = datetime.now(timezone.utc) - timedelta(
+                seconds=self.total_delay,
+            )
+            if (now - start).total_seconds() > self.catch_up:
+                target *= self.catch_up_factor
+        return target
+
+    def _window_seconds(self, start: datetime) -> float:
+        if not self._density:
+            seconds = self.seconds
+        else:
+            seconds = self.target(start) / self._density
+        return min(max(seconds, self.min_seconds), self.max_seconds)
+
+    def _smooth(self, previous: t.Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return previous + self.smoothing * (value - previous)
+
 
 PARSER = parsers.Options({
     'class': parsers.Import(required=True, parent=Collector),
@@ -11,6 +11,7 @@ PARSER = parsers.Dict(parsers.Options({
     'config': parsers.Options({}),
     'collector': parsers.Options({}),
     'analyzer': parsers.Options({}),
+    'partitions': parsers.Integer(),
 }))
 
 
@@ -26,6 +27,7 @@ def parse_profiles(
     * profile: The parsed profile.
     * collector: The parsed collector used for the profile.
     * analyzer: The parsed analyzer used for the profile.
+    * partitions: The number of partitions to investigate the profile in.
 
     Parameters
     ----------
@@ -33,7 +35,7 @@ def parse_profiles(
         Configuration object to parse from.
     extras: Sequence[str]
         Extra objects to load related to the profile. Right now this includes
-        'collector' and 'analyzer'.
+        'collector', 'analyzer' and 'partitions'.
 
     Returns
     -------
@@ -73,5 +75,12 @@ def parse_profiles(
                 raise ConfigError(
                     f"Profile '{name}' analyzer could not be parsed",
                 ) from error
+        if 'partitions' in extras:
+            partitions = profile_config.get_value('partitions', 1)
+            if partitions < 1:
+                raise ConfigError(
+                    f"Profile '{name}' partitions must be at least 1",
+                )
+            value['partitions'] = partitions
         profiles[name] = value
     return profiles
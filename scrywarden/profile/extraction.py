@@ -0,0 +1,246 @@
+"""Contains the shared extraction plan used to identify message values."""
+
+import re
+import typing as t
+
+import orjson
+
+from scrywarden.missing import MISSING
+from scrywarden.transport.message import Message, normalize
+from scrywarden.typing import JSONValue
+
+if t.TYPE_CHECKING:
+    from scrywarden.profile.base import Profile
+
+Key = t.Tuple[str, ...]
+
+_ESCAPED = re.compile(r'[\x00-\x1f"\\\ud800-\udfff]')
+"""Characters that orjson escapes or rejects in strings."""
+
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 64 - 1
+"""Integer range orjson is able to serialize."""
+
+
+def serialize(value: JSONValue) -> str:
+    """Serializes a JSON value into its canonical JSON string.
+
+    Canonical strings are compact and have their object keys sorted, which
+    is the form feature values are stored in. They are identical to the
+    output of `orjson.dumps` with the `OPT_SORT_KEYS` option.
+
+    Strings without escaped characters, integers, booleans and null are
+    serialized directly instead of going through the encode and decode
+    round trip of orjson.
+
+    Parameters
+    ----------
+    value: JSONValue
+        JSON value to serialize.
+
+    Returns
+    -------
+    str
+        Canonical JSON string.
+
+    Raises
+    ------
+    ValueError
+        If the value is not JSON serializable.
+    """
+    kind = type(value)
+    if kind is str:
+        if _ESCAPED.search(value) is None:
+            return f'"{value}"'
+    elif kind is int:
+        if _INT_MIN <= value <= _INT_MAX:
+            return str(value)
+    elif kind is bool:
+        return 'true' if value else 'false'
+    elif value is None:
+        return 'null'
+    try:
+        return str(orjson.dumps(value, option=orjson.OPT_SORT_KEYS), 'utf-8')
+    except Exception as error:
+        raise ValueError("Value is not JSON serializable") from error
+
+
+class Serializer:
+    """Serializes JSON values while memoizing repeated values.
+
+    Scalars are memoized by their type and value, floats by their exact
+    hexadecimal representation. Lists and dictionaries are memoized by their
+    identity, so the serializer must not outlive the values it serialized.
+    It's meant to be used for a single batch of messages.
+    """
+    def __init__(self):
+        self._cache: t.Dict[t.Any, str] = {}
+
+    def __call__(self, value: JSONValue) -> str:
+        """Serializes a JSON value into its canonical JSON string.
+
+        Parameters
+        ----------
+        value: JSONValue
+            JSON value to serialize.
+
+        Returns
+        -------
+        str
+            Canonical JSON string.
+
+        Raises
+        ------
+        ValueError
+            If the value is not JSON serializable.
+        """
+        kind = type(value)
+        if kind is dict or kind is list:
+            key = id(value)
+        elif kind is float:
+            # Keyed by bit pattern since -0.0 equals 0.0 but serializes
+            # differently.
+            key = (kind, value.hex())
+        else:
+            key = (kind, value)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return serialize(value)
+        serialized = self._cache[key] = serialize(value)
+        return serialized
+
+
+class ExtractionPlan:
+    """Union of the message keys that a group of profiles read.
+
+    Built from the keys of every field implementing `Field.get_keys` and the
+    `ACTOR` key of every profile using the default `get_actor`. Batches
+    created from the plan extract and serialize each key once per message
+    so profiles reading the same keys share the work.
+
+    Parameters
+    ----------
+    profiles: Iterable[Profile]
+        Profiles to build the plan for.
+
+    Attributes
+    ----------
+    keys: FrozenSet[Tuple[str, ...]]
+        Normalized message keys read by the profiles.
+    """
+    def __init__(self, profiles: t.Iterable['Profile']):
+        keys: t.Set[Key] = set()
+        for profile in profiles:
+            if profile.plans_actor:
+                keys.add(normalize(profile.ACTOR))
+            for field in profile.__fields__:
+                if field.plans_value:
+                    keys.update(field.get_keys() or ())
+        self.keys: t.FrozenSet[Key] = frozenset(keys)
+
+    def batch(self, messages: t.Iterable[Message]) -> 'ExtractionBatch':
+        """Creates an extraction batch for the given messages.
+
+        Parameters
+        ----------
+        messages: Iterable[Message]
+            Messages to extract the planned keys from.
+
+        Returns
+        -------
+        ExtractionBatch
+            Batch of the planned key columns.
+        """
+        return ExtractionBatch(messages, self.keys)
+
+
+class ExtractionBatch:
+    """Columnar batch of extracted and serialized message key values.
+
+    Each planned key has a value column and a serialized column with one
+    entry per message. Entries are filled the first time any profile reads
+    them, so messages that aren't routed to a profile reading a key are
+    never extracted. Values repeated within the batch are only serialized
+    once.
+
+    Parameters
+    ----------
+    messages: Iterable[Message]
+        Messages in the batch.
+    keys: Iterable[Tuple[str, ...]]
+        Normalized keys to create columns for.
+    """
+    def __init__(
+        self,
+        messages: t.Iterable[Message],
+        keys: t.Iterable[Key] = (),
+    ):
+        self.messages: t.List[Message] = list(messages)
+        self.rows: t.Dict[int, int] = {
+            message.id.int: row for row, message in enumerate(self.messages)
+        }
+        size = len(self.messages)
+        self._values: t.Dict[Key, t.List[t.Any]] = {
+            key: [MISSING] * size for key in keys
+        }
+        self._serialized: t.Dict[Key, t.List[t.Any]] = {
+            key: [MISSING] * size for key in self._values
+        }
+        self._serializer: Serializer = Serializer()
+
+    def value(self, message: Message, key: Key) -> JSONValue:
+        """Returns the value of a message key.
+
+        Parameters
+        ----------
+        message: Message
+            Message in the batch.
+        key: Tuple[str, ...]
+            Normalized message key.
+
+        Returns
+        -------
+        JSONValue
+            Key value or None if the message does not contain the key.
+        """
+        column = self._values.get(key)
+        row = self.rows.get(message.id.int)
+        if column is None or row is None:
+            return message.get(key)
+        value = column[row]
+        if value is MISSING:
+            value = column[row] = message.get(key)
+        return value
+
+    def serialized(self, message: Message, key: Key) -> str:
+        """Returns the canonical JSON string of a message key value.
+
+        Parameters
+        ----------
+        message: Message
+            Message in the batch.
+        key: Tuple[str, ...]
+            Normalized message key.
+
+        Returns
+        -------
+        str
+            Canonical JSON string of the key value.
+
+        Raises
+        ------
+        ValueError
+            If the key value is not JSON serializable.
+        """
+        column = self._serialized.get(key)
+        row = self.rows.get(message.id.int)
+        if column is None or row is None:
+            return self._serializer(message.get(key))
+        serialized = column[row]
+        if serialized is MISSING:
+            serialized = column[row] = self._serializer(
+                self.value(message, key),
+            )
+        return serialized
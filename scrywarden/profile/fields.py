@@ -1,7 +1,7 @@
 import typing as t
 
 from scrywarden.profile.reporters import Reporter, Mandatory
-from scrywarden.transport.message import Message
+from scrywarden.transport.message import Message, normalize
 from scrywarden.typing import JSONValue
 
 if t.TYPE_CHECKING:
@@ -17,6 +17,12 @@ class Field:
 
     Subclassing this class requires overriding the `get_value` method.
 
+    Fields whose value is built from fixed message keys can also override
+    `get_keys` and `compose`. This lets the pipeline extract and serialize
+    each key once per message for all profiles instead of once per field.
+    Subclasses that override `get_value` of a field implementing these
+    without overriding `get_keys` retrieve their value with `get_value`.
+
     Parameters
     ----------
     reporter: Optional[Reporter]
@@ -50,6 +56,45 @@ class Field:
         """
         raise NotImplementedError()
 
+    @property
+    def plans_value(self) -> bool:
+        """Returns if the value can be built from a shared extraction batch.
+
+        Only true when `get_value` is still implemented by the class that
+        implements `get_keys`, so overridden values are never bypassed.
+        """
+        cls = type(self)
+        owner = next(base for base in cls.__mro__ if 'get_keys' in vars(base))
+        return owner is not Field and cls.get_value is owner.get_value
+
+    def get_keys(self) -> t.Optional[t.Tuple[t.Tuple[str, ...], ...]]:
+        """Returns the message keys the field value is built from.
+
+        Returns
+        -------
+        Optional[Tuple[Tuple[str, ...], ...]]
+            Normalized message keys, or None if the field value cannot be
+            built from fixed keys. Fields returning None retrieve their value
+            with `get_value`.
+        """
+        return None
+
+    def compose(self, values: t.Sequence[str]) -> str:
+        """Builds the serialized field value from serialized key values.
+
+        Parameters
+        ----------
+        values: Sequence[str]
+            Canonical JSON strings of each key returned by `get_keys`, in the
+            same order. Missing keys are serialized as `null`.
+
+        Returns
+        -------
+        str
+            Serialized field value. Empty strings indicate a null value.
+        """
+        raise NotImplementedError()
+
 
 class Single(Field):
     """Returns a single JSON value from the message.
@@ -70,6 +115,13 @@ class Single(Field):
     def get_value(self, message: Message) -> JSONValue:
         return message.get(self.key or self.name)
 
+    def get_keys(self) -> t.Tuple[t.Tuple[str, ...], ...]:
+        return normalize(self.key or self.name),
+
+    def compose(self, values: t.Sequence[str]) -> str:
+        value, = values
+        return '' if value == 'null' else value
+
 
 class Multi(Field):
     """Returns a JSON array made of multiple JSON values.
@@ -91,3 +143,9 @@ class Multi(Field):
         for key in self.keys:
             values.append(message.get(key))
         return values
+
+    def get_keys(self) -> t.Tuple[t.Tuple[str, ...], ...]:
+        return tuple(normalize(key) for key in self.keys)
+
+    def compose(self, values: t.Sequence[str]) -> str:
+        return f"[{','.join(values)}]"
@@ -1,2 +1,2 @@
-from .base import Shipper
+from .base import Shipper, BufferedShipper
 from .config import parse_shippers
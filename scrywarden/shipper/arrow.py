@@ -0,0 +1,207 @@
+import logging
+import os
+import typing as t
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pa
+
+from scrywarden import database as db
+from scrywarden.config import parsers, Config
+from scrywarden.config.exceptions import ValidationError
+from scrywarden.exceptions import ConfigError
+from scrywarden.shipper import BufferedShipper
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+
+def is_valid_format(value: str) -> None:
+    """Determines if the file format value in the config is supported."""
+    if value not in EXTENSIONS:
+        raise ValidationError(
+            f"{value!r} is not a valid format, expected one of "
+            f"{', '.join(map(repr, EXTENSIONS))}",
+        )
+
+
+class _PartitionFile:
+    """File being written for a single profile and hour partition."""
+
+    def __init__(
+        self,
+        writer,
+        schema: 'pyarrow.Schema',
+        path: str,
+        temporary_path: str,
+    ):
+        self.writer = writer
+        self.schema: 'pyarrow.Schema' = schema
+        self.path: str = path
+        self.temporary_path: str = temporary_path
+        self.rows: int = 0
+
+
+class ArrowShipper(BufferedShipper):
+    """Saves the malicious anomalies to compressed Parquet or Arrow IPC files.
+
+    Files are partitioned by profile and by the hour the anomalies were
+    created in, using the directory layout::
+
+        <directory>/profile=<profile>/hour=<YYYY-MM-DDTHH>/part-<id>.parquet
+
+    Every flushed batch is appended to the open file of its partition as a
+    row group. Files are written to a hidden temporary path and moved into
+    place atomically when they are rotated, so readers never see partially
+    written files. Files are rotated once they hold `max_rows` rows, once
+    anomalies of a later hour arrive for the profile and on shutdown.
+
+    Requires the optional pyarrow dependency, which can be installed with
+    `pip install scrywarden[arrow]`.
+
+    Parameters
+    ----------
+    directory: str
+        Root directory of the partitioned files. Defaults to `alerts`.
+    format: str
+        File format to write, either `parquet` or `arrow` for the Arrow IPC
+        file format. Defaults to `parquet`.
+    compression: str
+        Compression codec to use. Defaults to `zstd`.
+    max_rows: int
+        Number of rows after which a file is rotated. Defaults to 1000000.
+    """
+    PARSER = BufferedShipper.PARSER.extend({
+        'directory': parsers.String(),
+        'format': parsers.String(validators=[is_valid_format]),
+        'compression': parsers.String(),
+        'max_rows': parsers.Integer(),
+    })
+
+    def __init__(
+        self,
+        directory: str = 'alerts',
+        format: str = 'parquet',
+        compression: t.Optional[str] = 'zstd',
+        max_rows: int = 1000000,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.directory: str = directory
+        self.format: str = format
+        self.compression: t.Optional[str] = compression
+        self.max_rows: int = max_rows
+        self._files: t.Dict[t.Tuple[str, datetime], _PartitionFile] = {}
+
+    def configure(self, config: Config) -> Config:
+        _require_pyarrow()
+        config = super().configure(config)
+        self.directory = config.get_value('directory', self.directory)
+        self.format = config.get_value('format', self.format)
+        self.compression = config.get_value('compression', self.compression)
+        self.max_rows = config.get_value('max_rows', self.max_rows)
+        return config
+
+    def open(self) -> None:
+        _require_pyarrow()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            for key in [*self._files]:
+                self._rotate(key)
+
+    def ship_batch(
+        self,
+        batch: t.List[t.Tuple[db.Investigation, pa.DataFrame]],
+    ) -> None:
+        profiles: t.Dict[str, t.List[pa.DataFrame]] = {}
+        for investigation, anomalies in batch:
+            profile = investigation.group.profile.name
+            profiles.setdefault(profile, []).append(anomalies)
+        for profile, frames in profiles.items():
+            anomalies = pa.concat(frames, ignore_index=True)
+            if 'message_id' in anomalies:
+                anomalies['message_id'] = anomalies['message_id'].astype(str)
+            hours = anomalies['created_at'].dt.floor('H')
+            for hour, rows in anomalies.groupby(hours, sort=True):
+                self._write(profile, hour.to_pydatetime(), rows)
+            latest = hours.max().to_pydatetime()
+            for key in [*self._files]:
+                if key[0] == profile and key[1] < latest:
+                    self._rotate(key)
+
+    def _write(
+        self,
+        profile: str,
+        hour: datetime,
+        anomalies: pa.DataFrame,
+    ) -> None:
+        table = pyarrow.Table.from_pandas(anomalies, preserve_index=False)
+        key = (profile, hour)
+        file = self._files.get(key)
+        if file is None:
+            file = self._files[key] = self._open_file(
+                profile, hour, table.schema,
+            )
+        file.writer.write_table(table.cast(file.schema))
+        file.rows += table.num_rows
+        logger.info(
+            "Wrote %d anomalies to '%s'", table.num_rows, file.path,
+        )
+        if file.rows >= self.max_rows:
+            self._rotate(key)
+
+    def _open_file(
+        self,
+        profile: str,
+        hour: datetime,
+        schema: 'pyarrow.Schema',
+    ) -> _PartitionFile:
+        directory = os.path.join(
+            self.directory, f'profile={profile}',
+            f"hour={hour.astimezone(timezone.utc):%Y-%m-%dT%H}",
+        )
+        os.makedirs(directory, exist_ok=True)
+        name = f'part-{uuid.uuid4().hex}{EXTENSIONS[self.format]}'
+        path = os.path.join(directory, name)
+        # Hidden files are skipped by dataset readers until rotated.
+        temporary_path = os.path.join(directory, f'.{name}.tmp')
+        if self.format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(
+                temporary_path, schema, compression=self.compression or 'none',
+            )
+        else:
+            writer = pyarrow.ipc.new_file(
+                temporary_path, schema,
+                options=pyarrow.ipc.IpcWriteOptions(
+                    compression=self.compression,
+                ),
+            )
+        return _PartitionFile(writer, schema, path, temporary_path)
+
+    def _rotate(self, key: t.Tuple[str, datetime]) -> None:
+        file = self._files.pop(key)
+        file.writer.close()
+        os.replace(file.temporary_path, file.path)
+        logger.debug("Rotated '%s' with %d rows", file.path, file.rows)
+
+
+def _require_pyarrow() -> None:
+    if pyarrow is None:
+        raise ConfigError(
+            "ArrowShipper requires pyarrow, install it with "
+            "'pip install scrywarden[arrow]'",
+        )
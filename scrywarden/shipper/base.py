@@ -1,5 +1,6 @@
 import logging
 import threading
+import time
 import typing as t
 import queue as q
 
@@ -9,7 +10,7 @@ from sqlalchemy.orm import sessionmaker, Session
 from scrywarden import database as db
 from scrywarden.curator.entry import CuratorEntry
 from scrywarden.entry import Entry
-from scrywarden.config import Config
+from scrywarden.config import Config, parsers
 from scrywarden.config.parsers import Parser
 
 logger = logging.getLogger(__name__)
@@ -65,6 +66,13 @@ class Shipper(threading.Thread):
         * field_id (int)
         * score (float)
 
+        The anomaly data is shared between all shippers and is read-only, so
+        writing into it raises a ValueError. Depending on the pandas version,
+        assigning a column can write into the shared data as well, so
+        shippers must ``copy()`` the dataframe before assigning, replacing
+        or modifying any column. Methods returning a new dataframe, such as
+        ``assign``, are safe to use on the shared data.
+
         Parameters
         ----------
         investigation: scrywarden.database.Investigation
@@ -73,21 +81,42 @@ class Shipper(threading.Thread):
             Malicious anomalies.
         """
 
+    def open(self) -> None:
+        """Opens resources kept open across calls to `ship`.
+
+        Called from the shipper thread before any findings are shipped.
+        Subclasses can override this to open files or connections once.
+        """
+
+    def close(self) -> None:
+        """Releases the resources opened by `open`.
+
+        Called from the shipper thread after the queue has been cleared on
+        shutdown.
+        """
+
     def run(self):
         """Main threading method."""
         self.queue = q.Queue(self.queue_size)
-        while not self.shutdown.is_set():
-            self._pull_entry()
-        logger.info("Shutting down shipper '%s'", self.name)
-        # Clear queue before shutdown.
-        while not self.queue.empty():
-            self._pull_entry()
+        self.open()
+        try:
+            while not self.shutdown.is_set():
+                self._pull_entry()
+            logger.info("Shutting down shipper '%s'", self.name)
+            # Clear queue before shutdown.
+            while not self.queue.empty():
+                self._pull_entry()
+        finally:
+            self.close()
 
     def _session(self, **kwargs) -> t.ContextManager[Session]:
         return db.managed_session(self.session_factory, **kwargs)
 
-    def _pull_entry(self):
-        entry = self.queue.get()
+    def _pull_entry(self, timeout: t.Optional[float] = None):
+        try:
+            entry = self.queue.get(timeout=timeout)
+        except q.Empty:
+            return
         try:
             self._handle_entry(entry)
         except Exception as error:
@@ -102,3 +131,142 @@ class Shipper(threading.Thread):
                 return logger.debug("Received curator blip: %s", entry.data)
             raise ValueError(f"Received unknown curator entry {entry.kind!r}")
         raise ValueError(f"Received unknown entry source {entry.source!r}")
+
+
+class BufferedShipper(Shipper):
+    """Shipper that coalesces findings of several investigations into batches.
+
+    Findings are buffered and shipped together once the buffered anomalies
+    reach `batch_size` rows, the buffer holds `batch_count` investigations or
+    `flush_interval` seconds passed since the first findings were buffered.
+    Remaining findings are flushed on shutdown. Subclasses should override
+    the `ship_batch` method instead of `ship`.
+
+    A batch that fails to ship stays buffered and is shipped again on the
+    next flush. After `max_attempts` failed attempts the batch is dropped
+    with an error, so a batch that can never be shipped doesn't block the
+    findings after it or grow the buffer without bound.
+
+    Parameters
+    ----------
+    batch_size: int
+        Number of anomaly rows that triggers a flush. 0 disables the limit.
+        Defaults to 10000.
+    batch_count: int
+        Number of investigations that triggers a flush. 0 disables the limit.
+        Defaults to 100.
+    flush_interval: float
+        Maximum number of seconds findings stay buffered. 0 disables the
+        limit. Defaults to 5 seconds.
+    max_attempts: int
+        Number of times shipping a batch is attempted before it is dropped.
+        Defaults to 3.
+    """
+    PARSER = parsers.Options({
+        'batch_size': parsers.Integer(),
+        'batch_count': parsers.Integer(),
+        'flush_interval': parsers.Float(),
+        'max_attempts': parsers.Integer(),
+    })
+
+    def __init__(
+        self,
+        batch_size: int = 10000,
+        batch_count: int = 100,
+        flush_interval: float = 5.,
+        max_attempts: int = 3,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.batch_size: int = batch_size
+        self.batch_count: int = batch_count
+        self.flush_interval: float = flush_interval
+        self.max_attempts: int = max_attempts
+        self._batch: t.List[t.Tuple[db.Investigation, pa.DataFrame]] = []
+        self._rows: int = 0
+        self._deadline: float = 0.0
+        self._attempts: int = 0
+
+    def configure(self, config: Config) -> Config:
+        config = super().configure(config)
+        self.batch_size = config.get_value('batch_size', self.batch_size)
+        self.batch_count = config.get_value('batch_count', self.batch_count)
+        self.flush_interval = config.get_value(
+            'flush_interval', self.flush_interval,
+        )
+        self.max_attempts = config.get_value(
+            'max_attempts', self.max_attempts,
+        )
+        return config
+
+    def ship(
+        self,
+        investigation: db.Investigation,
+        anomalies: pa.DataFrame,
+    ) -> None:
+        if not self._batch:
+            self._deadline = time.monotonic() + self.flush_interval
+        self._batch.append((investigation, anomalies))
+        self._rows += len(anomalies)
+        if (
+            (self.batch_size and self._rows >= self.batch_size)
+            or (self.batch_count and len(self._batch) >= self.batch_count)
+        ):
+            self.flush()
+
+    def ship_batch(
+        self,
+        batch: t.List[t.Tuple[db.Investigation, pa.DataFrame]],
+    ) -> None:
+        """Handles the buffered findings of several investigations.
+
+        Parameters
+        ----------
+        batch: List[Tuple[Investigation, DataFrame]]
+            Investigations and their malicious anomalies in the order they
+            were received.
+        """
+        raise NotImplementedError()
+
+    def flush(self) -> None:
+        """Ships the buffered findings.
+
+        Findings stay buffered when shipping fails and are shipped again on
+        the next flush, until shipping them failed `max_attempts` times.
+        """
+        if not self._batch:
+            return
+        logger.debug(
+            "Shipper '%s' flushing %d investigations", self.name,
+            len(self._batch),
+        )
+        try:
+            self.ship_batch(list(self._batch))
+        except Exception:
+            self._attempts += 1
+            self._deadline = time.monotonic() + self.flush_interval
+            if self._attempts >= self.max_attempts:
+                logger.error(
+                    "Shipper '%s' dropping %d anomalies of %d "
+                    "investigations after %d failed attempts", self.name,
+                    self._rows, len(self._batch), self._attempts,
+                )
+                self._batch, self._rows, self._attempts = [], 0, 0
+            raise
+        self._batch, self._rows, self._attempts = [], 0, 0
+
+    def close(self) -> None:
+        self.flush()
+
+    def _pull_entry(self, timeout: t.Optional[float] = None):
+        if self._batch and self.flush_interval:
+            timeout = max(self._deadline - time.monotonic(), 0.0)
+        super()._pull_entry(timeout=timeout)
+        if (
+            self._batch and self.flush_interval
+            and time.monotonic() >= self._deadline
+        ):
+            try:
+                self.flush()
+            except Exception as error:
+                logger.exception(error)
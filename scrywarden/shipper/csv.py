@@ -1,25 +1,27 @@
 import logging
-import os
+import typing as t
 
 import pandas as pa
 
-from scrywarden.shipper import Shipper
+from scrywarden import database as db
+from scrywarden.shipper import BufferedShipper
 from scrywarden.config import parsers, Config
 
 logger = logging.getLogger(__name__)
 
 
-class CSVShipper(Shipper):
+class CSVShipper(BufferedShipper):
     """Saves the malicious anomalies to a CSV.
 
-    Appends results instead of writing over the file.
+    Appends results instead of writing over the file. The file is kept open
+    while the shipper runs and findings are written in batches.
 
     Parameters
     ----------
     filename: str
         Path to the CSV file.
     """
-    PARSER = parsers.Options({
+    PARSER = BufferedShipper.PARSER.extend({
         'filename': parsers.String(),
     })
 
@@ -27,21 +29,35 @@ class CSVShipper(Shipper):
     def __init__(self, filename: str = 'alerts.csv', **kwargs):
         super().__init__(**kwargs)
         self.filename: str = filename
+        self._file: t.Optional[t.TextIO] = None
 
     def configure(self, config: Config) -> Config:
         config = super().configure(config)
         self.filename = config.get_value('filename', self.filename)
         return config
 
-    def ship(self, investigation, anomalies: pa.DataFrame) -> None:
+    def open(self) -> None:
+        self._file = open(self.filename, 'a', newline='')
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def ship_batch(
+        self,
+        batch: t.List[t.Tuple[db.Investigation, pa.DataFrame]],
+    ) -> None:
+        anomalies = pa.concat(
+            [frame for _, frame in batch], ignore_index=True,
+        )
         logger.info(
             "Writing %d anomalies to '%s'", len(anomalies), self.filename,
         )
-        write_header = True
-        try:
-            write_header = os.path.getsize(self.filename) == 0
-        except FileNotFoundError:
-            pass
         anomalies.to_csv(
-            self.filename, mode='a+', header=write_header, index=False,
+            self._file, header=self._file.tell() == 0, index=False,
         )
+        self._file.flush()
@@ -5,6 +5,7 @@ from pandas import DataFrame
 from scrywarden.shipper import Shipper
 from scrywarden.config import parsers, Config
 from scrywarden.config.exceptions import ValidationError
+from scrywarden.shipper.ndjson import to_ndjson
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +20,11 @@ def is_valid_level(value: str) -> None:
 
 
 class LoggerShipper(Shipper):
-    """Monitor that logs alerts to the standard logger."""
+    """Monitor that logs alerts to the standard logger.
+
+    Logs the anomalies of an investigation in a single record with one JSON
+    object per line.
+    """
 
     PARSER = parsers.Options({
         'level': parsers.String(validators=[is_valid_level]),
@@ -35,8 +40,11 @@ class LoggerShipper(Shipper):
             self.level = logging.getLevelName(config['level'].value)
 
     def ship(self, investigation, anomalies: DataFrame) -> None:
-        for row in anomalies.iterrows():
-            logger.log(self.level, "\n%s", row)
+        if not logger.isEnabledFor(self.level) or anomalies.empty:
+            return
+        logger.log(
+            self.level, "\n%s", to_ndjson(anomalies).decode().rstrip('\n'),
+        )
 
 
 class LoggerCountShipper(Shipper):
@@ -0,0 +1,116 @@
+import logging
+import sys
+import typing as t
+
+import orjson
+import pandas as pa
+
+from scrywarden import database as db
+from scrywarden.config import parsers, Config
+from scrywarden.shipper import BufferedShipper
+
+logger = logging.getLogger(__name__)
+
+STREAMS = {
+    'stdout': lambda: sys.stdout.buffer,
+    'stderr': lambda: sys.stderr.buffer,
+}
+
+
+def to_ndjson(frame: pa.DataFrame) -> bytes:
+    """Serializes a dataframe to newline delimited JSON.
+
+    Columns are converted to python values a whole column at a time, then
+    every row is dumped with its own orjson call and the lines are joined
+    once. orjson has no newline delimited mode, and dumping rows this way
+    keeps its exact floats and datetimes. Datetimes are written as RFC 3339
+    strings, UUIDs as strings and missing values as null.
+
+    Parameters
+    ----------
+    frame: DataFrame
+        Dataframe to serialize.
+
+    Returns
+    -------
+    bytes
+        One JSON object per row, each terminated by a newline.
+    """
+    if frame.empty:
+        return b''
+    columns = []
+    for name in frame.columns:
+        series = frame[name]
+        if pa.api.types.is_datetime64_any_dtype(series):
+            values = series.dt.to_pydatetime().tolist()
+            if series.hasnans:
+                values = [
+                    None if missing else value
+                    for value, missing in zip(values, series.isna())
+                ]
+        else:
+            values = series.tolist()
+        columns.append(values)
+    names = [str(name) for name in frame.columns]
+    lines = [
+        orjson.dumps(dict(zip(names, row))) for row in zip(*columns)
+    ]
+    lines.append(b'')
+    return b'\n'.join(lines)
+
+
+class NDJSONShipper(BufferedShipper):
+    """Writes the malicious anomalies as newline delimited JSON.
+
+    Every anomaly becomes a JSON object with the investigation ID added.
+    Each flushed batch is serialized with `to_ndjson` and written to the
+    file or stream with a single write.
+
+    Parameters
+    ----------
+    filename: str
+        Path of the file to append to. Use `stdout` or `stderr` to write to
+        the standard streams instead. Defaults to `alerts.ndjson`.
+    """
+    PARSER = BufferedShipper.PARSER.extend({
+        'filename': parsers.String(),
+    })
+
+    def __init__(self, filename: str = 'alerts.ndjson', **kwargs):
+        super().__init__(**kwargs)
+        self.filename: str = filename
+        self._file: t.Optional[t.BinaryIO] = None
+
+    def configure(self, config: Config) -> Config:
+        config = super().configure(config)
+        self.filename = config.get_value('filename', self.filename)
+        return config
+
+    def open(self) -> None:
+        if self.filename in STREAMS:
+            self._file = STREAMS[self.filename]()
+        else:
+            self._file = open(self.filename, 'ab')
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            if self._file is not None and self.filename not in STREAMS:
+                self._file.close()
+            self._file = None
+
+    def ship_batch(
+        self,
+        batch: t.List[t.Tuple[db.Investigation, pa.DataFrame]],
+    ) -> None:
+        frames = [
+            anomalies.assign(investigation_id=investigation.id)
+            for investigation, anomalies in batch
+        ]
+        data = to_ndjson(pa.concat(frames, ignore_index=True))
+        logger.info(
+            "Writing %d anomalies to '%s'", data.count(b'\n'), self.filename,
+        )
+        self._file.write(data)
+        self._file.flush()
@@ -0,0 +1,223 @@
+import http.client
+import logging
+import queue as q
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import pandas as pa
+
+from scrywarden import database as db
+from scrywarden.config import parsers, Config
+from scrywarden.shipper import BufferedShipper
+from scrywarden.shipper.ndjson import to_ndjson
+from scrywarden.timing import ExponentialBackoff
+
+logger = logging.getLogger(__name__)
+
+# Responses that are worth sending the same request again for.
+RETRY_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+
+
+class WebhookError(Exception):
+    """Raised when a webhook request fails."""
+
+
+class WebhookShipper(BufferedShipper):
+    """Posts the malicious anomalies to an HTTP webhook.
+
+    Buffered findings are posted in batches as newline delimited JSON, one
+    object per anomaly with its `investigation_id`. Requests are sent by a
+    pool of `concurrency` worker threads that reuse keep-alive connections,
+    so the shipper thread keeps pulling findings while requests are in
+    flight or waiting to be retried. When every worker is busy, shipping
+    waits for one to free up.
+
+    Failed requests are retried up to `retries` times with an exponential
+    backoff with jitter. Connection errors and the statuses 408, 429 and 5xx
+    are retried, any other error status drops the batch. Once the shipper
+    shuts down, waiting retries are sent right away and the remaining
+    retries, including those of the final flush, must finish within
+    `close_timeout` seconds.
+
+    Parameters
+    ----------
+    url: str
+        URL to post the anomalies to.
+    headers: Dict[str, str]
+        Extra headers to send with each request, such as authorization.
+    timeout: float
+        Number of seconds to wait on the connection. Defaults to 10 seconds.
+    concurrency: int
+        Maximum number of requests in flight. Defaults to 4.
+    retries: int
+        Number of times a failed request is retried. Defaults to 3.
+    close_timeout: float
+        Number of seconds requests may keep being retried after shutdown.
+        Defaults to 30 seconds.
+    """
+    PARSER = BufferedShipper.PARSER.extend({
+        'url': parsers.String(required=True),
+        'headers': parsers.Dict(parsers.String()),
+        'timeout': parsers.Float(),
+        'concurrency': parsers.Integer(),
+        'retries': parsers.Integer(),
+        'close_timeout': parsers.Float(),
+    })
+
+    def __init__(
+        self,
+        url: str = '',
+        headers: t.Optional[t.Dict[str, str]] = None,
+        timeout: float = 10.,
+        concurrency: int = 4,
+        retries: int = 3,
+        close_timeout: float = 30.,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.url: str = url
+        self.headers: t.Dict[str, str] = dict(headers or {})
+        self.timeout: float = timeout
+        self.concurrency: int = concurrency
+        self.retries: int = retries
+        self.close_timeout: float = close_timeout
+        self._close_deadline: t.Optional[float] = None
+        self._executor: t.Optional[ThreadPoolExecutor] = None
+        self._slots: t.Optional[threading.BoundedSemaphore] = None
+        self._connections: 't.Optional[q.LifoQueue]' = None
+
+    def configure(self, config: Config) -> Config:
+        config = super().configure(config)
+        self.url = config.get_value('url', self.url)
+        self.headers = config.get_value('headers', self.headers)
+        self.timeout = config.get_value('timeout', self.timeout)
+        self.concurrency = config.get_value('concurrency', self.concurrency)
+        self.retries = config.get_value('retries', self.retries)
+        self.close_timeout = config.get_value(
+            'close_timeout', self.close_timeout,
+        )
+        return config
+
+    def open(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            self.concurrency, thread_name_prefix=f'{self.name}-Webhook',
+        )
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._connections = q.LifoQueue()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            while self._connections is not None:
+                try:
+                    self._connections.get_nowait().close()
+                except q.Empty:
+                    break
+
+    def ship_batch(
+        self,
+        batch: t.List[t.Tuple[db.Investigation, pa.DataFrame]],
+    ) -> None:
+        frames = [
+            anomalies.assign(investigation_id=investigation.id)
+            for investigation, anomalies in batch
+        ]
+        body = to_ndjson(pa.concat(frames, ignore_index=True))
+        if not body:
+            return
+        self._slots.acquire()
+        future = self._executor.submit(self._deliver, body)
+        future.add_done_callback(lambda _: self._slots.release())
+
+    def _deliver(self, body: bytes) -> None:
+        backoff = ExponentialBackoff(initialize=True)
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return self._post(body)
+            except WebhookError as error:
+                logger.warning("Webhook request failed: %s", error)
+            except (OSError, http.client.HTTPException) as error:
+                logger.warning("Webhook connection failed: %s", error)
+            if attempts > self.retries:
+                break
+            delay = backoff.next()
+            if not self.shutdown.is_set():
+                logger.warning(
+                    "Retrying webhook request in %.2f seconds", delay,
+                )
+                # Retries waiting when a shutdown occurs are sent right away.
+                self.shutdown.wait(delay)
+                continue
+            remaining = self._get_close_deadline() - time.monotonic()
+            if remaining <= 0:
+                break
+            delay = min(delay, remaining)
+            logger.warning(
+                "Retrying webhook request in %.2f seconds before closing",
+                delay,
+            )
+            time.sleep(delay)
+        logger.error(
+            "Dropping %d anomalies after %d webhook attempts",
+            body.count(b'\n'), attempts,
+        )
+
+    def _get_close_deadline(self) -> float:
+        """Returns when retrying stops after the shipper shut down."""
+        if self._close_deadline is None:
+            self._close_deadline = time.monotonic() + self.close_timeout
+        return self._close_deadline
+
+    def _post(self, body: bytes) -> None:
+        url = urlsplit(self.url)
+        path = url.path or '/'
+        if url.query:
+            path = f'{path}?{url.query}'
+        connection = self._get_connection()
+        try:
+            connection.request('POST', path, body=body, headers={
+                'Content-Type': 'application/x-ndjson',
+                **self.headers,
+            })
+            response = connection.getresponse()
+            # The response must be read completely to reuse the connection.
+            response.read()
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._connections.put(connection)
+        if response.status in RETRY_STATUSES:
+            raise WebhookError(f"Received status {response.status}")
+        if response.status >= 400:
+            logger.error(
+                "Dropping %d anomalies after webhook responded with "
+                "status %d", body.count(b'\n'), response.status,
+            )
+            return
+        logger.info("Posted %d anomalies to webhook", body.count(b'\n'))
+
+    def _get_connection(self) -> http.client.HTTPConnection:
+        try:
+            return self._connections.get_nowait()
+        except q.Empty:
+            pass
+        url = urlsplit(self.url)
+        if url.scheme == 'https':
+            return http.client.HTTPSConnection(
+                url.hostname, url.port, timeout=self.timeout,
+            )
+        return http.client.HTTPConnection(
+            url.hostname, url.port, timeout=self.timeout,
+        )
@@ -0,0 +1,413 @@
+"""Runs the statements whose syntax differs between databases."""
+
+import typing as t
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.orm import Session
+
+Row = t.Dict[str, t.Any]
+
+
+class Storage:
+    """Inserts and upserts rows on a specific kind of database.
+
+    Use `get_storage` to retrieve the storage of the database a session is
+    bound to.
+    """
+
+    def insert(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+    ) -> None:
+        """Inserts rows into a table.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        table: Table
+            Table to insert into.
+        rows: List[Dict[str, Any]]
+            Column values of the rows to insert.
+        """
+        raise NotImplementedError()
+
+    def insert_ignore(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        index_elements: t.Optional[t.Sequence[sa.Column]] = None,
+    ) -> None:
+        """Inserts rows into a table, skipping rows that conflict.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        table: Table
+            Table to insert into.
+        rows: List[Dict[str, Any]]
+            Column values of the rows to insert.
+        index_elements: Optional[Sequence[Column]]
+            Columns of the unique index conflicts are checked against. Any
+            unique index is checked when not given.
+        """
+        raise NotImplementedError()
+
+    def insert_returning(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        column: sa.Column,
+    ) -> t.List[t.Any]:
+        """Inserts rows into a table and returns a generated column.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        table: Table
+            Table to insert into.
+        rows: List[Dict[str, Any]]
+            Column values of the rows to insert.
+        column: Column
+            Generated column to return, such as the primary key.
+
+        Returns
+        -------
+        List[Any]
+            Values of the column in the same order as the rows.
+        """
+        raise NotImplementedError()
+
+    def insert_select_returning(
+        self,
+        session: Session,
+        table: sa.Table,
+        columns: t.Sequence[str],
+        select: sa.sql.Select,
+        column: sa.Column,
+    ) -> t.List[t.Any]:
+        """Inserts the rows of a select into a table and returns a column.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        table: Table
+            Table to insert into.
+        columns: Sequence[str]
+            Names of the columns the selected values are inserted into.
+        select: Select
+            Statement selecting the rows to insert.
+        column: Column
+            Inserted column to return.
+
+        Returns
+        -------
+        List[Any]
+            Values of the column of every inserted row.
+        """
+        raise NotImplementedError()
+
+    def add_counts(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        index_elements: t.Sequence[sa.Column],
+        count: sa.Column,
+        verify: t.Sequence[sa.Column] = (),
+    ) -> None:
+        """Inserts rows or adds their count to the existing rows.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        table: Table
+            Table to upsert into.
+        rows: List[Dict[str, Any]]
+            Column values of the rows to upsert. Rows must be unique by the
+            index elements.
+        index_elements: Sequence[Column]
+            Columns of the unique index the existing rows are found by.
+        count: Column
+            Column whose value is added to the existing row.
+        verify: Sequence[Column]
+            Columns that must also be equal to the existing row. Rows that
+            conflict with a row whose verified columns differ are skipped.
+        """
+        raise NotImplementedError()
+
+    def merge_deltas(
+        self,
+        session: Session,
+        table: sa.Table,
+        deltas: sa.Table,
+        key: sa.Column,
+        count: sa.Column,
+        limit: int,
+    ) -> int:
+        """Adds the oldest pending deltas to their rows and removes them.
+
+        The deltas are added and removed in one statement or transaction,
+        so readers adding the pending deltas to the rows never count a
+        delta twice or miss one.
+
+        Parameters
+        ----------
+        session: Session
+            SQLAlchemy session.
+        table: Table
+            Table whose rows the deltas are added to.
+        deltas: Table
+            Insert only table of the deltas, ordered by its primary key.
+        key: Column
+            Column of the deltas referencing the primary key of the table.
+        count: Column
+            Column of the table the delta counts are added to. The deltas
+            store their count in a column of the same name.
+        limit: int
+            Maximum number of deltas to merge.
+
+        Returns
+        -------
+        int
+            Number of deltas merged.
+        """
+        raise NotImplementedError()
+
+
+class PostgreSQLStorage(Storage):
+    """Uses multi-row statements with `ON CONFLICT` and `RETURNING`."""
+
+    def insert(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+    ) -> None:
+        session.execute(pg.insert(table).values(rows))
+
+    def insert_ignore(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        index_elements: t.Optional[t.Sequence[sa.Column]] = None,
+    ) -> None:
+        session.execute(pg.insert(table).values(rows).on_conflict_do_nothing(
+            index_elements=index_elements,
+        ))
+
+    def insert_returning(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        column: sa.Column,
+    ) -> t.List[t.Any]:
+        result = session.execute(
+            pg.insert(table).returning(column).values(rows),
+        )
+        return [row[0] for row in result]
+
+    def insert_select_returning(
+        self,
+        session: Session,
+        table: sa.Table,
+        columns: t.Sequence[str],
+        select: sa.sql.Select,
+        column: sa.Column,
+    ) -> t.List[t.Any]:
+        result = session.execute(
+            table.insert().from_select(columns, select).returning(column),
+        )
+        return [row[0] for row in result]
+
+    def add_counts(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        index_elements: t.Sequence[sa.Column],
+        count: sa.Column,
+        verify: t.Sequence[sa.Column] = (),
+    ) -> None:
+        statement = pg.insert(table).values(rows)
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={count.name: count + excluded[count.name]},
+            where=sa.and_(*(
+                column == excluded[column.name] for column in verify
+            )) if verify else None,
+        )
+        session.execute(statement)
+
+    def merge_deltas(
+        self,
+        session: Session,
+        table: sa.Table,
+        deltas: sa.Table,
+        key: sa.Column,
+        count: sa.Column,
+        limit: int,
+    ) -> int:
+        # Deltas inserted while merging are not visible to the statement
+        # snapshot, so they are neither deleted nor added. Deltas locked by
+        # another merge are skipped.
+        delta_id = deltas.primary_key.columns.values()[0].name
+        table_id = table.primary_key.columns.values()[0].name
+        return int(session.execute(sa.text(f"""
+            WITH moved AS (
+                DELETE FROM {deltas.name} WHERE {delta_id} IN (
+                    SELECT {delta_id} FROM {deltas.name}
+                    ORDER BY {delta_id}
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {key.name}, {count.name}
+            ), summed AS (
+                SELECT {key.name}, sum({count.name}) AS total,
+                    count(*) AS merged
+                FROM moved GROUP BY {key.name}
+            ), updated AS (
+                UPDATE {table.name}
+                SET {count.name} = {table.name}.{count.name} + summed.total
+                FROM summed
+                WHERE {table.name}.{table_id} = summed.{key.name}
+                RETURNING summed.merged
+            )
+            SELECT coalesce(sum(merged), 0) FROM updated
+        """), {'limit': limit}).scalar())
+
+
+class SQLiteStorage(Storage):
+    """Uses `INSERT OR IGNORE` and single row inserts for generated keys.
+
+    Statements run in the same process as the database, so sending rows
+    one at a time and selecting the rows of an `INSERT ... SELECT` before
+    inserting them cost no network round trips.
+    """
+
+    def insert(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+    ) -> None:
+        session.execute(table.insert(), rows)
+
+    def insert_ignore(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        index_elements: t.Optional[t.Sequence[sa.Column]] = None,
+    ) -> None:
+        session.execute(table.insert().prefix_with('OR IGNORE'), rows)
+
+    def insert_returning(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        column: sa.Column,
+    ) -> t.List[t.Any]:
+        statement = table.insert()
+        return [
+            session.execute(statement, row).inserted_primary_key[0]
+            for row in rows
+        ]
+
+    def insert_select_returning(
+        self,
+        session: Session,
+        table: sa.Table,
+        columns: t.Sequence[str],
+        select: sa.sql.Select,
+        column: sa.Column,
+    ) -> t.List[t.Any]:
+        rows = [dict(zip(columns, row)) for row in session.execute(select)]
+        if rows:
+            session.execute(table.insert(), rows)
+        return [row[column.name] for row in rows]
+
+    def add_counts(
+        self,
+        session: Session,
+        table: sa.Table,
+        rows: t.List[Row],
+        index_elements: t.Sequence[sa.Column],
+        count: sa.Column,
+        verify: t.Sequence[sa.Column] = (),
+    ) -> None:
+        # Writes are serialized, so adding to the existing rows before
+        # inserting the missing ones can't race with another writer.
+        update = table.update().values({
+            count.name: count + sa.bindparam(f'_{count.name}'),
+        }).where(sa.and_(*(
+            column == sa.bindparam(f'_{column.name}')
+            for column in (*index_elements, *verify)
+        )))
+        session.execute(update, [
+            {f'_{key}': value for key, value in row.items()} for row in rows
+        ])
+        self.insert_ignore(session, table, rows, index_elements)
+
+    def merge_deltas(
+        self,
+        session: Session,
+        table: sa.Table,
+        deltas: sa.Table,
+        key: sa.Column,
+        count: sa.Column,
+        limit: int,
+    ) -> int:
+        # Writes are serialized, so the update and the delete see the same
+        # deltas.
+        delta_id = deltas.primary_key.columns.values()[0]
+        table_id = table.primary_key.columns.values()[0]
+        oldest = sa.select([delta_id]).order_by(delta_id).limit(limit).alias()
+        last_id = session.execute(
+            sa.select([sa.func.max(oldest.c[delta_id.name])]),
+        ).scalar()
+        if last_id is None:
+            return 0
+        pending = delta_id <= last_id
+        total = sa.select([sa.func.sum(deltas.c[count.name])]).where(
+            sa.and_(key == table_id, pending),
+        ).as_scalar()
+        session.execute(table.update().values({
+            count.name: count + total,
+        }).where(table_id.in_(sa.select([key]).where(pending))))
+        return session.execute(deltas.delete().where(pending)).rowcount
+
+
+STORAGES: t.Dict[str, Storage] = {
+    'postgresql': PostgreSQLStorage(),
+    'sqlite': SQLiteStorage(),
+}
+
+
+def get_storage(session: Session) -> Storage:
+    """Returns the storage of the database a session is bound to.
+
+    Parameters
+    ----------
+    session: Session
+        SQLAlchemy session.
+
+    Returns
+    -------
+    Storage
+        Storage of the session database.
+    """
+    return STORAGES[session.get_bind().dialect.name]
@@ -1,8 +1,10 @@
 import typing as t
-from collections import KeysView, ItemsView, ValuesView
+from collections.abc import KeysView, ItemsView, ValuesView
 from datetime import datetime, timezone
 from uuid import uuid4, UUID
 
+import orjson
+
 from scrywarden.typing import JSONValue
 
 
@@ -76,6 +78,65 @@ def keys(data: JSONValue) -> t.Iterator[t.Tuple[str, ...]]:
                 yield field, *nested_field
 
 
+def flatten(data: JSONValue) -> t.Dict[t.Tuple[str, ...], JSONValue]:
+    """Builds a flattened index of every field a JSON value has.
+
+    The index maps each field returned by `keys` to its value, so nested
+    lookups and membership checks become a single dictionary operation.
+    Fields are inserted in the same order `keys` iterates over them.
+
+    Parameters
+    ----------
+    data: JSONValue
+        Decoded JSON value.
+
+    Returns
+    -------
+    Dict[Tuple[str, ...], JSONValue]
+        Dictionary of field tuples to their JSON values.
+    """
+    index: t.Dict[t.Tuple[str, ...], JSONValue] = {}
+    _flatten(data, (), index)
+    return index
+
+
+def _flatten(
+    data: JSONValue,
+    prefix: t.Tuple[str, ...],
+    index: t.Dict[t.Tuple[str, ...], JSONValue],
+) -> None:
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = ((str(position), value) for position, value in enumerate(data))
+    else:
+        return
+    for field, value in items:
+        key = (*prefix, field)
+        index[key] = value
+        _flatten(value, key, index)
+
+
+def normalize(field: t.Sequence[str]) -> t.Tuple[str, ...]:
+    """Normalizes a field into a hashable tuple of strings.
+
+    Parameters
+    ----------
+    field: Sequence[str]
+        Single field string or sequence of nested field strings.
+
+    Returns
+    -------
+    Tuple[str, ...]
+        Normalized field tuple.
+    """
+    if isinstance(field, tuple):
+        return field
+    if isinstance(field, str):
+        return field,
+    return tuple(field)
+
+
 def copy(data: JSONValue) -> JSONValue:
     """Deep copies a JSON value.
 
@@ -99,15 +160,90 @@ def copy(data: JSONValue) -> JSONValue:
     return data
 
 
-class Message(t.NamedTuple):
-    """JSON data received from a data source.
+class MessageLookup:
+    """Mixin implementing the field lookup interface of messages.
 
-    Uses a named tuple for the sake of usability + immutability.
+    Classes using it provide the decoded JSON `data` and an optional
+    flattened `index` created by `flatten`. Lookups, membership checks and
+    iteration walk the JSON data when there is no index and become
+    dictionary operations when there is one. Fields are normalized with
+    `normalize` before being looked up.
     """
 
+    __slots__ = ()
+
+    data: JSONValue
+    index: t.Optional[t.Dict[t.Tuple[str, ...], JSONValue]]
+
+    def __getitem__(self, item: t.Sequence[str]) -> JSONValue:
+        index = self.index
+        if index is None:
+            return get(self.data, normalize(item))
+        return _lookup(self.data, index, item)
+
+    def __len__(self) -> int:
+        index = self.index
+        if index is None:
+            return sum(1 for _ in keys(self.data))
+        return len(index)
+
+    def __iter__(self) -> t.Iterator[t.Tuple[str, ...]]:
+        index = self.index
+        if index is None:
+            return keys(self.data)
+        return iter(index)
+
+    def __contains__(self, item: t.Sequence[str]) -> bool:
+        index = self.index
+        if index is None:
+            try:
+                _ = self[item]
+                return True
+            except KeyError:
+                return False
+        item = normalize(item)
+        return not item or item in index
+
+    def keys(self) -> KeysView:
+        return KeysView(self)
+
+    def items(self) -> ItemsView:
+        return ItemsView(self)
+
+    def values(self) -> ValuesView:
+        return ValuesView(self)
+
+    def get(
+        self,
+        item: t.Sequence[str],
+        default: t.Optional = None,
+    ) -> t.Optional[JSONValue]:
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+
+class _MessageFields(t.NamedTuple):
     id: UUID
     timestamp: datetime
     data: JSONValue
+    index: t.Optional[t.Dict[t.Tuple[str, ...], JSONValue]] = None
+
+
+class Message(MessageLookup, _MessageFields):
+    """JSON data received from a data source.
+
+    Uses a named tuple for the sake of usability + immutability. Field
+    lookups are provided by `MessageLookup`.
+
+    Messages can optionally carry a flattened index of their fields created
+    by `flatten`. Indexed messages perform lookups, membership checks and
+    iteration as dictionary operations instead of walking the JSON data,
+    which pays off when many profiles inspect the same message.
+    """
+
+    __slots__ = ()
 
     @classmethod
     def create(
@@ -115,6 +251,7 @@ class Message(t.NamedTuple):
         data: JSONValue,
         id: t.Optional[UUID] = None,
         timestamp: t.Optional[datetime] = None,
+        indexed: bool = False,
     ) -> 'Message':
         """Creates an instance of a message with default values.
 
@@ -127,6 +264,8 @@ class Message(t.NamedTuple):
         timestamp: datetime
             Datetime of the message. This will default to the time this
             message instance is created.
+        indexed: bool
+            If the flattened field index should be built for the message.
 
         Returns
         -------
@@ -135,42 +274,152 @@ class Message(t.NamedTuple):
         """
         return cls(
             id or uuid4(), timestamp or datetime.now(timezone.utc), data,
+            flatten(data) if indexed else None,
         )
 
-    def __getitem__(self, item: t.Sequence[str]) -> JSONValue:
-        if isinstance(item, str):
-            item = (item,)
-        return get(self.data, item)
+    def with_index(self) -> 'Message':
+        """Returns the message with the flattened field index built.
 
-    def __len__(self) -> int:
-        return len([*iter(self)])
+        Returns
+        -------
+        Message
+            Indexed message. Returns itself if already indexed.
+        """
+        if self.index is not None:
+            return self
+        return Message(self.id, self.timestamp, self.data, flatten(self.data))
 
-    def __iter__(self) -> t.Iterator[t.Tuple[str, ...]]:
-        return keys(self.data)
 
-    def __contains__(self, item: t.Sequence[str]) -> bool:
-        try:
-            _ = self[item]
-            return True
-        except KeyError:
-            return False
+class RawMessage(MessageLookup):
+    """JSON message that holds the raw bytes and decodes them on demand.
 
-    def keys(self) -> KeysView:
-        return KeysView(self)
+    Transports that receive JSON documents as bytes can send these instead of
+    a `Message` to defer the decoding cost until a profile reads a key from
+    the message. The document is decoded with orjson the first time the data
+    is accessed and cached afterwards, releasing the raw bytes. Queued raw
+    messages are also much more compact than their decoded dictionaries.
 
-    def items(self) -> ItemsView:
-        return ItemsView(self)
+    Supports the same lookup interface as `Message`. When `indexed` is set,
+    the flattened field index is built lazily on the first lookup.
 
-    def values(self) -> ValuesView:
-        return ValuesView(self)
+    Parameters
+    ----------
+    id: UUID
+        UUID of the message.
+    timestamp: datetime
+        Datetime of the message.
+    raw: Union[bytes, str]
+        Encoded JSON document.
+    indexed: bool
+        If lookups should go through a flattened field index.
+    """
 
-    def get(
+    __slots__ = ('id', 'timestamp', 'raw', 'indexed', '_data', '_index')
+
+    def __init__(
         self,
-        item: t.Sequence[str],
-        default: t.Optional = None,
-    ) -> t.Optional[JSONValue]:
-        try:
-            return self[item]
-        except KeyError:
-            return default
+        id: UUID,
+        timestamp: datetime,
+        raw: t.Union[bytes, str],
+        indexed: bool = False,
+    ):
+        self.id: UUID = id
+        self.timestamp: datetime = timestamp
+        self.raw: t.Union[bytes, str] = raw
+        self.indexed: bool = indexed
+        self._data: t.Optional[JSONValue] = None
+        self._index: t.Optional[t.Dict[t.Tuple[str, ...], JSONValue]] = None
+
+    @classmethod
+    def create(
+        cls,
+        raw: t.Union[bytes, str],
+        id: t.Optional[UUID] = None,
+        timestamp: t.Optional[datetime] = None,
+        indexed: bool = False,
+    ) -> 'RawMessage':
+        """Creates an instance of a raw message with default values.
 
+        Parameters
+        ----------
+        raw: Union[bytes, str]
+            Encoded JSON document of the message.
+        id: UUID
+            Custom UUID of the message. This will default to a random UUID V4.
+        timestamp: datetime
+            Datetime of the message. This will default to the time this
+            message instance is created.
+        indexed: bool
+            If lookups should go through a flattened field index.
+
+        Returns
+        -------
+        RawMessage
+            Created raw message object.
+        """
+        return cls(
+            id or uuid4(), timestamp or datetime.now(timezone.utc), raw,
+            indexed=indexed,
+        )
+
+    @property
+    def data(self) -> JSONValue:
+        """Returns the decoded JSON data, decoding it on first access."""
+        if self.raw is not None:
+            self._data = orjson.loads(self.raw)
+            self.raw = None
+        return self._data
+
+    @property
+    def index(self) -> t.Optional[t.Dict[t.Tuple[str, ...], JSONValue]]:
+        """Returns the flattened field index if the message is indexed."""
+        if self.indexed and self._index is None:
+            self._index = flatten(self.data)
+        return self._index
+
+    def with_index(self) -> 'RawMessage':
+        """Enables the lazily built flattened field index on the message.
+
+        Returns
+        -------
+        RawMessage
+            The same raw message instance.
+        """
+        self.indexed = True
+        return self
+
+    @property
+    def is_decoded(self) -> bool:
+        """Returns if the raw JSON document has been decoded yet."""
+        return self.raw is None
+
+    def decode(self) -> Message:
+        """Converts the raw message into a decoded message.
+
+        Returns
+        -------
+        Message
+            Message containing the decoded data.
+        """
+        return Message(self.id, self.timestamp, self.data, self.index)
+
+    def __repr__(self) -> str:
+        return (
+            f"RawMessage(id={self.id!r}, timestamp={self.timestamp!r}, "
+            f"decoded={self.is_decoded})"
+        )
+
+
+def _lookup(
+    data: JSONValue,
+    index: t.Dict[t.Tuple[str, ...], JSONValue],
+    item: t.Sequence[str],
+) -> JSONValue:
+    """Retrieves a field value through a flattened field index."""
+    item = normalize(item)
+    if not item:
+        return data
+    try:
+        return index[item]
+    except KeyError:
+        raise KeyError(item) from None
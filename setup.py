@@ -29,6 +29,9 @@ setup(
         'psycopg2==2.8.*',
         'SQLAlchemy==1.3.*',
     ],
+    extras_require={
+        'arrow': ['pyarrow>=3.0'],
+    },
     python_requires='>=3.6',
     entry_points={
         'console_scripts': [
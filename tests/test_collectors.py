@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+
+from scrywarden.profile.collectors import AdaptiveTimeRangeCollector
+
+
+class TestAdaptiveTimeRangeCollector:
+    def test_initial_window(self):
+        """Windows should use the configured seconds before observing."""
+        collector = AdaptiveTimeRangeCollector(seconds=30.)
+        assert collector._window_seconds(datetime.now(timezone.utc)) == 30.
+
+    def test_density(self):
+        """Windows should be sized to contain the targeted events."""
+        collector = AdaptiveTimeRangeCollector(
+            target_events=1000, smoothing=1., min_seconds=1.,
+        )
+        now = datetime.now(timezone.utc)
+        collector.observe(timedelta(seconds=60), 6000, 6000)
+        assert collector._window_seconds(now) == 10.
+        collector.observe(timedelta(seconds=60), 6, 6)
+        assert collector._window_seconds(now) == collector.max_seconds
+
+    def test_memory(self):
+        """Memory budget should lower the targeted events."""
+        collector = AdaptiveTimeRangeCollector(
+            target_events=1000, memory=10000, min_seconds=0.,
+        )
+        collector.observe(timedelta(seconds=10), 1000, 100000)
+        assert collector._window_seconds(datetime.now(timezone.utc)) == 1.
+
+    def test_catch_up(self):
+        """Windows should widen when far behind the current time."""
+        collector = AdaptiveTimeRangeCollector(
+            target_events=1000, catch_up=600., catch_up_factor=3.,
+        )
+        now = datetime.now(timezone.utc)
+        collector.observe(timedelta(seconds=10), 1000, 1000)
+        assert collector._window_seconds(now) == 10.
+        assert collector._window_seconds(now - timedelta(hours=1)) == 30.
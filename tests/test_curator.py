@@ -0,0 +1,40 @@
+import pandas as pa
+import pytest
+
+from scrywarden.curator.base import freeze
+
+
+class TestFreeze:
+    def test_read_only(self):
+        """Frozen dataframes should refuse writes into their data."""
+        frame = freeze(pa.DataFrame({
+            'event_id': [1, 2],
+            'score': [.5, 1.],
+            'created_at': pa.to_datetime(
+                ['2020-01-01', '2020-01-02'], utc=True,
+            ),
+        }))
+        with pytest.raises(ValueError):
+            frame['score'].values[0] = 0.
+        with pytest.raises(ValueError):
+            frame.iloc[0, 0] = 5
+        assert [*frame['event_id']] == [1, 2]
+
+    def test_shared(self):
+        """Copies of frozen dataframes should be free to assign columns."""
+        frame = freeze(pa.DataFrame({'event_id': [1, 2], 'score': [.5, 1.]}))
+        first, second = frame.copy(), frame.copy()
+        first['flagged'] = first['score'] > .7
+        second['score'] = second['score'] * 2
+        assert 'flagged' not in second
+        assert 'flagged' not in frame
+        assert [*frame['score']] == [.5, 1.]
+        assert [*first['score']] == [.5, 1.]
+        assert [*second['score']] == [1., 2.]
+
+    def test_assign(self):
+        """Assign should add columns without writing into frozen data."""
+        frame = freeze(pa.DataFrame({'event_id': [1, 2], 'score': [.5, 1.]}))
+        assigned = frame.copy(deep=False).assign(score=lambda f: f.score * 2)
+        assert [*frame['score']] == [.5, 1.]
+        assert [*assigned['score']] == [1., 2.]
@@ -0,0 +1,9 @@
+from scrywarden.database import hash_value
+
+
+def test_hash_value():
+    """Values should hash to the signed prefix of their MD5 digest."""
+    # md5('') starts with d41d8cd98f00b204, as hashed by PostgreSQL.
+    assert hash_value('') == int('d41d8cd98f00b204', 16) - 2 ** 64
+    assert hash_value('a' * 10000) == hash_value('a' * 10000)
+    assert -2 ** 63 <= hash_value('https://example.com') < 2 ** 63
@@ -0,0 +1,93 @@
+from scrywarden import database as db
+from scrywarden.profile import Profile, fields
+from scrywarden.profile.base import FieldMapping, ProfileField
+from scrywarden.profile.extraction import ExtractionPlan
+from scrywarden.transport.message import Message
+
+
+class Login(Profile):
+    REQUIRES = ('user',)
+    ACTOR = 'user'
+
+    src_ip = fields.Single()
+    location = fields.Multi([('geo', 'country'), ('geo', 'city')])
+    agent = fields.Single(key='agent')
+
+
+class Custom(Profile):
+    REQUIRES = ('user',)
+
+    src_ip = fields.Single()
+
+    def get_actor(self, message: Message) -> str:
+        return message['user'].upper()
+
+
+class Lower(fields.Single):
+    def get_value(self, message: Message) -> str:
+        return super().get_value(message).lower()
+
+
+class Lowered(Profile):
+    REQUIRES = ('user',)
+    ACTOR = 'user'
+
+    user = Lower()
+
+
+def sync(profile: Profile) -> Profile:
+    """Attaches unsaved database models to the profile fields."""
+    profile.fields = FieldMapping({
+        name: ProfileField(
+            field.instance, model=db.Field(id=index, name=name),
+        )
+        for index, (name, field) in enumerate(profile.fields.items(), 1)
+    })
+    return profile
+
+
+MESSAGES = [
+    Message.create({
+        'user': 'bob', 'src_ip': '10.0.0.1',
+        'geo': {'country': 'US', 'city': None},
+        'agent': {'name': 'curl', 'version': [7, 1]},
+    }),
+    Message.create({'user': 'alice', 'src_ip': 'café "\\n"'}),
+    Message.create({'user': 5, 'src_ip': '10.0.0.2'}),
+]
+
+
+class TestExtractionPlan:
+    def test_keys(self):
+        """Plan should contain the union of field and actor keys."""
+        plan = ExtractionPlan([Login(), Custom()])
+        assert plan.keys == {
+            ('user',), ('src_ip',), ('geo', 'country'), ('geo', 'city'),
+            ('agent',),
+        }
+
+    def test_matches_unplanned_rows(self):
+        """Planned rows should be identical to rows built per message."""
+        profiles = [sync(Login()), sync(Custom())]
+        batch = ExtractionPlan(profiles).batch(MESSAGES)
+        for profile in profiles:
+            expected = [*profile._generate_rows(MESSAGES)]
+            assert expected
+            assert [*profile._generate_rows(MESSAGES, batch=batch)] == (
+                expected
+            )
+
+    def test_shared_columns(self):
+        """Serialized values should be cached in the batch columns."""
+        batch = ExtractionPlan([Login()]).batch(MESSAGES)
+        assert batch.serialized(MESSAGES[0], ('src_ip',)) == '"10.0.0.1"'
+        assert batch._serialized[('src_ip',)][0] == '"10.0.0.1"'
+
+    def test_overridden_value(self):
+        """Fields overriding `get_value` should not be read from the batch."""
+        profile = sync(Lowered())
+        messages = [Message.create({'user': 'BOB'})]
+        batch = ExtractionPlan([profile]).batch(messages)
+        rows = [*profile._generate_rows(messages, batch=batch)]
+        assert rows == [*profile._generate_rows(messages)]
+        assert '"bob"' in rows[0]
@@ -0,0 +1,78 @@
+import threading
+import types
+from queue import Queue
+
+import pandas as pa
+
+from scrywarden.investigator import Investigator
+from scrywarden.profile.analyzers import Analyzer
+from scrywarden.profile.collectors import Collector
+
+
+class PageCollector(Collector):
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+
+    def collect_pages(self, profile, investigation, previous=None):
+        yield from self.pages[investigation.index]
+
+
+class PassAnalyzer(Analyzer):
+    def analyze(self, anomalies):
+        return anomalies
+
+
+class FakeInvestigator(Investigator):
+    def __init__(self, count, **kwargs):
+        super().__init__(**kwargs)
+        self.count = count
+        self.created = 0
+
+    def _create_investigation(self):
+        if self.created == self.count:
+            self.shutdown.wait()
+            return None
+        self.created += 1
+        return types.SimpleNamespace(index=self.created), None
+
+    def _assign(self, investigation, anomalies):
+        pass
+
+    def _mark_assigned(self, investigation):
+        investigation.is_assigned = True
+
+    def _complete(self, investigation, results):
+        if not results:
+            return None
+        return investigation, pa.concat(results, ignore_index=True)
+
+
+class TestPrefetch:
+    def test_order(self):
+        """Prefetched investigations should be analyzed in order."""
+        pages = {
+            1: [pa.DataFrame({'event_id': [1, 2]}), pa.DataFrame(),
+                pa.DataFrame({'event_id': [3]})],
+            2: [],
+            3: [pa.DataFrame({'event_id': [4]})],
+        }
+        investigator = FakeInvestigator(
+            3, collector=PageCollector(pages), analyzer=PassAnalyzer(),
+            shutdown=threading.Event(), prefetch=1, queue=Queue(),
+        )
+        investigator._prefetched = Queue(investigator.prefetch)
+        investigator._prefetcher = threading.Thread(
+            target=investigator._prefetch,
+        )
+        investigator._prefetcher.start()
+        try:
+            first, anomalies = investigator._investigate_prefetched()
+            assert first.index == 1 and first.is_assigned
+            assert [*anomalies['event_id']] == [1, 2, 3]
+            second, anomalies = investigator._investigate_prefetched()
+            assert second.index == 3
+            assert [*anomalies['event_id']] == [4]
+        finally:
+            investigator.shutdown.set()
+            investigator._prefetcher.join()
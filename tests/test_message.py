@@ -1,6 +1,8 @@
 import pytest
 
-from scrywarden.transport.message import keys, get
+from scrywarden.transport.message import (
+    keys, get, flatten, Message, RawMessage,
+)
 
 
 class TestGetFields:
@@ -67,3 +69,76 @@ class TestGetValue:
             'integer': 5,
         }
         assert get(data, ('nested', 'value')) == 'here'
+
+
+class TestRawMessage:
+    def test_lazy_decode(self):
+        """Raw message should only decode when the data is accessed."""
+        message = RawMessage.create(b'{"person": "Bob", "greeting": "Hi"}')
+        assert not message.is_decoded
+        assert message.get('greeting') == 'Hi'
+        assert message.is_decoded
+        assert message.raw is None
+
+    def test_lookup(self):
+        """Raw message should support the same lookups as messages."""
+        message = RawMessage.create('{"nested": {"value": [1, 2]}}')
+        assert ('nested', 'value', '1') in message
+        assert 'missing' not in message
+        assert message['nested', 'value', '0'] == 1
+        assert message.get('missing', 5) == 5
+        assert len(message) == 4
+
+    def test_decode(self):
+        """Decoding should keep the message ID and timestamp."""
+        raw = RawMessage.create(b'{"greeting": "Hi"}')
+        message = raw.decode()
+        assert isinstance(message, Message)
+        assert message.id == raw.id
+        assert message.timestamp == raw.timestamp
+        assert message.data == {'greeting': 'Hi'}
+
+
+class TestFlatten:
+    def test_matches_keys(self):
+        """Flattened index should contain every key in iteration order."""
+        data = {'nested': {'value': 'here'}, 'array': [6, {'surprise': 1}]}
+        assert [*flatten(data)] == [*keys(data)]
+
+    def test_values(self):
+        """Flattened index should map keys to their nested values."""
+        data = {'nested': {'value': 'here'}, 'array': [6]}
+        index = flatten(data)
+        assert index[('nested', 'value')] == 'here'
+        assert index[('array', '0')] == 6
+        assert index[('nested',)] == {'value': 'here'}
+
+
+class TestIndexedMessage:
+    def test_lookup(self):
+        """Indexed messages should behave the same as unindexed ones."""
+        data = {'person': 'Bob', 'nested': {'value': [1, 2]}}
+        plain = Message.create(data)
+        indexed = plain.with_index()
+        assert indexed.index is not None
+        for message in (plain, indexed):
+            assert 'person' in message
+            assert ['nested', 'value', '1'] in message
+            assert ('missing',) not in message
+            assert message['nested', 'value', '0'] == 1
+            assert message.get('missing') is None
+            assert len(message) == 5
+        assert [*plain] == [*indexed]
+
+    def test_missing_key(self):
+        """Indexed lookups should raise KeyError for missing fields."""
+        message = Message.create({'person': 'Bob'}, indexed=True)
+        with pytest.raises(KeyError):
+            _ = message['greeting']
+
+    def test_raw_message_index(self):
+        """Raw messages should build the index lazily on first lookup."""
+        message = RawMessage.create(b'{"person": "Bob"}', indexed=True)
+        assert message._index is None
+        assert message['person'] == 'Bob'
+        assert message._index == {('person',): 'Bob'}
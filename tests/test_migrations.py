@@ -0,0 +1,25 @@
+import sqlalchemy as sa
+
+from scrywarden import database as db
+from scrywarden.migrations import MIGRATIONS, SchemaVersion, migrate
+
+
+def test_versions():
+    """Migrations should be numbered in the order they are applied."""
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == [*range(1, len(MIGRATIONS) + 1)]
+
+
+def test_migrate(tmp_path):
+    """Migrating should record every version once and be idempotent."""
+    engine = db.create_sqlite_engine(str(tmp_path / 'scrywarden.db'))
+    migrate(engine)
+    migrate(engine)
+    with engine.connect() as connection:
+        rows = connection.execute(sa.select([
+            SchemaVersion.c.version, SchemaVersion.c.description,
+        ]).order_by(SchemaVersion.c.version)).fetchall()
+    assert [tuple(row) for row in rows] == [
+        (migration.version, migration.description)
+        for migration in MIGRATIONS
+    ]
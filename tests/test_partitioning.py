@@ -0,0 +1,108 @@
+import types
+from datetime import datetime, timedelta, timezone
+
+from scrywarden.partitioning import TABLES, Partitioning
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class TestPartitioning:
+    def test_period(self):
+        """Periods should cover the interval containing the timestamp."""
+        timestamp = utc(2021, 3, 17, 15, 30)
+        assert Partitioning('day').period(timestamp) == (
+            utc(2021, 3, 17), utc(2021, 3, 18),
+        )
+        assert Partitioning('week').period(timestamp) == (
+            utc(2021, 3, 15), utc(2021, 3, 22),
+        )
+        assert Partitioning('month').period(utc(2021, 12, 31)) == (
+            utc(2021, 12, 1), utc(2022, 1, 1),
+        )
+
+    def test_partition_name(self):
+        """Partition names should round trip to their start."""
+        partitioning = Partitioning('month')
+        name = partitioning.partition_name('event', utc(2021, 3, 1))
+        assert name == 'event_p202103'
+        assert partitioning.partition_start('event', name) == utc(2021, 3, 1)
+        assert partitioning.partition_start('event', 'event_old') is None
+        assert partitioning.partition_start('anomaly', name) is None
+
+    def test_expired(self):
+        """Partitions should only expire once past the retention."""
+        partitioning = Partitioning('day', retention=2)
+        starts = [utc(2021, 3, day) for day in range(1, 6)]
+        now = utc(2021, 3, 5, 12)
+        assert partitioning.expired(starts, now) == {
+            utc(2021, 3, 1), utc(2021, 3, 2),
+        }
+        assert Partitioning('day').expired(starts, now) == set()
+
+
+class FakePartitioning(Partitioning):
+    """Partitioning of a fake catalog that records the executed DDL."""
+
+    def __init__(self, starts, **kwargs):
+        super().__init__(**kwargs)
+        self.starts = set(starts)
+        self.statements = []
+
+    def is_partitioned(self, connection):
+        return True
+
+    def _lock_partitions(self, connection):
+        pass
+
+    def _get_partitions(self, connection):
+        return {table: set(self.starts) for table in TABLES}
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+
+
+def ddl(partitioning, action):
+    return sorted({
+        statement.split('"')[1].rsplit('_p', 1)[1]
+        for statement in partitioning.statements if action in statement
+    })
+
+
+class TestMaintenance:
+    def test_maintain(self):
+        """Upcoming partitions should be created and expired ones dropped."""
+        partitioning = FakePartitioning(
+            [utc(2021, 3, day) for day in (1, 2, 5)], premake=2, retention=2,
+        )
+        connection = types.SimpleNamespace(execute=partitioning.execute)
+        partitioning.maintain(connection, now=utc(2021, 3, 5, 12))
+        assert ddl(partitioning, 'CREATE') == ['20210306', '20210307']
+        assert ddl(partitioning, 'DROP') == ['20210301', '20210302']
+        assert partitioning._partitions == {
+            utc(2021, 3, day) for day in (5, 6, 7)
+        }
+
+    def test_ensure(self):
+        """Only partitions missing from the catalog should be created."""
+        now = datetime.now(timezone.utc)
+        partitioning = FakePartitioning([], retention=2)
+        connection = types.SimpleNamespace(execute=partitioning.execute)
+        partitioning._partitions = {partitioning.period(now)[0]}
+        partitioning.ensure(connection, [now])
+        assert partitioning.statements == []
+        old = partitioning.period(now - timedelta(days=5))[0]
+        partitioning.ensure(connection, [old + timedelta(hours=1)])
+        assert len(partitioning.statements) == len(TABLES)
+        assert old in partitioning._partitions
+
+    def test_ensure_dropped(self):
+        """Expired partitions dropped elsewhere should be checked again."""
+        now = datetime.now(timezone.utc)
+        old = Partitioning().period(now - timedelta(days=5))[0]
+        partitioning = FakePartitioning([], retention=2)
+        connection = types.SimpleNamespace(execute=partitioning.execute)
+        partitioning._partitions = {old}
+        partitioning.ensure(connection, [old])
+        assert len(partitioning.statements) == len(TABLES)
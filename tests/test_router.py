@@ -0,0 +1,68 @@
+from scrywarden.pipline.router import Router
+from scrywarden.profile import Profile, Route, fields
+from scrywarden.transport.message import Message
+
+
+class Greetings(Profile):
+    REQUIRES = ('person',)
+    ROUTE = Route('type', frozenset({'greeting'}))
+
+    greeting = fields.Single()
+
+
+class Farewells(Profile):
+    REQUIRES = ('person',)
+    ROUTE = Route('type', frozenset({'farewell', 'goodbye'}))
+
+    farewell = fields.Single()
+
+
+class Everything(Profile):
+    REQUIRES = ('person',)
+
+    person = fields.Single()
+
+
+class TestRouter:
+    def setup_method(self):
+        self.greetings = Greetings(name='greetings')
+        self.farewells = Farewells(name='farewells')
+        self.everything = Everything(name='everything')
+        self.router = Router([self.greetings, self.farewells, self.everything])
+
+    def test_route_values(self):
+        """Messages should only be routed to profiles with their value."""
+        message = Message.create({'type': 'goodbye', 'person': 'Bob'})
+        assert self.router.candidates(message) == [
+            self.everything, self.farewells,
+        ]
+
+    def test_requires(self):
+        """Messages missing required fields should not be routed."""
+        message = Message.create({'type': 'greeting'})
+        assert self.router.candidates(message) == []
+
+    def test_unhashable_value(self):
+        """Unhashable route values should not match any routes."""
+        message = Message.create({'type': ['greeting'], 'person': 'Bob'})
+        assert self.router.candidates(message) == [self.everything]
+
+    def test_dispatch(self):
+        """Dispatch should group messages by every profile."""
+        hello = Message.create({'type': 'greeting', 'person': 'Bob'})
+        other = Message.create({'type': 'other', 'person': 'Bob'})
+        routed = self.router.dispatch([hello, other])
+        assert routed == {
+            self.greetings: [hello],
+            self.farewells: [],
+            self.everything: [hello, other],
+        }
+
+    def test_matches(self):
+        """Default matches should check the routing declarations."""
+        assert self.greetings.matches(
+            Message.create({'type': 'greeting', 'person': 'Bob'}),
+        )
+        assert not self.greetings.matches(
+            Message.create({'type': 'farewell', 'person': 'Bob'}),
+        )
@@ -0,0 +1,52 @@
+import threading
+
+from scrywarden.investigator import Investigator, InvestigationScheduler
+
+
+class FakeInvestigator(Investigator):
+    def __init__(self, name, backlog, steps, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self._backlog = backlog
+        self._steps = steps
+        self.stepped = 0
+        self.is_setup = False
+        self.is_torn_down = False
+
+    @property
+    def backlog(self):
+        return self._backlog
+
+    def setup(self):
+        self.is_setup = True
+
+    def step(self):
+        self.stepped += 1
+        self._steps.append(self.name)
+        if len(self._steps) >= 6:
+            self.shutdown.set()
+        return self.name == 'busy'
+
+    def teardown(self):
+        self.is_torn_down = True
+
+
+class TestInvestigationScheduler:
+    def test_schedule(self):
+        """Busy investigators should be stepped again before idle ones."""
+        steps = []
+        busy = FakeInvestigator('busy', 10.0, steps)
+        idle = FakeInvestigator('idle', 100.0, steps)
+        scheduler = InvestigationScheduler(
+            [busy, idle], workers=1, interval=60.0,
+            shutdown=threading.Event(),
+        )
+        scheduler.start()
+        scheduler.join(5)
+        assert not scheduler.is_alive()
+        # The idle investigator is furthest behind so it goes first, then
+        # waits out the interval while the busy one keeps going.
+        assert steps == ['idle', 'busy', 'busy', 'busy', 'busy', 'busy']
+        for investigator in (busy, idle):
+            assert investigator.is_setup and investigator.is_torn_down
+            assert not investigator.block
@@ -0,0 +1,44 @@
+import orjson
+import pytest
+
+from scrywarden.profile.extraction import serialize, Serializer
+
+VALUES = [
+    '', 'hello', 'café ☕', 'quote "here"', 'back\\slash', 'new\nline',
+    'tab\t', '\x00\x1f\x7f', ' ', '/path', 0, -1, 42, 2 ** 63 - 1,
+    -2 ** 63, 2 ** 64 - 1, True, False, None, 1.5, 1e16, 0.0, -0.0,
+    [1, 'two', None], {'b': 1, 'a': [True, {'d': 'x', 'c': 'y'}]},
+]
+
+
+def canonical(value) -> str:
+    return str(orjson.dumps(value, option=orjson.OPT_SORT_KEYS), 'utf-8')
+
+
+class TestSerialize:
+    @pytest.mark.parametrize('value', VALUES)
+    def test_canonical(self, value):
+        """Serialized values should be identical to orjson canonical form."""
+        assert serialize(value) == canonical(value)
+
+    @pytest.mark.parametrize('value', [2 ** 64, '\ud800', object()])
+    def test_invalid(self, value):
+        """Values orjson cannot serialize should raise ValueError."""
+        with pytest.raises(ValueError):
+            serialize(value)
+
+
+class TestSerializer:
+    def test_canonical(self):
+        """Memoized values should be identical to orjson canonical form."""
+        serializer = Serializer()
+        for _ in range(2):
+            for value in VALUES:
+                assert serializer(value) == canonical(value)
+
+    def test_types_not_confused(self):
+        """Equal values of different types should not share cache entries."""
+        serializer = Serializer()
+        assert serializer(1) == '1'
+        assert serializer(True) == 'true'
+        assert serializer(1.0) == '1.0'
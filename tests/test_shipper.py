@@ -0,0 +1,248 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import time
+import types
+import uuid
+
+import orjson
+import pandas as pa
+import pytest
+
+from scrywarden.curator.entry import CuratorEntry
+from scrywarden.shipper import BufferedShipper
+from scrywarden.shipper.csv import CSVShipper
+from scrywarden.shipper.ndjson import NDJSONShipper, to_ndjson
+from scrywarden.shipper.webhook import WebhookShipper
+
+
+class ListShipper(BufferedShipper):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def ship_batch(self, batch):
+        self.batches.append([investigation for investigation, _ in batch])
+
+
+class FailingShipper(ListShipper):
+    def __init__(self, failures=1, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def ship_batch(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("Shipping failed")
+        super().ship_batch(batch)
+
+
+def run(shipper, entries, wait=0.0):
+    shipper.shutdown = threading.Event()
+    shipper.start()
+    while shipper.queue is None:
+        time.sleep(.01)
+    for investigation, anomalies in entries:
+        shipper.queue.put(CuratorEntry.malicious_activity(
+            investigation, anomalies,
+        ))
+    time.sleep(wait)
+    shipper.shutdown.set()
+    shipper.queue.put(CuratorEntry.blip('Shutdown'))
+    shipper.join(5)
+
+
+def frame(*event_ids):
+    return pa.DataFrame({'event_id': event_ids})
+
+
+class TestBufferedShipper:
+    def test_thresholds(self):
+        """Batches should flush on count, size and shutdown."""
+        shipper = ListShipper(batch_count=2, batch_size=3, flush_interval=0)
+        run(shipper, [(1, frame(1)), (2, frame(2)), (3, frame(3, 4, 5)),
+                      (4, frame(6))])
+        assert shipper.batches == [[1, 2], [3], [4]]
+
+    def test_interval(self):
+        """Batches should flush once the flush interval passes."""
+        shipper = ListShipper(flush_interval=.05)
+        run(shipper, [(1, frame(1)), (2, frame(2))], wait=.5)
+        assert shipper.batches == [[1, 2]]
+        assert not shipper._batch
+
+    def test_failure(self):
+        """Findings should stay buffered when shipping a batch fails."""
+        shipper = FailingShipper(batch_count=2, flush_interval=0)
+        run(shipper, [(1, frame(1)), (2, frame(2)), (3, frame(3))])
+        assert shipper.batches == [[1, 2, 3]]
+
+    def test_drop(self):
+        """Batches should be dropped after failing max_attempts times."""
+        shipper = FailingShipper(
+            failures=2, batch_count=1, flush_interval=0, max_attempts=2,
+        )
+        run(shipper, [(1, frame(1)), (2, frame(2)), (3, frame(3))])
+        assert shipper.batches == [[3]]
+        assert not shipper._batch
+
+
+class TestCSVShipper:
+    def test_append(self, tmp_path):
+        """CSV shipper should write the header once across batches."""
+        filename = tmp_path / 'alerts.csv'
+        run(CSVShipper(filename=str(filename), batch_count=1), [
+            (1, frame(1, 2)), (2, frame(3)),
+        ])
+        run(CSVShipper(filename=str(filename)), [(3, frame(4))])
+        assert pa.read_csv(filename)['event_id'].tolist() == [1, 2, 3, 4]
+
+
+class TestArrowShipper:
+    def test_partitions(self, tmp_path):
+        """Anomalies should be written to profile and hour partitions."""
+        pyarrow = pytest.importorskip('pyarrow')
+        import pyarrow.dataset
+        from scrywarden.shipper.arrow import ArrowShipper
+
+        def investigation(name):
+            profile = types.SimpleNamespace(name=name)
+            return types.SimpleNamespace(
+                group=types.SimpleNamespace(profile=profile),
+            )
+
+        def anomalies(*times):
+            return pa.DataFrame({
+                'event_id': range(len(times)),
+                'message_id': [uuid.uuid4() for _ in times],
+                'created_at': pa.to_datetime(times, utc=True),
+                'score': [1.] * len(times),
+            })
+
+        for format in ('parquet', 'arrow'):
+            directory = tmp_path / format
+            run(ArrowShipper(directory=str(directory), format=format), [
+                (investigation('web'), anomalies(
+                    '2020-01-01 10:15', '2020-01-01 11:05',
+                )),
+                (investigation('ssh'), anomalies('2020-01-01 10:30')),
+            ])
+            files = sorted(
+                path.relative_to(directory).parent.as_posix()
+                for path in directory.rglob('*') if path.is_file()
+            )
+            assert files == [
+                'profile=ssh/hour=2020-01-01T10',
+                'profile=web/hour=2020-01-01T10',
+                'profile=web/hour=2020-01-01T11',
+            ]
+            dataset = pyarrow.dataset.dataset(
+                str(directory), format='parquet' if format == 'parquet'
+                else 'ipc', partitioning='hive',
+            )
+            assert dataset.to_table().num_rows == 3
+
+
+class TestNDJSON:
+    def test_to_ndjson(self):
+        """Frames should serialize to one JSON object per line."""
+        message_id = uuid.uuid4()
+        data = to_ndjson(pa.DataFrame({
+            'event_id': [1, 2],
+            'message_id': [message_id, message_id],
+            'created_at': pa.to_datetime(['2020-01-01 10:00', None], utc=True),
+            'score': [.5, float('nan')],
+        }))
+        assert data.endswith(b'\n')
+        assert [orjson.loads(line) for line in data.splitlines()] == [
+            {
+                'event_id': 1, 'message_id': str(message_id),
+                'created_at': '2020-01-01T10:00:00+00:00', 'score': .5,
+            },
+            {
+                'event_id': 2, 'message_id': str(message_id),
+                'created_at': None, 'score': None,
+            },
+        ]
+
+    def test_shipper(self, tmp_path):
+        """NDJSON shipper should append every investigation to the file."""
+        filename = tmp_path / 'alerts.ndjson'
+        investigation = types.SimpleNamespace(id=7)
+        run(NDJSONShipper(filename=str(filename)), [
+            (investigation, frame(1, 2)), (investigation, frame(3)),
+        ])
+        lines = filename.read_bytes().splitlines()
+        assert [orjson.loads(line) for line in lines] == [
+            {'event_id': 1, 'investigation_id': 7},
+            {'event_id': 2, 'investigation_id': 7},
+            {'event_id': 3, 'investigation_id': 7},
+        ]
+
+
+def serve(requests, statuses):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            requests.append((self.client_address, body))
+            status = statuses.pop() if statuses else 200
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+
+def post(server, entries, wait=0.0, **kwargs):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        run(WebhookShipper(
+            url=f'http://127.0.0.1:{server.server_port}/alerts', **kwargs,
+        ), entries, wait)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+class TestWebhookShipper:
+    def test_post(self):
+        """Batches should be retried and reuse keep-alive connections."""
+        requests = []
+        investigation = types.SimpleNamespace(id=7)
+        post(serve(requests, [503]), [
+            (investigation, frame(1, 2)), (investigation, frame(3)),
+        ], wait=1.0, batch_count=1, concurrency=1)
+        bodies = [body for _, body in requests]
+        assert bodies[0] == bodies[1]
+        assert [
+            orjson.loads(line)['event_id']
+            for body in bodies[1:] for line in body.splitlines()
+        ] == [1, 2, 3]
+        assert len({address for address, _ in requests}) == 1
+
+    def test_shutdown(self):
+        """Findings flushed on shutdown should still be retried."""
+        requests = []
+        investigation = types.SimpleNamespace(id=7)
+        post(serve(requests, [503, 503]), [
+            (investigation, frame(1)),
+        ], concurrency=1)
+        assert len(requests) == 3
+        assert orjson.loads(requests[-1][1])['event_id'] == 1
+
+    def test_close_timeout(self):
+        """Retries after shutdown should stop at the close timeout."""
+        requests = []
+        investigation = types.SimpleNamespace(id=7)
+        start = time.monotonic()
+        post(serve(requests, [503] * 100), [
+            (investigation, frame(1)),
+        ], concurrency=1, retries=100, close_timeout=1.0)
+        assert time.monotonic() - start < 5
+        assert 1 < len(requests) < 100
@@ -0,0 +1,677 @@
+import pickle
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from queue import Queue
+
+import pandas as pa
+import pytest
+
+from scrywarden import database as db
+from scrywarden.config import Config
+from scrywarden.investigator import Investigator
+from scrywarden.investigator.base import HEARTBEAT_TIMEOUT, PrefetchedPage
+from scrywarden.migrations import migrate
+from scrywarden.pipline.base import Pipeline
+from scrywarden.profile.analyzers import Analyzer
+from scrywarden.profile.base import sync_profiles
+from scrywarden.profile.collectors import Collector, TimeRangeCollector
+from scrywarden.profile.example import ExampleProfile
+from scrywarden.storage import get_storage
+from scrywarden.transport.message import Message
+
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+class PassAnalyzer(Analyzer):
+    def analyze(self, anomalies):
+        return anomalies
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = db.create_sqlite_engine(str(tmp_path / 'scrywarden.db'))
+    migrate(engine)
+    return db.create_session_factory(engine)
+
+
+def greet(person, greeting, seconds):
+    return Message.create(
+        {'person': person, 'greeting': greeting},
+        timestamp=START + timedelta(seconds=seconds),
+    )
+
+
+GREETINGS = [
+    [greet('bob', 'hi', 0), greet('bob', 'hi', 1), greet('bob', 'yo', 2)],
+    [greet('bob', 'hi', 10), greet('bob', 'hey', 11)],
+]
+
+
+def process(factory, batches=GREETINGS, **kwargs):
+    profile = ExampleProfile(name='example')
+    pipeline = Pipeline([], [profile], factory, **kwargs)
+    with db.managed_session(factory, expire_on_commit=False) as session:
+        sync_profiles(session, [profile])
+    pipeline._profiles_by_id = {profile.model.id: profile}
+    for messages in batches:
+        pipeline._messages = list(messages)
+        pipeline._process()
+    return profile
+
+
+def analyze_windows(factory, profile, collector, **kwargs):
+    """Runs an investigator until it runs out of windows.
+
+    Returns the IDs of the analyzed events of every investigation.
+    """
+    queue = Queue()
+    investigator = Investigator(
+        profile=profile, collector=collector, analyzer=PassAnalyzer(),
+        session_factory=factory, queue=queue, shutdown=threading.Event(),
+        block=False, **kwargs,
+    )
+    investigator.setup()
+    try:
+        while investigator.step():
+            pass
+    finally:
+        investigator.teardown()
+    analyzed = []
+    while not queue.empty():
+        _, _, (_, anomalies) = queue.get_nowait()
+        analyzed.append(sorted(anomalies['event_id'].unique()))
+    return analyzed
+
+
+@pytest.fixture
+def profile(factory):
+    return process(factory)
+
+
+class TestSQLite:
+    def test_pipeline(self, factory, profile):
+        """Features should be counted and events created on SQLite."""
+        with db.managed_session(factory) as session:
+            features = session.query(db.Feature.value, db.Feature.count)
+            assert dict(features.all()) == {'"hi"': 3, '"yo"': 1, '"hey"': 1}
+            events = session.query(db.Event).order_by(
+                db.Event.created_at,
+            ).all()
+            assert [event.created_at for event in events] == [
+                START, START + timedelta(seconds=2),
+                START + timedelta(seconds=11),
+            ]
+            assert {event.profile_id for event in events} == {
+                profile.model.id,
+            }
+
+    def test_investigate(self, factory, profile):
+        """Investigators should assign every event once on SQLite."""
+        queue = Queue()
+        investigator = Investigator(
+            profile=profile, collector=TimeRangeCollector(
+                seconds=10, delay=0, page_size=2,
+            ), analyzer=PassAnalyzer(), session_factory=factory,
+            queue=queue, shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            while investigator.step():
+                pass
+        finally:
+            investigator.teardown()
+        with db.managed_session(factory) as session:
+            assigned = session.query(db.InvestigationEvent.c.event_id)
+            assert sorted(row.event_id for row in assigned) == [1, 2, 3]
+        assert queue.qsize() == 2
+
+    def test_pages(self, factory):
+        """Pages should split events created at the same time by ID."""
+        profile = process(factory, [
+            [greet('bob', f'hi{index}', 0) for index in range(5)],
+        ])
+        collector = TimeRangeCollector(
+            seconds=10, delay=0, page_size=2, session_factory=factory,
+            shutdown=threading.Event(), block=False,
+        )
+        pages = collector.collect_pages(profile, db.Investigation())
+        assert [list(page['event_id'].unique()) for page in pages] == [
+            [1, 2], [3, 4], [5],
+        ]
+        assert analyze_windows(factory, profile, collector) == [
+            [1, 2, 3, 4, 5],
+        ]
+
+    def test_resume(self, factory):
+        """Restarted investigators should resume after the watermark."""
+        first, second = GREETINGS
+        profile = process(factory, [first])
+        collector = TimeRangeCollector(seconds=5, delay=0)
+        assert analyze_windows(factory, profile, collector) == [[1, 2]]
+        profile = process(factory, [second])
+        collector = TimeRangeCollector(
+            seconds=5, delay=0, session_factory=factory,
+        )
+        assert analyze_windows(factory, profile, collector) == [[3]]
+        with db.managed_session(factory) as session:
+            previous = session.query(db.Investigation).order_by(
+                db.Investigation.id.desc(),
+            ).first()
+            assert previous.last_event_id == 3
+            assert collector._get_previous_end(previous) == START + timedelta(
+                seconds=11,
+            )
+            previous.last_event_id = None
+            assert collector._get_previous_end(previous) == (
+                previous.window_end
+            )
+
+    def test_unfinished_pages(self, factory):
+        """Claimed investigations should be analyzed in pages."""
+        profile = process(factory, [
+            [greet('bob', f'hi{index}', 0) for index in range(5)],
+        ])
+        collector = TimeRangeCollector(seconds=10, delay=0)
+        assert analyze_windows(factory, profile, collector) == [
+            [1, 2, 3, 4, 5],
+        ]
+        with db.managed_session(factory) as session:
+            investigation = session.query(db.Investigation).one()
+            investigation.completed_at = None
+            investigation.created_by = None
+        pages = []
+
+        class PageAnalyzer(Analyzer):
+            def analyze(self, anomalies):
+                pages.append(list(anomalies['event_id'].unique()))
+                return anomalies
+
+        investigator = Investigator(
+            profile=profile, collector=TimeRangeCollector(
+                seconds=10, delay=0, page_size=2,
+            ), analyzer=PageAnalyzer(), session_factory=factory,
+            queue=Queue(), shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            assert investigator.step()
+        finally:
+            investigator.teardown()
+        assert pages == [[1, 2], [3, 4], [5]]
+        with db.managed_session(factory) as session:
+            investigation = session.query(db.Investigation).one()
+            assert investigation.completed_at is not None
+
+    def test_prefetch_failure(self, factory):
+        """Failed prefetches should abort their pages and retry the window."""
+        profile = process(factory, [
+            [greet('bob', f'hi{index}', 0) for index in range(5)],
+        ])
+        shutdown = threading.Event()
+        investigator = Investigator(
+            profile=profile, collector=FailingCollector(
+                seconds=10, delay=0, page_size=2,
+            ), analyzer=PassAnalyzer(), session_factory=factory,
+            queue=Queue(), shutdown=shutdown, block=False,
+        )
+        investigator.setup()
+        investigator._prefetched = Queue()
+        prefetcher = threading.Thread(target=investigator._prefetch)
+        prefetcher.start()
+        pages = []
+        try:
+            while not pages or pages[-1][1:] != (None, False):
+                investigation, anomalies, aborted = (
+                    investigator._prefetched.get(timeout=10)
+                )
+                pages.append((
+                    investigation.id,
+                    None if anomalies is None
+                    else list(anomalies['event_id'].unique()),
+                    aborted,
+                ))
+        finally:
+            shutdown.set()
+            prefetcher.join()
+            investigator.teardown()
+        (first, *_), (second, *_) = pages[0], pages[-1]
+        assert pages == [
+            (first, [1, 2], False), (first, None, True),
+            (second, [1, 2], False), (second, [3, 4], False),
+            (second, [5], False), (second, None, False),
+        ]
+        with db.managed_session(factory) as session:
+            investigations = session.query(db.Investigation.id)
+            assert [row.id for row in investigations] == [second]
+
+    def test_discard_aborted(self, factory, profile):
+        """Aborted pages should not be merged into the next investigation."""
+        investigator = Investigator(
+            profile=profile, collector=TimeRangeCollector(
+                seconds=10, delay=0,
+            ), analyzer=PassAnalyzer(), session_factory=factory,
+            queue=Queue(), shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            first = db.Investigation(id=1)
+            second = db.Investigation(
+                id=2, window_end=START, group=investigator._group,
+            )
+            anomalies = pa.DataFrame({'event_id': [1]})
+            investigator._prefetched = Queue()
+            for page in [
+                PrefetchedPage(first, anomalies),
+                PrefetchedPage(first, None, aborted=True),
+                PrefetchedPage(second, anomalies.assign(event_id=2)),
+                PrefetchedPage(second, None),
+            ]:
+                investigator._prefetched.put(page)
+            assert investigator._investigate_prefetched() is None
+            investigation, anomalies = investigator._investigate_prefetched()
+            assert investigation is second
+            assert list(anomalies['event_id']) == [2]
+        finally:
+            investigator.teardown()
+
+    def test_stale_investigator(self, factory):
+        """Investigations of crashed investigators should be taken back."""
+        profile = process(factory, [
+            [greet('bob', f'hi{index}', 0) for index in range(3)],
+            [greet('bob', 'hey', 20)],
+        ])
+        collector = TimeRangeCollector(seconds=10, delay=0)
+        assert analyze_windows(factory, profile, collector) == [
+            [1, 2, 3], [4],
+        ]
+        heartbeat_at = datetime.now(timezone.utc) - timedelta(
+            seconds=HEARTBEAT_TIMEOUT + 1,
+        )
+        with db.managed_session(factory) as session:
+            crashed = db.Investigator(
+                id=uuid.uuid4(), profile_id=profile.model.id,
+                heartbeat_at=heartbeat_at,
+            )
+            session.add(crashed)
+            session.flush()
+            first, second = session.query(db.Investigation).order_by(
+                db.Investigation.index,
+            ).all()
+            # Crashed after assigning the first window and while assigning
+            # the second one.
+            first.completed_at = None
+            first.created_by = crashed.id
+            second.completed_at = None
+            second.is_assigned = False
+            second.created_by = crashed.id
+            session.execute(db.InvestigationEvent.delete().where(
+                db.InvestigationEvent.c.investigation_id == second.id,
+            ))
+        assert analyze_windows(factory, profile, collector) == [
+            [1, 2, 3], [4],
+        ]
+        with db.managed_session(factory) as session:
+            assert not session.query(db.Investigator).count()
+            investigations = session.query(db.Investigation).filter(
+                db.Investigation.completed_at.isnot(None),
+            )
+            assert investigations.count() == 2
+
+    def test_step_failure(self, factory, profile):
+        """Steps should recover from a transient collector error."""
+        queue = Queue()
+        investigator = Investigator(
+            profile=profile, collector=FailingCollector(
+                page=0, seconds=10, delay=0,
+            ), analyzer=PassAnalyzer(), session_factory=factory,
+            queue=queue, shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            with pytest.raises(RuntimeError):
+                investigator.step()
+            assert [investigator.step() for _ in range(3)] == [
+                True, True, False,
+            ]
+        finally:
+            investigator.teardown()
+        analyzed = []
+        while not queue.empty():
+            _, _, (_, anomalies) = queue.get_nowait()
+            analyzed.append(sorted(anomalies['event_id'].unique()))
+        assert analyzed == [[1, 2], [3]]
+        with db.managed_session(factory) as session:
+            assert session.query(db.Investigation).filter(
+                db.Investigation.completed_at.is_(None),
+            ).count() == 0
+
+    def test_discard_failed(self, factory, profile):
+        """Pages of a failed prefetched investigation should be discarded."""
+        collector = TimeRangeCollector(seconds=10, delay=0)
+        assert analyze_windows(factory, profile, collector) == [[1, 2], [3]]
+        investigator = Investigator(
+            profile=profile, collector=collector, analyzer=PassAnalyzer(),
+            session_factory=factory, queue=Queue(),
+            shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            with db.managed_session(
+                factory, expire_on_commit=False,
+            ) as session:
+                first, second = session.query(db.Investigation).order_by(
+                    db.Investigation.index,
+                ).all()
+            anomalies = pa.DataFrame({'event_id': [1]})
+            investigator._prefetched = Queue()
+            investigator._investigation = first
+            investigator._abandon_current()
+            for page in [
+                PrefetchedPage(first, anomalies),
+                PrefetchedPage(first, None),
+                PrefetchedPage(second, anomalies.assign(event_id=3)),
+                PrefetchedPage(second, None),
+            ]:
+                investigator._prefetched.put(page)
+            investigation, anomalies = investigator._investigate_prefetched()
+            assert investigation is second
+            assert list(anomalies['event_id']) == [3]
+            assert investigator._discarded is None
+        finally:
+            investigator.teardown()
+        with db.managed_session(factory) as session:
+            first = session.query(db.Investigation).get(first.id)
+            assert first.created_by is None
+
+    def test_listen(self, factory, profile):
+        """Waiting for events should fall back to polling without LISTEN."""
+        shutdown = threading.Event()
+        collector = TimeRangeCollector(
+            session_factory=factory, shutdown=shutdown, block=False,
+        )
+        collector._listen(profile.model)
+        assert collector._listener is None
+        collector.block = True
+        collector._listen(profile.model)
+        assert collector._listener is not None
+        assert not collector._listener.listen()
+        assert not collector._wait_for_events(.01)
+        shutdown.set()
+        assert collector._wait_for_events(.01)
+        collector.close()
+        assert collector._listener is None
+
+    def test_previous_without_blocking(self, factory, profile):
+        """Investigators that don't block should never start listening."""
+        investigator = Investigator(
+            profile=profile, collector=TimeRangeCollector(),
+            analyzer=PassAnalyzer(), session_factory=factory,
+            queue=Queue(), shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            with db.managed_session(factory) as session:
+                session.add(db.Investigation(
+                    group_id=investigator._group.id,
+                    created_by=investigator._model.id,
+                ))
+
+            def listen():
+                raise AssertionError("Listened without blocking")
+
+            investigator._listener.listen = listen
+            previous = investigator._get_previous_investigation()
+            assert not previous.is_assigned
+        finally:
+            investigator.teardown()
+
+    def test_partitions(self, factory):
+        """Partitions should only investigate actors of their partition."""
+        profile = process(factory, [[
+            greet(person, greeting, seconds)
+            for seconds, person in enumerate(['bob', 'alice', 'carol'])
+            for greeting in ['hi', 'yo']
+        ]])
+        with db.managed_session(factory) as session:
+            actors = dict(session.query(db.Event.id, db.Event.actor_id))
+        assert len(set(actors.values())) == 3
+        analyzed = []
+        for index in range(2):
+            events, = analyze_windows(
+                factory, profile, TimeRangeCollector(seconds=10, delay=0),
+                partition=(index, 2),
+            )
+            assert {actors[event] % 2 for event in events} == {index}
+            analyzed.extend(events)
+        assert sorted(analyzed) == sorted(actors)
+
+    def test_new_partitions(self, factory):
+        """New partition groups should continue from the previous groups."""
+        first, second = GREETINGS
+        profile = process(factory, [first])
+        collector = TimeRangeCollector(seconds=5, delay=0)
+        assert analyze_windows(factory, profile, collector) == [[1, 2]]
+        assert analyze_windows(
+            factory, profile, collector, partition=(1, 2),
+        ) == []
+        profile = process(factory, [second])
+        assert analyze_windows(
+            factory, profile, collector, partition=(1, 2),
+        ) == [[3]]
+        assert analyze_windows(
+            factory, profile, collector, partition=(0, 2),
+        ) == []
+        assert analyze_windows(
+            factory, profile, collector, partition=(1, 3),
+        ) == []
+
+    def test_assign_late_event(self, factory, profile):
+        """Events committed after a page was fetched should not be assigned.
+
+        The late event gets an ID below the page's largest ID, like an
+        event of a transaction that started before the page was fetched.
+        """
+        with db.managed_session(factory) as session:
+            event = session.query(db.Event.__table__).filter(
+                db.Event.id == 2,
+            ).one()
+            anomalies = session.query(db.Anomaly.__table__).filter(
+                db.Anomaly.event_id == 2,
+            ).all()
+            session.query(db.Event).filter(db.Event.id == 2).delete()
+        queue = Queue()
+        collector = LateCollector(
+            [(event._asdict(), [row._asdict() for row in anomalies])],
+            seconds=20, delay=0,
+        )
+        investigator = Investigator(
+            profile=profile, collector=collector, analyzer=PassAnalyzer(),
+            session_factory=factory, queue=queue,
+            shutdown=threading.Event(), block=False,
+        )
+        investigator.setup()
+        try:
+            investigator.step()
+        finally:
+            investigator.teardown()
+        _, _, (_, analyzed) = queue.get_nowait()
+        assert sorted(collector.claimed) == [1, 3]
+        with db.managed_session(factory) as session:
+            assigned = session.query(db.InvestigationEvent.c.event_id)
+            assert sorted(row.event_id for row in assigned) == sorted(
+                analyzed['event_id'].unique(),
+            )
+            assert session.query(db.Event).get(2) is not None
+
+    def test_assign_created_at(self, factory, profile):
+        """Assigned events should be placed at the time of their event."""
+        with db.managed_session(factory) as session:
+            group = db.InvestigationGroup(profile_id=profile.model.id)
+            investigation = db.Investigation(group=group)
+            session.add(investigation)
+            session.flush()
+            events = session.query(
+                db.Event.id.label('event_id'),
+                db.Event.created_at.label('created_at'),
+            ).all()
+            anomalies = pa.DataFrame(
+                events, columns=['event_id', 'created_at'],
+            )
+            anomalies['created_at'] = pa.to_datetime(anomalies['created_at'])
+            assert sorted(
+                Collector().assign(session, investigation, anomalies),
+            ) == [1, 2, 3]
+            assigned = session.query(
+                db.InvestigationEvent.c.event_id,
+                db.InvestigationEvent.c.created_at,
+            )
+            assert sorted(assigned.all()) == sorted(events)
+
+    def test_hash_collision(self, factory, profile):
+        """Values colliding with another value should not add to its count."""
+        with db.managed_session(factory) as session:
+            feature = session.query(db.Feature).filter(
+                db.Feature.value == '"hi"',
+            ).one()
+            get_storage(session).add_counts(
+                session, db.Feature.__table__, [{
+                    'field_id': feature.field_id,
+                    'actor_id': feature.actor_id,
+                    'value': '"collision"',
+                    'value_hash': feature.value_hash,
+                    'count': 5,
+                }], index_elements=[
+                    db.Feature.field_id, db.Feature.actor_id,
+                    db.Feature.value_hash,
+                ], count=db.Feature.count, verify=[db.Feature.value],
+            )
+            features = session.query(db.Feature.value, db.Feature.count)
+            assert dict(features.all()) == {'"hi"': 3, '"yo"': 1, '"hey"': 1}
+
+    def test_feature_deltas(self, factory):
+        """Feature deltas should be counted before and after compacting."""
+        process(factory, feature_deltas=True, compact_interval=3600)
+        with db.managed_session(factory) as session:
+            features = session.query(db.Feature.value, db.feature_count())
+            assert dict(features.all()) == {'"hi"': 3, '"yo"': 1, '"hey"': 1}
+            features = session.query(db.Feature.value, db.Feature.count)
+            assert dict(features.all()) == {'"hi"': 2, '"yo"': 1, '"hey"': 0}
+            assert session.query(db.FeatureDelta).count() == 2
+            assert db.compact_features(session, limit=1) == 1
+            assert db.compact_features(session) == 1
+            assert db.compact_features(session) == 0
+            features = session.query(db.Feature.value, db.Feature.count)
+            assert dict(features.all()) == {'"hi"': 3, '"yo"': 1, '"hey"': 1}
+
+
+class LateCollector(TimeRangeCollector):
+    """Commits a late event between fetching and assigning the first page."""
+
+    def __init__(self, late, **kwargs):
+        super().__init__(**kwargs)
+        self.late = late
+
+    def assign(self, session, investigation, anomalies):
+        if self.late:
+            event, anomaly_rows = self.late.pop()
+            session.execute(db.Event.__table__.insert(), event)
+            session.execute(db.Anomaly.__table__.insert(), anomaly_rows)
+        self.claimed = super().assign(session, investigation, anomalies)
+        return self.claimed
+
+
+class FailingCollector(TimeRangeCollector):
+    """Fails assigning the given page of the first investigation once."""
+
+    def __init__(self, page=1, **kwargs):
+        super().__init__(**kwargs)
+        self.page = page
+
+    def assign(self, session, investigation, anomalies):
+        if self.page is not None:
+            if not self.page:
+                self.page = None
+                raise RuntimeError('assign failed')
+            self.page -= 1
+        return super().assign(session, investigation, anomalies)
+
+
+class StaleReplica(db.Replica):
+    def lag(self) -> float:
+        return 30.0
+
+
+@pytest.fixture
+def replica_factory(tmp_path):
+    engine = db.create_sqlite_engine(str(tmp_path / 'replica.db'))
+    migrate(engine)
+    return db.create_session_factory(engine)
+
+
+def investigate(factory, profile, replica):
+    investigator = Investigator(
+        profile=profile, collector=TimeRangeCollector(seconds=10, delay=5),
+        analyzer=PassAnalyzer(), session_factory=factory, replica=replica,
+        queue=Queue(), shutdown=threading.Event(), block=False,
+    )
+    investigator.setup()
+    try:
+        while investigator.step():
+            pass
+    finally:
+        investigator.teardown()
+    with db.managed_session(factory) as session:
+        assigned = session.query(db.InvestigationEvent.c.event_id)
+        return sorted(row.event_id for row in assigned)
+
+
+class TestReplica:
+    def test_route(self, factory, replica_factory):
+        """Reads should only go to a replica within the tolerated lag."""
+        replica = db.Replica(factory, replica_factory)
+        assert replica.lag() == 0.0
+        assert replica.route() is replica_factory
+        stale = StaleReplica(factory, replica_factory)
+        assert stale.route(60.0) is replica_factory
+        assert stale.route(5.0) is factory
+
+    def test_total_delay(self, factory, replica_factory):
+        """Replica lag should add to the delay windows are collected after."""
+        collector = TimeRangeCollector(delay=5, max_lag=10)
+        assert collector.total_delay == 5
+        collector.replica = db.Replica(factory, replica_factory)
+        assert collector.total_delay == 15
+
+    def test_collect_from_replica(self, factory, replica_factory, profile):
+        """Collectors should read events from a fresh replica."""
+        replica = db.Replica(factory, replica_factory)
+        assert investigate(factory, profile, replica) == []
+
+    def test_collect_from_stale_replica(
+        self, factory, replica_factory, profile,
+    ):
+        """Collectors should read from the primary when the replica lags."""
+        replica = StaleReplica(factory, replica_factory)
+        assert investigate(factory, profile, replica) == [1, 2, 3]
+
+    def test_parse_replica(self, tmp_path, factory):
+        """Replica settings should fall back to the primary settings."""
+        config = Config({
+            'driver': 'sqlite',
+            'path': str(tmp_path / 'scrywarden.db'),
+            'replica': {'path': str(tmp_path / 'replica.db')},
+        }, key=('database',))
+        replica = db.parse_replica(config, factory)
+        engine = replica.replica.kw['bind']
+        assert engine.dialect.name == 'sqlite'
+        assert engine.url.database == str(tmp_path / 'replica.db')
+        assert db.parse_replica(Config({}), factory) is None
+
+    def test_pickle_analyzer(self, factory, replica_factory):
+        """Analyzers sent to processes should leave their sessions behind."""
+        analyzer = PassAnalyzer(factory, db.Replica(factory, replica_factory))
+        copy = pickle.loads(pickle.dumps(analyzer))
+        assert copy.session_factory is None
+        assert copy.replica is None
+        assert analyzer.replica is not None